@@ -1,14 +1,16 @@
 import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-from operations.routing import websocket_urlpatterns
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'field_ops_system.settings')
+django_asgi_app = get_asgi_application()
+
+from operations.authentication import TokenAuthMiddleware
+from operations.routing import websocket_urlpatterns
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "http": django_asgi_app,
+    "websocket": TokenAuthMiddleware(
         URLRouter(
             websocket_urlpatterns
         )
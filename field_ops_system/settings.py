@@ -37,6 +37,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'operations.metrics.MetricsMiddleware',
+    'operations.profiling.QueryBudgetMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -44,6 +46,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'operations.replicas.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,16 +84,78 @@ DATABASES = {
     }
 }
 
+# Read replicas of the primary for dashboards, reports and exports (see operations/replicas.py),
+# e.g. DATABASE_REPLICA_HOSTS=replica-a:5432,replica-b; same database name and credentials as default
+DATABASE_REPLICA_HOSTS = config(
+    'DATABASE_REPLICA_HOSTS',
+    default='',
+    cast=lambda value: [host.strip() for host in value.split(',') if host.strip()]
+)
+REPLICA_DATABASES = []
+for number, replica_host in enumerate(DATABASE_REPLICA_HOSTS):
+    host, _, port = replica_host.partition(':')
+    alias = f'replica_{number}'
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host, PORT=port or DATABASES['default']['PORT'], TEST={'MIRROR': 'default'})
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['operations.replicas.ReplicaRouter']
+REPLICA_STICKY_SECONDS = 10  # seconds a user reads from the primary after writing (covers replication lag)
+
 # Channel layers configuration for Django Channels
+# Several comma-separated Redis URLs shard channels and groups across hosts,
+# e.g. CHANNEL_REDIS_HOSTS=redis://redis-a:6379,redis://redis-b:6379
+CHANNEL_REDIS_HOSTS = config(
+    'CHANNEL_REDIS_HOSTS',
+    default='redis://127.0.0.1:6379',
+    cast=lambda value: [host.strip() for host in value.split(',') if host.strip()]
+)
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
-            'hosts': [('127.0.0.1', 6379)],
+            'hosts': CHANNEL_REDIS_HOSTS,
+            'capacity': config('CHANNEL_LAYER_CAPACITY', default=1000, cast=int),
+            'group_expiry': 86400,
         },
     },
 }
 
+# CHANNEL_LAYER=memory swaps in the in-process layer for single-worker local runs
+# (e.g. the loadtest_websockets command against one Daphne process)
+if config('CHANNEL_LAYER', default='redis') == 'memory':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Redis used for shared process state (presence tracking)
+REDIS_URL = config('REDIS_URL', default='redis://127.0.0.1:6379/1')
+
+# Shared cache (cached counts, map tiles, ...)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('CACHE_REDIS_URL', default='redis://127.0.0.1:6379/2'),
+    },
+}
+
+# Large-table pagination (see operations/pagination.py)
+ESTIMATED_COUNT_THRESHOLD = 100000  # above this many rows, planner estimates replace COUNT(*)
+COUNT_CACHE_TIMEOUT = 60  # seconds an exact per-filter count is cached
+
+# Presence tracking of connected agents (see operations/presence.py)
+PRESENCE_ENABLED = config('PRESENCE_ENABLED', default=True, cast=bool)
+PRESENCE_TTL = 90  # seconds without a heartbeat before an agent is offline (3 missed pings)
+
+# Agent event log used to replay missed WebSocket messages after a reconnect
+AGENT_EVENT_RETENTION = 200  # events kept per agent
+AGENT_EVENT_REPLAY_LIMIT = 100  # max events sent in one replay batch
+
+# Transactional outbox for assignment events (see operations/outbox.py)
+OUTBOX_BATCH_SIZE = 100  # events published per relay transaction
+
 # Custom User Model
 AUTH_USER_MODEL = 'operations.User'
 
@@ -140,10 +205,19 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'operations.authentication.SignedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
+    'DEFAULT_THROTTLE_RATES': {
+        'token': config('AUTH_TOKEN_RATE', default='10/minute'),  # anonymous token requests per IP
+    },
 }
 
+# Signed API tokens for the mobile app (see operations/authentication.py)
+AUTH_TOKEN_MAX_AGE = config('AUTH_TOKEN_MAX_AGE', default=7 * 24 * 3600, cast=int)  # seconds
+AUTH_USER_CACHE_TTL = 60  # seconds a token user is served from memory before reloading
+AUTH_USER_CACHE_SIZE = 10000  # users cached per process
+
 # Leaflet configuration
 LEAFLET_CONFIG = {
     'DEFAULT_CENTER': (12.9716, 77.5946),  # Bangalore coordinates
@@ -157,6 +231,7 @@ LEAFLET_CONFIG = {
 
 # OpenRouteService API Key (Get free key from https://openrouteservice.org)
 OPENROUTESERVICE_API_KEY = 'your_openrouteservice_api_key_here'
+OPENROUTESERVICE_URL = 'https://api.openrouteservice.org/v2/directions/driving-car'
 
 # Firebase Cloud Messaging settings
 FCM_DJANGO_SETTINGS = {
@@ -178,6 +253,101 @@ SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
 X_FRAME_OPTIONS = 'DENY'
 
+# Automatic dispatch of queued clients to free agents (see operations/dispatch.py)
+DISPATCH_ENABLED = config('DISPATCH_ENABLED', default=True, cast=bool)
+DISPATCH_BATCH_WINDOW = 0.25  # seconds to collect "agent free" reports before deciding
+DISPATCH_QUEUE_REFRESH = 30  # seconds between reloads of the unassigned-client queue
+DISPATCH_WEIGHTS = {
+    'priority': 10.0,
+    'wait_hours': 2.0,
+    'distance_km': 1.0,
+}
+
+# Assignment duration estimates (see operations/eta.py; fit with the train_eta command)
+ETA_MODEL_PATH = BASE_DIR / 'eta_model.json'
+ETA_AREA_CELL_DEGREES = 0.05  # ~5 km grid cells for the per-area factor
+
+# Settings overridable at runtime from the SystemSettings table (see operations/live_settings.py)
+LIVE_SETTINGS_REFRESH = 300  # seconds between full reloads, in case a change notification was missed
+LIVE_SETTINGS_CHANNEL = 'live_settings:changed'  # Redis pub/sub channel for change notifications
+LOCATION_BROADCAST_INTERVAL = 0  # minimum seconds between location broadcasts per agent connection
+
+# Adaptive location ping rate (see operations/ping_rate.py); tunable live via SystemSettings
+PING_RATE_ADAPTIVE = config('PING_RATE_ADAPTIVE', default=True, cast=bool)
+PING_RATE_POLICY = {  # seconds between location updates per agent state
+    'idle': 120,
+    'en_route': 15,
+    'near': 5,
+    'on_site': 60,
+}
+PING_RATE_NEAR_METERS = 1000  # distance to the client at which 'en_route' becomes 'near'
+PING_RATE_TARGET_PER_SECOND = 200  # location messages per worker before intervals back off
+PING_RATE_MAX_BACKOFF = 4  # at most this many times the normal interval under load
+
+# Workload balancing (see operations/workload.py)
+WORKLOAD_REFRESH = 60  # seconds between reloads of today's booked work
+WORKLOAD_TRAVEL_SPEED_KMH = 25  # average travel speed used to turn distance into time
+WORKLOAD_DEFAULT_DURATION_MINUTES = 30  # assumed on-site time when there is no estimate
+WORKLOAD_DAILY_CAPACITY_HOURS = 10  # auto and bulk assign skip agents booked beyond this
+
+# Territories (see operations/territories.py; built with the build_territories command)
+TERRITORIES_ENABLED = config('TERRITORIES_ENABLED', default=True, cast=bool)
+TERRITORY_CACHE_TIMEOUT = 300  # seconds between reloads of zone centers and neighbours
+
+# Map marker clustering (see operations/maps.py)
+MAP_CLUSTER_CELLS_PER_TILE = 4  # grid cells per 256px tile edge (~64px clusters)
+MAP_TILE_CACHE_TIMEOUT = 60  # seconds a rendered vector tile is cached
+
+# Location analytics rollups (see operations/analytics.py; run rollup_locations hourly)
+ANALYTICS_CELL_DEGREES = 0.005  # ~500 m grid cells
+ANALYTICS_MAX_GAP_SECONDS = 300  # longest gap between samples counted as time spent in a cell
+ANALYTICS_LOOKBACK_HOURS = 1  # hours re-rolled each run to pick up late points
+ANALYTICS_CLIENT_CELLS_TIMEOUT = 300  # seconds client counts per cell are cached
+
+# Mileage (see operations/mileage.py)
+MILEAGE_MIN_STEP_METERS = 15  # shorter moves (or moves within GPS accuracy) are jitter
+MILEAGE_MAX_SPEED_KMH = 150  # moves implying a higher speed are GPS glitches
+
+# Batched location uploads (see operations/ingest.py)
+LOCATION_BATCH_MAX_POINTS = 1000
+LOCATION_BATCH_MAX_AGE_HOURS = 72  # older queued points are rejected
+
+# Live anomaly alerts (see operations/anomalies.py)
+ANOMALY_DETECTION_ENABLED = config('ANOMALY_DETECTION_ENABLED', default=True, cast=bool)
+ANOMALY_MAX_SPEED_KMH = 200  # faster jumps are reported as impossible movement
+ANOMALY_MIN_JUMP_KM = 0.5  # ignore short jumps when checking speed
+ANOMALY_STOP_MINUTES = 20  # stationary this long while heading to a client is a long stop
+ANOMALY_STOP_RADIUS_METERS = 100
+ANOMALY_ONSITE_RADIUS_METERS = 300  # within this of the client counts as on site
+ANOMALY_DETOUR_KM = 3  # detour over the straight-line route before alerting...
+ANOMALY_DETOUR_RATIO = 0.5  # ...or this fraction of the direct distance, whichever is larger
+ANOMALY_ALERT_COOLDOWN = 900  # seconds between alerts of one kind for one agent
+ANOMALY_MANAGER_CACHE = 300  # seconds between reloads of the managers alerts are logged for
+
+# Metrics (see operations/metrics.py); scraped from /metrics
+METRICS_ENABLED = config('METRICS_ENABLED', default=False, cast=bool)
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Query budgets per view name / consumer call (see operations/profiling.py)
+QUERY_BUDGET_ENABLED = config('QUERY_BUDGET_ENABLED', default=DEBUG, cast=bool)
+QUERY_BUDGET_RAISE = config('QUERY_BUDGET_RAISE', default=False, cast=bool)  # fail instead of warn, for tests
+QUERY_BUDGETS = {
+    'default': {'queries': 20, 'query_ms': 200},
+    'manager_dashboard': {'queries': 15},
+    'update_agent_location': {'queries': 8},
+    'agent.update_agent_location': {'queries': 4},
+    'update_agent_location_batch': {'queries': 11},
+    'agent.store_location_batch': {'queries': 8},
+    'agent.load_session_state': {'queries': 2},
+    'manager.create_assignment': {'queries': 8},
+}
+
+# Sampled profiling of slow requests
+PROFILE_SAMPLE_RATE = config('PROFILE_SAMPLE_RATE', default=0.0, cast=float)  # fraction of requests profiled
+PROFILE_THRESHOLD_MS = 500  # only profiles slower than this are kept
+PROFILE_DIR = BASE_DIR / 'profiles'
+PROFILER = config('PROFILER', default='cprofile')  # or 'pyinstrument' if installed
+
 # Logging configuration
 LOGGING = {
     'version': 1,
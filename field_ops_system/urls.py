@@ -2,9 +2,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from operations.views import metrics_endpoint
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_endpoint, name='metrics'),
     path('', include('operations.urls')),
     path('api/', include('operations.urls')),
 ]
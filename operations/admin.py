@@ -1,12 +1,16 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.gis.admin import OSMGeoAdmin
+from django.db.models import Count, OuterRef, Subquery
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 from import_export.admin import ImportExportModelAdmin
 from import_export import resources
-from .models import User, Client, Assignment, LocationHistory, NotificationLog, SystemSettings
+from .models import User, Client, Assignment, LocationHistory, NotificationLog, SystemSettings, Territory
+from .events import invalidate_agent_state
+from .pagination import EstimatedCountPaginator
+from .replicas import ReplicaReadAdminMixin
 
 # Custom User Admin
 class UserAdmin(BaseUserAdmin):
@@ -41,7 +45,7 @@ class ClientResource(resources.ModelResource):
         export_order = fields
 
 # Client Admin with Map
-class ClientAdmin(ImportExportModelAdmin, OSMGeoAdmin):
+class ClientAdmin(ReplicaReadAdminMixin, ImportExportModelAdmin, OSMGeoAdmin):
     resource_class = ClientResource
     list_display = ('name', 'phone', 'priority', 'address_short', 'current_assignment_status', 'is_active', 'created_at')
     list_filter = ('priority', 'is_active', 'created_at')
@@ -73,22 +77,31 @@ class ClientAdmin(ImportExportModelAdmin, OSMGeoAdmin):
         return obj.address[:50] + "..." if len(obj.address) > 50 else obj.address
     address_short.short_description = "Address"
 
+    def get_queryset(self, request):
+        # Annotate the active assignment status so the changelist needs no per-row query
+        active_status = Assignment.objects.filter(
+            client=OuterRef('pk'),
+            status__in=['assigned', 'in_progress']
+        ).order_by('-assigned_at').values('status')[:1]
+        return super().get_queryset(request).annotate(active_assignment_status=Subquery(active_status))
+
     def current_assignment_status(self, obj):
-        assignment = obj.current_assignment
-        if assignment:
+        assignment_status = obj.active_assignment_status
+        if assignment_status:
             color = {
                 'assigned': 'orange',
                 'in_progress': 'blue', 
                 'completed': 'green',
                 'cancelled': 'red'
-            }.get(assignment.status, 'gray')
+            }.get(assignment_status, 'gray')
             return format_html(
                 '<span style="color: {};">{}</span>',
                 color,
-                assignment.get_status_display()
+                dict(Assignment.STATUS_CHOICES).get(assignment_status, assignment_status)
             )
         return "Not assigned"
     current_assignment_status.short_description = "Assignment Status"
+    current_assignment_status.admin_order_field = 'active_assignment_status'
 
     def current_assignment_link(self, obj):
         assignment = obj.current_assignment
@@ -99,10 +112,12 @@ class ClientAdmin(ImportExportModelAdmin, OSMGeoAdmin):
     current_assignment_link.short_description = "Current Assignment"
 
 # Assignment Admin
-class AssignmentAdmin(admin.ModelAdmin):
+class AssignmentAdmin(ReplicaReadAdminMixin, admin.ModelAdmin):
     list_display = ('agent', 'client', 'status', 'priority_display', 'distance_display', 'assigned_at', 'completed_at')
-    list_filter = ('status', 'assigned_at', 'agent', 'client__priority')
+    list_filter = ('status', 'assigned_at', 'client__priority')
+    list_select_related = ('agent', 'client')
     search_fields = ('agent__username', 'client__name', 'client__phone')
+    autocomplete_fields = ('agent', 'client')
     readonly_fields = ('assigned_at', 'distance_to_client', 'actual_duration', 'created_by')
     ordering = ('-assigned_at',)
     date_hierarchy = 'assigned_at'
@@ -123,6 +138,7 @@ class AssignmentAdmin(admin.ModelAdmin):
     def priority_display(self, obj):
         return obj.client.get_priority_display()
     priority_display.short_description = "Client Priority"
+    priority_display.admin_order_field = 'client__priority'
 
     def distance_display(self, obj):
         if obj.distance_to_client:
@@ -134,15 +150,19 @@ class AssignmentAdmin(admin.ModelAdmin):
         if not change:  # New assignment
             obj.created_by = request.user
         super().save_model(request, obj, form, change)
+        invalidate_agent_state(obj.agent_id)
 
 # Location History Admin
-class LocationHistoryAdmin(admin.ModelAdmin):
+class LocationHistoryAdmin(ReplicaReadAdminMixin, admin.ModelAdmin):
     list_display = ('agent', 'location_display', 'timestamp', 'accuracy', 'assignment')
-    list_filter = ('agent', 'timestamp')
+    list_filter = ('timestamp',)
+    list_select_related = ('agent', 'assignment__agent', 'assignment__client')
     search_fields = ('agent__username',)
+    # Tens of millions of rows: use planner estimates rather than COUNT(*)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     readonly_fields = ('timestamp',)
     ordering = ('-timestamp',)
-    date_hierarchy = 'timestamp'
 
     def location_display(self, obj):
         return f"({obj.location.y:.4f}, {obj.location.x:.4f})"
@@ -155,10 +175,14 @@ class LocationHistoryAdmin(admin.ModelAdmin):
         return False  # Don't allow editing
 
 # Notification Log Admin
-class NotificationLogAdmin(admin.ModelAdmin):
+class NotificationLogAdmin(ReplicaReadAdminMixin, admin.ModelAdmin):
     list_display = ('recipient', 'notification_type', 'title', 'is_read', 'created_at')
     list_filter = ('notification_type', 'is_read', 'created_at')
+    list_select_related = ('recipient',)
     search_fields = ('recipient__username', 'title', 'message')
+    autocomplete_fields = ('recipient', 'assignment')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     readonly_fields = ('created_at', 'read_at')
     ordering = ('-created_at',)
     date_hierarchy = 'created_at'
@@ -179,6 +203,21 @@ class NotificationLogAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         return False  # Don't allow manual creation
 
+# Territory Admin
+class TerritoryAdmin(OSMGeoAdmin):
+    list_display = ('name', 'client_count', 'neighbour_count', 'created_at')
+    search_fields = ('name',)
+    readonly_fields = ('client_count', 'created_at')
+    filter_horizontal = ('neighbours',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(neighbour_total=Count('neighbours'))
+
+    def neighbour_count(self, obj):
+        return obj.neighbour_total
+    neighbour_count.short_description = "Neighbours"
+    neighbour_count.admin_order_field = 'neighbour_total'
+
 # System Settings Admin
 class SystemSettingsAdmin(admin.ModelAdmin):
     list_display = ('key', 'value_short', 'description_short', 'updated_at')
@@ -202,6 +241,7 @@ admin.site.register(Assignment, AssignmentAdmin)
 admin.site.register(LocationHistory, LocationHistoryAdmin)
 admin.site.register(NotificationLog, NotificationLogAdmin)
 admin.site.register(SystemSettings, SystemSettingsAdmin)
+admin.site.register(Territory, TerritoryAdmin)
 
 # Customize admin site
 admin.site.site_header = "Field Operations Management"
@@ -220,7 +260,11 @@ def mark_clients_active(modeladmin, request, queryset):
 mark_clients_active.short_description = "Mark selected clients as active"
 
 def cancel_assignments(modeladmin, request, queryset):
-    updated = queryset.filter(status__in=['assigned', 'in_progress']).update(status='cancelled')
+    active = queryset.filter(status__in=['assigned', 'in_progress'])
+    agent_ids = set(active.values_list('agent_id', flat=True))
+    updated = active.update(status='cancelled')
+    for agent_id in agent_ids:
+        invalidate_agent_state(agent_id)
     modeladmin.message_user(request, f"{updated} assignments cancelled.")
 cancel_assignments.short_description = "Cancel selected assignments"
 
@@ -0,0 +1,298 @@
+"""
+Heatmap and coverage analytics from LocationHistory.
+
+Raw location history is far too large to aggregate per request, so the
+rollup_locations command bins it into LocationRollup rows: one per grid
+cell (ANALYTICS_CELL_DEGREES square) per hour, holding the number of
+samples, the distinct agents and the agent time spent there. Time is the
+gap to the agent's next sample, capped at ANALYTICS_MAX_GAP_SECONDS so
+signal loss is not counted as presence.
+
+Rollups are rebuilt one whole hour at a time, so runs are idempotent. Each
+run starts ANALYTICS_LOOKBACK_HOURS before the newest rolled-up hour to pick
+up late points and stops at the current (incomplete) hour. Batched uploads
+(see ingest.py) can carry points days old; they mark the hours they cover
+as dirty in Redis and the next run re-rolls those hours as well.
+"""
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+import numpy as np
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Min, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Client, LocationHistory, LocationRollup
+from .presence import get_client
+
+logger = logging.getLogger(__name__)
+
+# Hours of history binned per database round trip
+CHUNK_HOURS = 24
+
+# Redis set of UTC hours (epoch hours) that received late points since they were rolled up
+DIRTY_HOURS_KEY = 'analytics:dirty_hours'
+
+def cell_degrees():
+    return getattr(settings, 'ANALYTICS_CELL_DEGREES', 0.005)
+
+def cell_center(cell_x, cell_y, size):
+    """(lat, lng) of a cell's center"""
+    return (cell_y + 0.5) * size, (cell_x + 0.5) * size
+
+def floor_hour(value):
+    """Start of the UTC hour containing value (rollup hours are UTC)"""
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+def parse_range(start=None, end=None, default_days=7):
+    """ISO start/end strings -> aware datetimes (end defaults to now); raises ValueError"""
+    end = parse_datetime(end) if end else timezone.now()
+    start = parse_datetime(start) if start else end - timedelta(days=default_days)
+    if start is None or end is None:
+        raise ValueError('Invalid start or end')
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    if timezone.is_naive(end):
+        end = timezone.make_aware(end)
+    if start >= end:
+        raise ValueError('start must be before end')
+    return start, end
+
+def dwell_seconds(agent_index, timestamps, max_gap, continued=()):
+    """Gap from each sample (sorted by agent, then time) to the same agent's next one, capped.
+
+    The last sample of an agent in `continued` (indices of agents with a
+    later sample beyond the loaded range) gets the full max_gap.
+    """
+    gaps = np.zeros(len(timestamps))
+    if not len(timestamps):
+        return gaps
+    last = np.ones(len(timestamps), dtype=bool)
+    last[:-1] = agent_index[1:] != agent_index[:-1]
+    gaps[:-1] = np.where(last[:-1], 0, np.minimum(np.diff(timestamps), max_gap))
+    gaps[last & np.isin(agent_index, list(continued))] = max_gap
+    return gaps
+
+def bin_samples(agent_index, timestamps, lat, lng, size, gaps):
+    """Aggregate samples (sorted by agent, then time) and their dwell seconds into per hour/cell rollups.
+
+    Returns (hours, cell_x, cell_y, samples, seconds, agents) arrays.
+    """
+    hours = np.floor(timestamps / 3600).astype(np.int64)
+    cell_x = np.floor(lng / size).astype(np.int64)
+    cell_y = np.floor(lat / size).astype(np.int64)
+
+    keys = np.column_stack([hours, cell_x, cell_y])
+    groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    samples = np.bincount(inverse, minlength=len(groups))
+    seconds = np.bincount(inverse, weights=gaps, minlength=len(groups))
+
+    # Distinct agents per group
+    pairs = np.unique(np.column_stack([inverse, agent_index]), axis=0)
+    agents = np.bincount(pairs[:, 0], minlength=len(groups))
+
+    return groups[:, 0], groups[:, 1], groups[:, 2], samples, seconds, agents
+
+def load_samples(start, end):
+    """Location samples in [start, end) as (agent ids, arrays sorted by agent, then time)"""
+    rows = LocationHistory.objects.filter(timestamp__gte=start, timestamp__lt=end).order_by(
+        'agent_id', 'timestamp'
+    ).values_list('agent_id', 'timestamp', 'location')
+
+    agent_ids = {}
+    agent_index, timestamps, lat, lng = [], [], [], []
+    for agent_id, timestamp, location in rows.iterator(chunk_size=10000):
+        agent_index.append(agent_ids.setdefault(agent_id, len(agent_ids)))
+        timestamps.append(timestamp.timestamp())
+        lat.append(location.y)
+        lng.append(location.x)
+    return (
+        list(agent_ids),
+        np.array(agent_index, dtype=np.int64),
+        np.array(timestamps, dtype=float),
+        np.array(lat, dtype=float),
+        np.array(lng, dtype=float),
+    )
+
+def continued_agents(agent_ids, agent_index, timestamps, before, after):
+    """Indices of agents whose last loaded sample is before `before` and who have a sample at or after `after`"""
+    last = np.ones(len(timestamps), dtype=bool)
+    last[:-1] = agent_index[1:] != agent_index[:-1]
+    candidates = agent_index[last & (timestamps < before.timestamp())]
+    if not len(candidates):
+        return set()
+    later = LocationHistory.objects.filter(
+        agent_id__in=[agent_ids[i] for i in candidates], timestamp__gte=after
+    ).order_by().values_list('agent_id', flat=True).distinct()
+    index = {agent_id: i for i, agent_id in enumerate(agent_ids)}
+    return {index[agent_id] for agent_id in later}
+
+def rollup_range(start, end):
+    """Rebuild the rollups for whole hours in [start, end); returns rows written"""
+    size = cell_degrees()
+    max_gap = getattr(settings, 'ANALYTICS_MAX_GAP_SECONDS', 300)
+    written = 0
+
+    chunk_start, end = floor_hour(start), floor_hour(end)
+    while chunk_start < end:
+        chunk_end = min(chunk_start + timedelta(hours=CHUNK_HOURS), end)
+        # Samples up to max_gap past the chunk give the dwell time of the chunk's last ones,
+        # so a range rolls up to the same cells as one pass over a longer range
+        window_end = chunk_end + timedelta(seconds=max_gap)
+        agent_ids, agent_index, timestamps, lat, lng = load_samples(chunk_start, window_end)
+
+        rollups = []
+        inside = timestamps < chunk_end.timestamp()
+        if inside.any():
+            continued = continued_agents(agent_ids, agent_index, timestamps, chunk_end, window_end)
+            gaps = dwell_seconds(agent_index, timestamps, max_gap, continued)
+            hours, cell_x, cell_y, samples, seconds, agents = bin_samples(
+                agent_index[inside], timestamps[inside], lat[inside], lng[inside], size, gaps[inside]
+            )
+            for i in range(len(hours)):
+                rollups.append(LocationRollup(
+                    hour=datetime.fromtimestamp(int(hours[i]) * 3600, tz=dt_timezone.utc),
+                    cell_x=int(cell_x[i]),
+                    cell_y=int(cell_y[i]),
+                    samples=int(samples[i]),
+                    seconds=float(seconds[i]),
+                    agents=int(agents[i]),
+                ))
+
+        with transaction.atomic():
+            LocationRollup.objects.filter(hour__gte=chunk_start, hour__lt=chunk_end).delete()
+            LocationRollup.objects.bulk_create(rollups, batch_size=5000)
+        written += len(rollups)
+        chunk_start = chunk_end
+
+    return written
+
+def mark_dirty(first_timestamp, last_timestamp):
+    """Flag the hours spanned by late points (epoch seconds) for the next rollup run"""
+    # The sample before the first point, up to max_gap earlier, gets a new dwell time too
+    first_timestamp -= getattr(settings, 'ANALYTICS_MAX_GAP_SECONDS', 300)
+    mark_hours_dirty(range(int(first_timestamp // 3600), int(last_timestamp // 3600) + 1))
+
+def mark_hours_dirty(hours):
+    try:
+        get_client().sadd(DIRTY_HOURS_KEY, *hours)
+    except redis.RedisError as e:
+        logger.warning("Marking rollup hours dirty failed: %s", e)
+
+def rollup_dirty(before):
+    """Re-roll dirty hours earlier than `before`; returns rows written"""
+    # SPOP takes the hours atomically, so hours marked while this runs stay for the next run
+    try:
+        client = get_client()
+        count = client.scard(DIRTY_HOURS_KEY)
+        dirty = sorted(int(hour) for hour in client.spop(DIRTY_HOURS_KEY, count)) if count else []
+    except redis.RedisError as e:
+        logger.warning("Reading dirty rollup hours failed: %s", e)
+        return 0
+
+    # Hours at or after `before` are covered by the incremental range
+    limit = before.timestamp() // 3600
+    hours = [hour for hour in dirty if hour < limit]
+    written = 0
+    # Contiguous runs of hours become one range each
+    run_start = None
+    for i, hour in enumerate(hours):
+        if run_start is None:
+            run_start = hour
+        if i + 1 == len(hours) or hours[i + 1] != hour + 1:
+            try:
+                written += rollup_range(
+                    datetime.fromtimestamp(run_start * 3600, tz=dt_timezone.utc),
+                    datetime.fromtimestamp((hour + 1) * 3600, tz=dt_timezone.utc)
+                )
+            except Exception:
+                # Put back the hours not rolled up yet
+                mark_hours_dirty(hours[hours.index(run_start):])
+                raise
+            run_start = None
+    return written
+
+def rollup_pending(now=None):
+    """Incrementally roll up complete hours since the last run, plus dirty hours; returns rows written"""
+    end = floor_hour(now or timezone.now())
+    latest = LocationRollup.objects.aggregate(latest=Max('hour'))['latest']
+    if latest is not None:
+        start = latest - timedelta(hours=getattr(settings, 'ANALYTICS_LOOKBACK_HOURS', 1))
+    else:
+        start = LocationHistory.objects.aggregate(first=Min('timestamp'))['first']
+        if start is None:
+            return 0
+    return rollup_dirty(floor_hour(start)) + rollup_range(start, end)
+
+def heatmap(start, end, bbox=None):
+    """Summed rollups per cell over [start, end) as a list of dicts"""
+    size = cell_degrees()
+    rollups = LocationRollup.objects.filter(hour__gte=floor_hour(start), hour__lt=end)
+    if bbox:
+        west, south, east, north = bbox
+        rollups = rollups.filter(
+            cell_x__gte=int(np.floor(west / size)), cell_x__lte=int(np.floor(east / size)),
+            cell_y__gte=int(np.floor(south / size)), cell_y__lte=int(np.floor(north / size)),
+        )
+
+    cells = []
+    for row in rollups.order_by().values('cell_x', 'cell_y').annotate(
+        total_samples=Sum('samples'), total_seconds=Sum('seconds')
+    ):
+        lat, lng = cell_center(row['cell_x'], row['cell_y'], size)
+        cells.append({
+            'lat': lat,
+            'lng': lng,
+            'samples': row['total_samples'],
+            'seconds': round(row['total_seconds'], 1),
+        })
+    return cells
+
+def client_cells():
+    """Active client counts per cell as {(cell_x, cell_y): count}, cached briefly"""
+    size = cell_degrees()
+    key = f'analytics:client_cells:{size}'
+    counts = cache.get(key)
+    if counts is None:
+        locations = list(Client.objects.filter(is_active=True).values_list('location', flat=True))
+        lng = np.array([location.x for location in locations], dtype=float)
+        lat = np.array([location.y for location in locations], dtype=float)
+        cells, totals = np.unique(
+            np.column_stack([np.floor(lng / size), np.floor(lat / size)]).astype(np.int64),
+            axis=0, return_counts=True
+        )
+        counts = {(int(x), int(y)): int(n) for (x, y), n in zip(cells, totals)}
+        cache.set(key, counts, getattr(settings, 'ANALYTICS_CLIENT_CELLS_TIMEOUT', 300))
+    return counts
+
+def coverage_gaps(start, end, min_seconds=0, limit=100):
+    """Cells with clients but at most min_seconds of agent time over [start, end), most clients first"""
+    size = cell_degrees()
+    agent_time = {
+        (cell_x, cell_y): total
+        for cell_x, cell_y, total in LocationRollup.objects.filter(hour__gte=floor_hour(start), hour__lt=end)
+        .order_by().values('cell_x', 'cell_y').annotate(total=Sum('seconds'))
+        .values_list('cell_x', 'cell_y', 'total')
+    }
+
+    clients = client_cells()
+    gaps = []
+    for (cell_x, cell_y), count in clients.items():
+        seconds = agent_time.get((cell_x, cell_y), 0)
+        if seconds <= min_seconds:
+            lat, lng = cell_center(cell_x, cell_y, size)
+            gaps.append({'lat': lat, 'lng': lng, 'clients': count, 'seconds': round(seconds, 1)})
+    gaps.sort(key=lambda gap: -gap['clients'])
+
+    total_clients = sum(clients.values())
+    uncovered = sum(gap['clients'] for gap in gaps)
+    return {
+        'cell_degrees': size,
+        'client_cells': len(clients),
+        'gap_cells': len(gaps),
+        'covered_client_ratio': round(1 - uncovered / total_clients, 4) if total_clients else None,
+        'gaps': gaps[:limit],
+    }
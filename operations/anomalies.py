@@ -0,0 +1,201 @@
+"""
+Streaming anomaly detection on agent location pings.
+
+Each worker keeps a short sliding window of recent positions per agent in
+memory and checks every ping, without reading the database, for:
+
+- impossible_speed: a jump faster than ANOMALY_MAX_SPEED_KMH (GPS spoofing
+  or a broken device)
+- long_stop: no movement beyond ANOMALY_STOP_RADIUS_METERS for
+  ANOMALY_STOP_MINUTES while heading to a client
+- route_deviation: while heading to a client, a detour of more than
+  ANOMALY_DETOUR_KM over the straight line from where the agent was when the
+  assignment started to the client
+
+Alerts are written as NotificationLog rows for every manager and pushed to
+the managers group. Each kind is raised at most once per
+ANOMALY_ALERT_COOLDOWN seconds per agent.
+
+Windows live in the worker that receives the ping. WebSocket pings all
+reach the worker holding the agent's connection, but REST pings spread
+across workers split one agent's window between them: jumps between pings
+handled by different workers go unchecked, stops and detours are seen
+later or not at all, and cooldowns are per worker. Agents posting
+locations over REST need sticky routing (e.g. by token) for full coverage.
+"""
+import threading
+import time
+from collections import deque
+import numpy as np
+from django.conf import settings
+from .geo import haversine_km
+
+# Seconds without pings after which an agent's window is dropped
+TRACK_EXPIRY = 3600
+
+def anomalies_enabled():
+    return getattr(settings, 'ANOMALY_DETECTION_ENABLED', True)
+
+def setting(name, default):
+    return getattr(settings, name, default)
+
+class AgentTrack:
+    """Recent positions and alert state for one agent"""
+
+    def __init__(self):
+        self.points = deque()
+        self.stopped = False
+        self.assignment_id = None
+        self.origin = None
+        self.deviated = False
+        self.last_alert = {}
+
+    def add(self, at, latitude, longitude):
+        self.points.append((at, latitude, longitude))
+        horizon = at - setting('ANOMALY_STOP_MINUTES', 20) * 60 - 60
+        while len(self.points) > 2 and self.points[1][0] <= horizon:
+            self.points.popleft()
+
+    def start_assignment(self, assignment_id, latitude, longitude):
+        self.assignment_id = assignment_id
+        self.origin = (latitude, longitude) if assignment_id else None
+        self.deviated = False
+
+class Analyzer:
+    """Per-process sliding windows for all agents reporting to this worker"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tracks = {}
+        self.last_sweep = time.monotonic()
+
+    def observe(self, agent_id, latitude, longitude, assignment_id=None, client_position=None, on_site=False, at=None):
+        """Feed one ping; returns a list of alert dicts (usually empty)"""
+        at = at if at is not None else time.time()
+        cooldown = setting('ANOMALY_ALERT_COOLDOWN', 900)
+        raised = []
+        with self.lock:
+            track = self.tracks.get(agent_id)
+            if track is None:
+                track = self.tracks[agent_id] = AgentTrack()
+            for alert in self.check(track, at, latitude, longitude, assignment_id, client_position, on_site):
+                if at - track.last_alert.get(alert['kind'], at - cooldown) >= cooldown:
+                    track.last_alert[alert['kind']] = at
+                    raised.append(dict(alert, agent_id=str(agent_id), latitude=latitude, longitude=longitude))
+            self.sweep()
+        return raised
+
+    def check(self, track, at, latitude, longitude, assignment_id, client_position, on_site):
+        alerts = []
+
+        if track.points:
+            last_at, last_lat, last_lng = track.points[-1]
+            km = float(haversine_km(last_lat, last_lng, latitude, longitude))
+            hours = max(at - last_at, 1) / 3600
+            if km >= setting('ANOMALY_MIN_JUMP_KM', 0.5) and km / hours > setting('ANOMALY_MAX_SPEED_KMH', 200):
+                alerts.append({
+                    'kind': 'impossible_speed',
+                    'title': 'Impossible movement detected',
+                    'message': f'Moved {km:.1f} km in {at - last_at:.0f} s ({km / hours:.0f} km/h)',
+                })
+
+        track.add(at, latitude, longitude)
+
+        if str(assignment_id or '') != str(track.assignment_id or ''):
+            track.start_assignment(assignment_id, latitude, longitude)
+
+        # Long stop while on an assignment: every point in the window within the stop radius
+        points = np.array(track.points)
+        stop_seconds = setting('ANOMALY_STOP_MINUTES', 20) * 60
+        radius_km = setting('ANOMALY_STOP_RADIUS_METERS', 100) / 1000
+        if at - points[0, 0] >= stop_seconds:
+            spread = haversine_km(latitude, longitude, points[:, 1], points[:, 2]).max()
+            at_client = client_position is not None and float(
+                haversine_km(latitude, longitude, client_position[0], client_position[1])
+            ) <= setting('ANOMALY_ONSITE_RADIUS_METERS', 300) / 1000
+            if spread <= radius_km and assignment_id and not on_site and not at_client:
+                if not track.stopped:
+                    track.stopped = True
+                    alerts.append({
+                        'kind': 'long_stop',
+                        'title': 'Agent stopped',
+                        'message': f'No movement for {(at - points[0, 0]) / 60:.0f} minutes',
+                    })
+            elif spread > radius_km:
+                track.stopped = False
+
+        # Route deviation: extra distance over the straight line from the start point to the client
+        if client_position is not None and track.origin is not None and not on_site and not track.deviated:
+            direct = float(haversine_km(track.origin[0], track.origin[1], client_position[0], client_position[1]))
+            via = float(
+                haversine_km(track.origin[0], track.origin[1], latitude, longitude)
+                + haversine_km(latitude, longitude, client_position[0], client_position[1])
+            )
+            detour = via - direct
+            if detour > max(setting('ANOMALY_DETOUR_KM', 3), direct * setting('ANOMALY_DETOUR_RATIO', 0.5)):
+                track.deviated = True
+                alerts.append({
+                    'kind': 'route_deviation',
+                    'title': 'Agent off route',
+                    'message': f'{detour:.1f} km away from the route to the client',
+                })
+
+        return alerts
+
+    def sweep(self):
+        """Drop windows of agents that stopped reporting (called with the lock held)"""
+        now = time.monotonic()
+        if now - self.last_sweep < 60:
+            return
+        self.last_sweep = now
+        cutoff = time.time() - TRACK_EXPIRY
+        for agent_id in [key for key, track in self.tracks.items() if track.points[-1][0] < cutoff]:
+            del self.tracks[agent_id]
+
+analyzer = Analyzer()
+
+_managers = {'ids': [], 'loaded_at': None}
+
+def manager_ids():
+    """Active manager ids, cached for ANOMALY_MANAGER_CACHE seconds"""
+    from .models import User
+
+    loaded_at = _managers['loaded_at']
+    if loaded_at is None or time.monotonic() - loaded_at > setting('ANOMALY_MANAGER_CACHE', 300):
+        _managers['ids'] = list(User.objects.filter(role='manager', is_active=True).values_list('id', flat=True))
+        _managers['loaded_at'] = time.monotonic()
+    return _managers['ids']
+
+def raise_alerts(agent, alerts, assignment_id=None):
+    """Log alerts for every manager and push them to the managers group"""
+    from .models import NotificationLog
+    from .outbox import enqueue_events
+
+    name = agent.get_full_name() or agent.username
+    NotificationLog.objects.bulk_create([
+        NotificationLog(
+            recipient_id=manager_id,
+            notification_type='alert',
+            title=f"{alert['title']}: {name}",
+            message=alert['message'],
+            assignment_id=assignment_id
+        )
+        for alert in alerts
+        for manager_id in manager_ids()
+    ])
+    enqueue_events([
+        ('managers', dict(alert, type='agent_alert', agent_name=name))
+        for alert in alerts
+    ])
+
+def check_location(agent, latitude, longitude, assignment_id=None, client_position=None, on_site=False):
+    """Run the detectors for one ping and raise any alerts; returns them"""
+    if not anomalies_enabled():
+        return []
+    alerts = analyzer.observe(
+        str(agent.id), latitude, longitude,
+        assignment_id=assignment_id, client_position=client_position, on_site=on_site
+    )
+    if alerts:
+        raise_alerts(agent, alerts, assignment_id)
+    return alerts
@@ -6,5 +6,12 @@ class OperationsConfig(AppConfig):
     verbose_name = 'Field Operations'
 
     def ready(self):
-        # Import signals if needed
-        pass
+        # Load the ETA model once per process so estimates are pure lookups
+        from .eta import load_model
+        load_model()
+
+        # Publish SystemSettings changes to every worker
+        from . import live_settings  # noqa: F401
+
+        # Offer newly saved clients to idle agents
+        from . import dispatch  # noqa: F401
@@ -0,0 +1,160 @@
+"""
+Signed, stateless API tokens for the mobile app and other high-frequency clients.
+
+A token is the user's id (plus a fingerprint of their password hash) signed
+with SECRET_KEY by django.core.signing, so verifying one needs no database
+access: the signature and age (AUTH_TOKEN_MAX_AGE) are checked in memory and
+the user comes from a per-process cache refreshed every AUTH_USER_CACHE_TTL
+seconds. Changing the password or deactivating the user invalidates tokens
+once the cache entry is refreshed. Each request gets its own copy of the
+cached user, so fields it saves (e.g. current_location) do not leak into
+other requests; code that needs the latest stored values of such fields
+must read them from the database (see mileage.last_position).
+
+Send it as "Authorization: Token <token>" to the REST API, or as ?token= on
+WebSocket URLs. Browser sessions keep working unchanged.
+"""
+import copy
+import threading
+import time
+from urllib.parse import parse_qs
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import signing
+from django.db.models.signals import post_save
+from django.utils.crypto import constant_time_compare, salted_hmac
+from rest_framework import authentication, exceptions
+from rest_framework.throttling import AnonRateThrottle
+
+SALT = 'operations.authentication.token'
+
+def max_age():
+    return getattr(settings, 'AUTH_TOKEN_MAX_AGE', 7 * 24 * 3600)
+
+def password_fingerprint(user):
+    return salted_hmac(SALT, user.password).hexdigest()[:12]
+
+def issue_token(user):
+    """Signed token for a user"""
+    return signing.dumps({'u': str(user.id), 'p': password_fingerprint(user)}, salt=SALT)
+
+def read_token(token):
+    """Verified token payload, or None if the signature or age is invalid"""
+    try:
+        return signing.loads(token, salt=SALT, max_age=max_age())
+    except signing.BadSignature:
+        return None
+
+class UserCache:
+    """Per-process cache of User objects for token authentication"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = {}
+
+    def peek(self, user_id):
+        """Copy of the cached user if present and fresh; never touches the database"""
+        entry = self.users.get(user_id)
+        if entry and time.monotonic() - entry[1] < getattr(settings, 'AUTH_USER_CACHE_TTL', 60):
+            return copy.copy(entry[0])
+        return None
+
+    def load(self, user_id):
+        """Fetch a user from the database into the cache (None if missing)"""
+        user = get_user_model().objects.filter(pk=user_id).first()
+        if user is not None:
+            self.put(copy.copy(user))
+        return user
+
+    def put(self, user):
+        with self.lock:
+            if len(self.users) >= getattr(settings, 'AUTH_USER_CACHE_SIZE', 10000):
+                self.users.clear()
+            self.users[str(user.pk)] = (user, time.monotonic())
+
+    def discard(self, user_id):
+        with self.lock:
+            self.users.pop(str(user_id), None)
+
+user_cache = UserCache()
+
+# Saves touching only these fields (location pings) keep the cached entry
+VOLATILE_FIELDS = frozenset(['current_location', 'location_updated_at', 'updated_at', 'zone', 'last_login'])
+
+def forget_user(sender, instance, update_fields=None, **kwargs):
+    # Profile, password and is_active changes are picked up on the next request
+    if update_fields and set(update_fields) <= VOLATILE_FIELDS:
+        return
+    user_cache.discard(instance.pk)
+
+post_save.connect(forget_user, sender=settings.AUTH_USER_MODEL, dispatch_uid='operations.authentication.forget_user')
+
+def check_user(user, payload):
+    return (
+        user is not None
+        and user.is_active
+        and constant_time_compare(payload.get('p', ''), password_fingerprint(user))
+    )
+
+def authenticate_token(token):
+    """User for a valid token, or None (one query only on a cache miss)"""
+    payload = read_token(token)
+    if payload is None:
+        return None
+    user = user_cache.peek(payload['u']) or user_cache.load(payload['u'])
+    return user if check_user(user, payload) else None
+
+class SignedTokenAuthentication(authentication.BaseAuthentication):
+    """DRF authentication for "Authorization: Token <signed token>" (no session, no CSRF)"""
+
+    keywords = ('token', 'bearer')
+
+    def authenticate(self, request):
+        parts = authentication.get_authorization_header(request).split()
+        if not parts or parts[0].decode().lower() not in self.keywords:
+            return None
+        if len(parts) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header')
+
+        token = parts[1].decode()
+        user = authenticate_token(token)
+        if user is None:
+            raise exceptions.AuthenticationFailed('Invalid or expired token')
+        return user, token
+
+    def authenticate_header(self, request):
+        return 'Token'
+
+class TokenRateThrottle(AnonRateThrottle):
+    """Per-IP limit on anonymous token requests (password guesses), rate from the 'token' scope"""
+
+    scope = 'token'
+
+class TokenAuthMiddleware:
+    """ASGI middleware authenticating WebSockets from ?token=, else via the session stack"""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.session_stack = AuthMiddlewareStack(inner)
+
+    async def __call__(self, scope, receive, send):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        token = query.get('token', [None])[0]
+        if not token:
+            return await self.session_stack(scope, receive, send)
+
+        payload = read_token(token)
+        user = None
+        if payload is not None:
+            user = user_cache.peek(payload['u'])
+            if user is None:
+                user = await database_sync_to_async(user_cache.load)(payload['u'])
+            if not check_user(user, payload):
+                user = None
+
+        if user is None:
+            user = AnonymousUser()
+        return await self.inner(dict(scope, user=user), receive, send)
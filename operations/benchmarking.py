@@ -0,0 +1,251 @@
+"""
+Seeded synthetic data and benchmark cases for the operations hot paths.
+
+Used by the run_benchmarks management command. Every case runs inside a
+transaction that is rolled back afterwards, so benchmarks can be pointed at
+a development database without leaving data behind.
+"""
+import io
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db import connection
+from django.test import Client as TestClient
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .models import User, Client, Assignment, LocationHistory
+
+CENTER_LAT, CENTER_LNG = settings.LEAFLET_CONFIG['DEFAULT_CENTER']
+
+# Roughly a 40 km box around the map centre
+SPREAD_DEGREES = 0.2
+
+def random_points(rng, count):
+    """Return (lat, lng) arrays of points scattered around the map centre"""
+    lats = CENTER_LAT + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES, count)
+    lngs = CENTER_LNG + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES, count)
+    return lats, lngs
+
+def make_agents(rng, count, prefix='bench_agent'):
+    lats, lngs = random_points(rng, count)
+    return User.objects.bulk_create([
+        User(
+            username=f'{prefix}_{i:05d}',
+            role='agent',
+            password='!',
+            current_location=Point(lngs[i], lats[i]),
+        )
+        for i in range(count)
+    ])
+
+def make_manager(username='bench_manager'):
+    return User.objects.create(username=username, role='manager', is_staff=True, password='!')
+
+def make_clients(rng, count, prefix='bench_client'):
+    lats, lngs = random_points(rng, count)
+    priorities = rng.integers(1, 5, count)
+    return Client.objects.bulk_create([
+        Client(
+            name=f'{prefix} {i:06d}',
+            phone=f'9{i:09d}',
+            address=f'{i} Benchmark Road',
+            location=Point(lngs[i], lats[i]),
+            priority=int(priorities[i]),
+        )
+        for i in range(count)
+    ])
+
+def make_history(rng, agents, clients, count, points_per_assignment=20):
+    """Create completed assignments with location trails for the given agents"""
+    now = timezone.now()
+    assignment_count = max(count // points_per_assignment, 1)
+    agent_index = rng.integers(0, len(agents), assignment_count)
+    client_index = rng.integers(0, len(clients), assignment_count)
+    durations = rng.integers(10, 120, assignment_count)
+
+    assignments = Assignment.objects.bulk_create([
+        Assignment(
+            agent=agents[agent_index[i]],
+            client=clients[client_index[i]],
+            status='completed',
+            started_at=now - timezone.timedelta(minutes=int(durations[i])),
+            completed_at=now,
+            actual_duration=timezone.timedelta(minutes=int(durations[i])),
+        )
+        for i in range(assignment_count)
+    ])
+
+    lats, lngs = random_points(rng, assignment_count * points_per_assignment)
+    LocationHistory.objects.bulk_create([
+        LocationHistory(
+            agent_id=assignment.agent_id,
+            assignment=assignment,
+            location=Point(lngs[a * points_per_assignment + p], lats[a * points_per_assignment + p]),
+            accuracy=10.0,
+        )
+        for a, assignment in enumerate(assignments)
+        for p in range(points_per_assignment)
+    ], batch_size=5000)
+    return assignments
+
+def make_client_sheet(rng, count):
+    """Build an in-memory Excel upload in the format upload_clients expects"""
+    lats, lngs = random_points(rng, count)
+    frame = pd.DataFrame({
+        'name': [f'Upload client {i:06d}' for i in range(count)],
+        'phone': [f'8{i:09d}' for i in range(count)],
+        'email': [f'client{i}@example.com' for i in range(count)],
+        'address': [f'{i} Upload Street' for i in range(count)],
+        'latitude': lats,
+        'longitude': lngs,
+        'priority': rng.integers(1, 5, count),
+    })
+    buffer = io.BytesIO()
+    frame.to_excel(buffer, index=False)
+    buffer.seek(0)
+    buffer.name = 'clients.xlsx'
+    return buffer
+
+class StubRouteHandler(BaseHTTPRequestHandler):
+    """Answers every POST with a fixed OpenRouteService-style response"""
+    body = json.dumps({
+        'features': [{
+            'geometry': {'coordinates': [[77.59, 12.97], [77.60, 12.98], [77.61, 12.99]]},
+            'properties': {'segments': [{
+                'distance': 2500.0,
+                'duration': 420.0,
+                'steps': [{'instruction': 'Head north'}, {'instruction': 'Arrive'}],
+            }]},
+        }]
+    }).encode()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+def start_stub_route_server():
+    """Start the stub routing server on a free port and return it"""
+    server = HTTPServer(('127.0.0.1', 0), StubRouteHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def measure(func, repeat, warmup=1):
+    """Time func() and count its queries, returning summary statistics"""
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    queries = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(len(captured.captured_queries))
+
+    timings.sort()
+    return {
+        'repeat': repeat,
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(float(np.percentile(timings, 95)), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'queries': int(statistics.median(queries)),
+    }
+
+def expect_status(response, *codes):
+    if response.status_code not in codes:
+        raise AssertionError(f"Unexpected status {response.status_code}: {response.content[:200]!r}")
+
+class BenchmarkData:
+    """Seeded dataset shared by all cases in a run"""
+
+    def __init__(self, seed, agents, clients, history):
+        rng = np.random.default_rng(seed)
+        self.rng = rng
+        self.manager = make_manager()
+        self.agents = make_agents(rng, agents)
+        self.clients = make_clients(rng, clients)
+        make_history(rng, self.agents, self.clients, history)
+
+def bench_auto_assign(data, repeat):
+    api = APIClient()
+    api.force_authenticate(data.manager)
+    agents = iter(data.agents)
+
+    def run():
+        response = api.post('/api/auto-assign/', {'agent_id': str(next(agents).id)}, format='json')
+        expect_status(response, 201)
+
+    return measure(run, min(repeat, len(data.agents) - 1))
+
+def bench_upload_clients(data, repeat, rows=500):
+    browser = TestClient()
+    browser.force_login(data.manager)
+    sheets = [make_client_sheet(data.rng, rows) for _ in range(repeat + 1)]
+    sheets = iter(sheets)
+
+    def run():
+        response = browser.post('/upload-clients/', {'file': next(sheets)})
+        expect_status(response, 302)
+
+    result = measure(run, repeat)
+    result['rows'] = rows
+    return result
+
+def bench_manager_dashboard(data, repeat):
+    browser = TestClient()
+    browser.force_login(data.manager)
+
+    def run():
+        expect_status(browser.get('/manager/'), 200)
+
+    return measure(run, repeat)
+
+def bench_update_agent_location(data, repeat):
+    api = APIClient()
+    agent = data.agents[0]
+    api.force_authenticate(agent)
+    lats, lngs = random_points(data.rng, repeat + 1)
+    points = iter(zip(lats, lngs))
+
+    def run():
+        latitude, longitude = next(points)
+        response = api.post('/api/location/update/', {
+            'latitude': latitude, 'longitude': longitude, 'accuracy': 8.0
+        }, format='json')
+        expect_status(response, 200)
+
+    return measure(run, repeat)
+
+def bench_get_route(data, repeat):
+    api = APIClient()
+    api.force_authenticate(data.agents[0])
+    params = {'start_lat': 12.97, 'start_lng': 77.59, 'end_lat': 12.99, 'end_lng': 77.61}
+
+    def run():
+        expect_status(api.get('/api/route/', params), 200)
+
+    return measure(run, repeat)
+
+CASES = {
+    'auto_assign_client': bench_auto_assign,
+    'upload_clients': bench_upload_clients,
+    'manager_dashboard': bench_manager_dashboard,
+    'update_agent_location': bench_update_agent_location,
+    'get_route': bench_get_route,
+}
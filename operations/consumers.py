@@ -1,14 +1,85 @@
-import json
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-from .models import Assignment, NotificationLog
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Assignment
+from .events import send_agent_event, get_missed_events
+from .ingest import BatchError, store_location_batch
+from .mileage import last_position
+from .protocol import ProtocolError, negotiate
+from . import live_settings, metrics, ping_rate, presence
+from .profiling import query_budget
+from .services import AssignmentError, active_assignment, assign_client
+from .dispatch import dispatcher, notify_agent_free, notify_client_queued
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
-class AgentConsumer(AsyncWebsocketConsumer):
+class FieldOpsConsumer(AsyncWebsocketConsumer):
+    """Base consumer handling wire-format negotiation (see operations/protocol.py)"""
+
+    # Message types reported individually in metrics; anything else counts as 'other'
+    message_types = ('ping',)
+
+    async def accept_protocol(self):
+        """Accept the connection with the best subprotocol the client offered"""
+        subprotocol, self.codec = negotiate(self.scope.get('subprotocols'))
+        await self.accept(subprotocol)
+        if metrics.metrics_enabled():
+            metrics.WS_CONNECTIONS.inc(consumer=type(self).__name__)
+
+    async def send_message(self, data):
+        """Encode and send a message in the negotiated format"""
+        if self.codec.binary:
+            await self.send(bytes_data=self.codec.encode(data))
+        else:
+            await self.send(text_data=self.codec.encode(data))
+
+    async def receive(self, text_data=None, bytes_data=None):
+        """Decode incoming frames and hand them to receive_message"""
+        try:
+            data = self.codec.decode(text_data, bytes_data)
+        except ProtocolError as e:
+            await self.send_message({
+                'type': 'error',
+                'message': str(e)
+            })
+            return
+
+        message_type = data.get('type') if isinstance(data, dict) else None
+        if message_type not in self.message_types:
+            message_type = 'other'
+
+        try:
+            with metrics.timer(metrics.WS_MESSAGE_SECONDS, consumer=type(self).__name__, type=message_type):
+                await self.receive_message(data)
+        except Exception as e:
+            await self.send_message({
+                'type': 'error',
+                'message': str(e)
+            })
+
+    async def receive_message(self, data):
+        """Reply to message types the consumer does not handle (subclasses fall back to this)"""
+        message_type = data.get('type') if isinstance(data, dict) else None
+        await self.send_message({
+            'type': 'error',
+            'message': f'Unknown message type: {message_type}'
+        })
+
+class AgentConsumer(FieldOpsConsumer):
     """WebSocket consumer for field agents"""
 
+    message_types = ('ping', 'location_update', 'location_batch', 'assignment_status_update')
+
     async def connect(self):
         self.user = self.scope["user"]
 
@@ -20,6 +91,12 @@ class AgentConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
+        # Cache session state so steady-state location pings need no reads
+        await self.load_session_state()
+        await database_sync_to_async(live_settings.ensure_loaded)()
+        self.last_broadcast = 0.0
+        self.ping_rate = None
+
         # Join agent-specific group
         self.group_name = f'agent_{self.user.id}'
         await self.channel_layer.group_add(
@@ -27,15 +104,40 @@ class AgentConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        await self.accept()
+        await self.accept_protocol()
+        await presence.connection_opened(self.user.id)
 
         # Send connection confirmation
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'connection_established',
             'message': 'Connected to Field Operations System',
             'agent_id': str(self.user.id),
             'agent_name': self.user.username
-        }))
+        })
+        await self.update_ping_rate()
+
+        # An idle agent coming online can take the next queued client
+        if self.assignment_id is None:
+            dispatcher.agent_free(self.user.id)
+
+        # Replay events missed while disconnected (client passes ?last_seq=N)
+        last_seq = self.get_last_seq()
+        if last_seq is not None:
+            events, truncated = await database_sync_to_async(get_missed_events)(self.user.id, last_seq)
+            await self.send_message({
+                'type': 'events_replay',
+                'last_seq': last_seq,
+                'events': events,
+                'truncated': truncated
+            })
+
+    def get_last_seq(self):
+        """Read the last sequence number seen by the client from the query string"""
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            return int(query['last_seq'][0])
+        except (KeyError, IndexError, ValueError):
+            return None
 
     async def disconnect(self, close_code):
         # Leave agent group
@@ -44,33 +146,26 @@ class AgentConsumer(AsyncWebsocketConsumer):
                 self.group_name,
                 self.channel_name
             )
-
-    async def receive(self, text_data):
-        """Handle messages from WebSocket"""
-        try:
-            text_data_json = json.loads(text_data)
-            message_type = text_data_json.get('type')
-
-            if message_type == 'location_update':
-                await self.handle_location_update(text_data_json)
-            elif message_type == 'assignment_status_update':
-                await self.handle_assignment_status_update(text_data_json)
-            elif message_type == 'ping':
-                await self.send(text_data=json.dumps({
-                    'type': 'pong',
-                    'timestamp': text_data_json.get('timestamp')
-                }))
-
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': 'Invalid JSON format'
-            }))
-        except Exception as e:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': str(e)
-            }))
+            await presence.connection_closed(self.user.id)
+
+    async def receive_message(self, data):
+        """Handle decoded messages from WebSocket"""
+        message_type = data.get('type')
+
+        if message_type == 'location_update':
+            await self.handle_location_update(data)
+        elif message_type == 'location_batch':
+            await self.handle_location_batch(data)
+        elif message_type == 'assignment_status_update':
+            await self.handle_assignment_status_update(data)
+        elif message_type == 'ping':
+            await presence.heartbeat(self.user.id)
+            await self.send_message({
+                'type': 'pong',
+                'timestamp': data.get('timestamp')
+            })
+        else:
+            await super().receive_message(data)
 
     async def handle_location_update(self, data):
         """Handle location update from agent"""
@@ -78,37 +173,82 @@ class AgentConsumer(AsyncWebsocketConsumer):
             latitude = float(data.get('latitude'))
             longitude = float(data.get('longitude'))
             accuracy = data.get('accuracy')
+            ping_rate.meter.record()
 
             # Update agent location in database
             await self.update_agent_location(latitude, longitude, accuracy)
+            await presence.heartbeat(self.user.id)
 
-            # Broadcast location to managers
-            await self.channel_layer.group_send(
-                'managers',
-                {
-                    'type': 'send_notification',
-                    'data': {
-                        'type': 'location_update',
-                        'agent_id': str(self.user.id),
-                        'agent_name': self.user.username,
-                        'latitude': latitude,
-                        'longitude': longitude,
-                        'accuracy': accuracy
-                    }
-                }
-            )
+            # Broadcast location to managers, at most once per LOCATION_BROADCAST_INTERVAL
+            now = time.monotonic()
+            if now - self.last_broadcast >= live_settings.get('LOCATION_BROADCAST_INTERVAL', 0):
+                self.last_broadcast = now
+                with metrics.timer(metrics.GROUP_SEND_SECONDS, source='agent_location'):
+                    await self.channel_layer.group_send(
+                        'managers',
+                        {
+                            'type': 'send_notification',
+                            'data': {
+                                'type': 'location_update',
+                                'agent_id': str(self.user.id),
+                                'agent_name': self.user.username,
+                                'latitude': latitude,
+                                'longitude': longitude,
+                                'accuracy': accuracy,
+                                'timestamp': data.get('timestamp')
+                            }
+                        }
+                    )
 
             # Confirm location update
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'location_updated',
                 'message': 'Location updated successfully'
-            }))
+            })
+            await self.update_ping_rate()
 
         except (ValueError, TypeError) as e:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': f'Invalid location data: {str(e)}'
-            }))
+            })
+
+    async def handle_location_batch(self, data):
+        """Handle queued positions uploaded after a connectivity gap"""
+        try:
+            result = await self.store_location_batch(data.get('points'))
+        except BatchError as e:
+            await self.send_message({
+                'type': 'error',
+                'message': f'Invalid location batch: {str(e)}'
+            })
+            return
+
+        await presence.heartbeat(self.user.id)
+
+        # Only the newest point is broadcast, and only if it moved the agent
+        latest = result['latest']
+        if latest:
+            with metrics.timer(metrics.GROUP_SEND_SECONDS, source='agent_location'):
+                await self.channel_layer.group_send(
+                    'managers',
+                    {
+                        'type': 'send_notification',
+                        'data': {
+                            'type': 'location_update',
+                            'agent_id': str(self.user.id),
+                            'agent_name': self.user.username,
+                            **latest
+                        }
+                    }
+                )
+
+        await self.send_message({
+            'type': 'location_batch_stored',
+            'accepted': result['accepted'],
+            'rejected': result['rejected']
+        })
+        await self.update_ping_rate()
 
     async def handle_assignment_status_update(self, data):
         """Handle assignment status update from agent"""
@@ -118,57 +258,159 @@ class AgentConsumer(AsyncWebsocketConsumer):
             notes = data.get('notes', '')
 
             if new_status not in ['in_progress', 'completed']:
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     'type': 'error',
                     'message': 'Invalid status'
-                }))
+                })
                 return
 
             # Update assignment status
             success = await self.update_assignment_status(assignment_id, new_status, notes)
 
             if success:
-                await self.send(text_data=json.dumps({
+                if new_status == 'completed':
+                    self.clear_assignment()
+                else:
+                    self.assignment_id = str(assignment_id)
+                    self.assignment_status = new_status
+
+                await self.send_message({
                     'type': 'assignment_status_updated',
                     'assignment_id': assignment_id,
                     'status': new_status,
                     'message': f'Assignment status updated to {new_status}'
-                }))
+                })
+                await self.update_ping_rate()
             else:
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     'type': 'error',
                     'message': 'Failed to update assignment status'
-                }))
+                })
 
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': str(e)
-            }))
+            })
 
     async def send_notification(self, event):
         """Send notification to agent"""
-        await self.send(text_data=json.dumps(event['data']))
+        self.apply_event_to_state(event['data'])
+        await self.send_message(event['data'])
+        await self.update_ping_rate()
+
+    async def state_invalidate(self, event):
+        """Reload cached session state after an out-of-band change (e.g. admin edit)"""
+        await self.load_session_state()
+        await self.update_ping_rate()
+
+    async def update_ping_rate(self):
+        """Send a 'ping_rate' directive if the agent's interval changed (see operations/ping_rate.py)"""
+        if not ping_rate.adaptive_enabled():
+            return
+        state = ping_rate.agent_state(self.assignment_status, self.last_position, self.client_position)
+        directive = (state, ping_rate.interval_for(state))
+        if directive != self.ping_rate:
+            self.ping_rate = directive
+            await self.send_message({
+                'type': 'ping_rate',
+                'state': state,
+                'interval': directive[1]
+            })
+
+    def apply_event_to_state(self, data):
+        """Keep the cached assignment in step with notifications sent to this agent"""
+        message_type = data.get('type')
+
+        if message_type in ('assignment_notification', 'new_assignment'):
+            self.assignment_id = data.get('assignment_id')
+            self.assignment_status = 'assigned'
+            self.assignment_since = parse_datetime(data.get('assigned_at') or '') or timezone.now()
+            self.client_position = (data.get('latitude'), data.get('longitude'))
+        elif data.get('assignment_id') != self.assignment_id:
+            return
+        elif message_type == 'assignment_cancelled':
+            self.clear_assignment()
+        elif message_type == 'assignment_update':
+            if data.get('status') in ('completed', 'cancelled'):
+                self.clear_assignment()
+            else:
+                self.assignment_status = data.get('status')
+
+    def clear_assignment(self):
+        self.assignment_id = None
+        self.assignment_status = None
+        self.assignment_since = None
+        self.client_position = None
 
     @database_sync_to_async
+    @query_budget('agent.load_session_state')
+    def load_session_state(self):
+        """Load the active assignment and last known position for this connection"""
+        assignment = active_assignment(self.user.id)
+
+        self.clear_assignment()
+        if assignment:
+            self.assignment_id = str(assignment.id)
+            self.assignment_status = assignment.status
+            self.assignment_since = assignment.assigned_at
+            self.client_position = (assignment.client.latitude, assignment.client.longitude)
+
+        # scope['user'] may come from the token auth cache; read the stored position
+        self.last_position, self.last_position_at = last_position(self.user.id)
+
+    @database_sync_to_async
+    @query_budget('agent.update_agent_location')
     def update_agent_location(self, latitude, longitude, accuracy):
-        """Update agent location in database"""
+        """Update agent location in database (narrow writes, no reads)"""
         from django.contrib.gis.geos import Point
+        from .anomalies import check_location
+        from .mileage import record_movement
         from .models import LocationHistory
+        from .territories import assign_zone
 
+        previous, previous_at = self.last_position, self.last_position_at
         location = Point(longitude, latitude)
         self.user.current_location = location
-        self.user.save()
+        self.user.location_updated_at = timezone.now()
+        fields = ['current_location', 'location_updated_at', 'updated_at']
+        if assign_zone(self.user, latitude, longitude):
+            fields.append('zone')
+        self.user.save(update_fields=fields)
+        self.last_position = (latitude, longitude)
+        self.last_position_at = self.user.location_updated_at
 
         # Save to location history
         LocationHistory.objects.create(
-            agent=self.user,
+            agent_id=self.user.id,
             location=location,
             accuracy=accuracy,
-            assignment=self.user.current_assignment
+            assignment_id=self.assignment_id
+        )
+        record_movement(self.user.id, self.assignment_id, previous, previous_at, latitude, longitude, accuracy)
+        check_location(
+            self.user, latitude, longitude,
+            assignment_id=self.assignment_id,
+            client_position=self.client_position,
+            on_site=self.assignment_status == 'in_progress'
+        )
+
+    @database_sync_to_async
+    @query_budget('agent.store_location_batch')
+    def store_location_batch(self, points):
+        """Store a batch of queued positions (one bulk insert)"""
+        result = store_location_batch(
+            self.user, points,
+            assignment_id=self.assignment_id,
+            assignment_since=self.assignment_since
         )
+        if result['latest']:
+            self.last_position = (result['latest']['latitude'], result['latest']['longitude'])
+            self.last_position_at = datetime.fromtimestamp(result['latest']['timestamp'] / 1000, tz=dt_timezone.utc)
+        return result
 
     @database_sync_to_async
+    @query_budget('agent.update_assignment_status')
     def update_assignment_status(self, assignment_id, new_status, notes):
         """Update assignment status in database"""
         try:
@@ -181,6 +423,7 @@ class AgentConsumer(AsyncWebsocketConsumer):
                 assignment.start_assignment()
             elif new_status == 'completed':
                 assignment.complete_assignment(notes)
+                notify_agent_free(self.user.id)
 
             return True
         except Assignment.DoesNotExist:
@@ -188,9 +431,11 @@ class AgentConsumer(AsyncWebsocketConsumer):
         except Exception:
             return False
 
-class ManagerConsumer(AsyncWebsocketConsumer):
+class ManagerConsumer(FieldOpsConsumer):
     """WebSocket consumer for managers"""
 
+    message_types = ('ping', 'create_assignment', 'cancel_assignment')
+
     async def connect(self):
         self.user = self.scope["user"]
 
@@ -202,6 +447,9 @@ class ManagerConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
+        # Agent ids already validated on this connection
+        self.known_agent_ids = set()
+
         # Join manager-specific group
         self.group_name = f'manager_{self.user.id}'
         await self.channel_layer.group_add(
@@ -215,15 +463,16 @@ class ManagerConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        await self.accept()
+        await self.accept_protocol()
+        await presence.connection_opened()
 
         # Send connection confirmation
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'connection_established',
             'message': 'Connected to Field Operations Management',
             'manager_id': str(self.user.id),
             'manager_name': self.user.username
-        }))
+        })
 
     async def disconnect(self, close_code):
         # Leave groups
@@ -232,38 +481,29 @@ class ManagerConsumer(AsyncWebsocketConsumer):
                 self.group_name,
                 self.channel_name
             )
+            await presence.connection_closed()
 
         await self.channel_layer.group_discard(
             'managers',
             self.channel_name
         )
 
-    async def receive(self, text_data):
-        """Handle messages from WebSocket"""
-        try:
-            text_data_json = json.loads(text_data)
-            message_type = text_data_json.get('type')
-
-            if message_type == 'create_assignment':
-                await self.handle_create_assignment(text_data_json)
-            elif message_type == 'cancel_assignment':
-                await self.handle_cancel_assignment(text_data_json)
-            elif message_type == 'ping':
-                await self.send(text_data=json.dumps({
-                    'type': 'pong',
-                    'timestamp': text_data_json.get('timestamp')
-                }))
-
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': 'Invalid JSON format'
-            }))
-        except Exception as e:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': str(e)
-            }))
+    async def receive_message(self, data):
+        """Handle decoded messages from WebSocket"""
+        message_type = data.get('type')
+
+        if message_type == 'create_assignment':
+            await self.handle_create_assignment(data)
+        elif message_type == 'cancel_assignment':
+            await self.handle_cancel_assignment(data)
+        elif message_type == 'ping':
+            await presence.heartbeat()
+            await self.send_message({
+                'type': 'pong',
+                'timestamp': data.get('timestamp')
+            })
+        else:
+            await super().receive_message(data)
 
     async def handle_create_assignment(self, data):
         """Handle assignment creation from manager"""
@@ -276,42 +516,23 @@ class ManagerConsumer(AsyncWebsocketConsumer):
             assignment = await self.create_assignment(agent_id, client_id, notes)
 
             if assignment:
-                # Notify agent
-                await self.channel_layer.group_send(
-                    f'agent_{agent_id}',
-                    {
-                        'type': 'send_notification',
-                        'data': {
-                            'type': 'new_assignment',
-                            'assignment_id': str(assignment.id),
-                            'client_name': assignment.client.name,
-                            'client_address': assignment.client.address,
-                            'client_phone': assignment.client.phone,
-                            'priority': assignment.client.get_priority_display(),
-                            'latitude': assignment.client.latitude,
-                            'longitude': assignment.client.longitude,
-                            'message': f'New assignment: {assignment.client.name}'
-                        }
-                    }
-                )
-
                 # Confirm to manager
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     'type': 'assignment_created',
                     'assignment_id': str(assignment.id),
                     'message': 'Assignment created successfully'
-                }))
+                })
             else:
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     'type': 'error',
                     'message': 'Failed to create assignment'
-                }))
+                })
 
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': str(e)
-            }))
+            })
 
     async def handle_cancel_assignment(self, data):
         """Handle assignment cancellation from manager"""
@@ -323,88 +544,73 @@ class ManagerConsumer(AsyncWebsocketConsumer):
             success = await self.cancel_assignment(assignment_id, reason)
 
             if success:
-                assignment = await self.get_assignment(assignment_id)
-                if assignment:
-                    # Notify agent
-                    await self.channel_layer.group_send(
-                        f'agent_{assignment.agent.id}',
-                        {
-                            'type': 'send_notification',
-                            'data': {
-                                'type': 'assignment_cancelled',
-                                'assignment_id': assignment_id,
-                                'message': f'Assignment cancelled: {reason}'
-                            }
-                        }
-                    )
-
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     'type': 'assignment_cancelled',
                     'assignment_id': assignment_id,
                     'message': 'Assignment cancelled successfully'
-                }))
+                })
             else:
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     'type': 'error',
                     'message': 'Failed to cancel assignment'
-                }))
+                })
 
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': str(e)
-            }))
+            })
 
     async def send_notification(self, event):
         """Send notification to manager"""
-        await self.send(text_data=json.dumps(event['data']))
+        await self.send_message(event['data'])
 
     @database_sync_to_async
+    @query_budget('manager.create_assignment')
     def create_assignment(self, agent_id, client_id, notes):
-        """Create assignment in database"""
-        from .models import Client
-
+        """Create assignment in database and queue the agent notification"""
         try:
-            agent = User.objects.get(id=agent_id, role='agent')
-            client = Client.objects.get(id=client_id)
-
-            # Check if agent already has active assignment
-            if agent.current_assignment:
+            if not self.is_agent(agent_id):
                 return None
 
-            # Check if client is already assigned
-            if client.current_assignment:
-                return None
-
-            assignment = Assignment.objects.create(
-                agent=agent,
-                client=client,
-                notes=notes,
-                created_by=self.user
-            )
-
-            return assignment
-        except Exception:
+            return assign_client(agent_id, client_id, created_by=self.user, notes=notes)
+        except (AssignmentError, ValidationError):
+            # Busy agent, taken client or malformed ids: reported to the manager as a failure
             return None
+        except Exception:
+            logger.exception("Creating assignment failed for agent %s, client %s", agent_id, client_id)
+            raise
+
+    def is_agent(self, agent_id):
+        """Check an agent id, remembering valid ones for the life of the connection"""
+        agent_id = str(agent_id)
+        if agent_id not in self.known_agent_ids:
+            if not User.objects.filter(id=agent_id, role='agent').exists():
+                return False
+            self.known_agent_ids.add(agent_id)
+        return True
 
     @database_sync_to_async
+    @query_budget('manager.cancel_assignment')
     def cancel_assignment(self, assignment_id, reason):
-        """Cancel assignment in database"""
+        """Cancel assignment in database and queue the agent notification"""
         try:
-            assignment = Assignment.objects.get(id=assignment_id)
-            assignment.status = 'cancelled'
-            assignment.notes = f"{assignment.notes}\n\nCancelled: {reason}" if assignment.notes else f"Cancelled: {reason}"
-            assignment.save()
+            with transaction.atomic():
+                assignment = Assignment.objects.select_for_update().get(id=assignment_id)
+                assignment.status = 'cancelled'
+                assignment.notes = f"{assignment.notes}\n\nCancelled: {reason}" if assignment.notes else f"Cancelled: {reason}"
+                assignment.save()
+
+                # Notify agent once the cancellation is committed
+                send_agent_event(assignment.agent_id, {
+                    'type': 'assignment_cancelled',
+                    'assignment_id': str(assignment_id),
+                    'message': f'Assignment cancelled: {reason}'
+                })
+                notify_agent_free(assignment.agent_id)
+                notify_client_queued()
             return True
         except Assignment.DoesNotExist:
             return False
         except Exception:
             return False
-
-    @database_sync_to_async
-    def get_assignment(self, assignment_id):
-        """Get assignment from database"""
-        try:
-            return Assignment.objects.select_related('agent', 'client').get(id=assignment_id)
-        except Assignment.DoesNotExist:
-            return None
@@ -0,0 +1,214 @@
+"""
+Automatic dispatch of queued clients to agents as soon as they become free.
+
+Each worker process runs one Dispatcher thread. Agents are reported free
+when they complete or lose an assignment, or when they come online; the
+thread collects those reports for DISPATCH_BATCH_WINDOW seconds, so a burst
+of completions is handled in one pass, then gives every free agent the best
+client from an in-memory queue of unassigned clients. A client saved as
+active or put back in the queue by a cancellation reloads the queue and
+offers it to every idle online agent, so it does not wait for the next
+agent to become free.
+
+Clients are ranked by priority, how long they have been waiting and how far
+they are from the agent (see DISPATCH_WEIGHTS), looking first in the
+agent's territory and its neighbours; within a batch the agents with the
+least work booked today pick first. The queue is held as NumPy
+arrays and refreshed from the database every DISPATCH_QUEUE_REFRESH seconds;
+the final claim goes through services.assign_client, so several workers
+dispatching at once can never double-assign a client.
+"""
+import logging
+import threading
+import time
+import numpy as np
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import post_save
+from .geo import haversine_km
+from .models import Assignment, Client, User
+from .services import ACTIVE_STATUSES, AssignmentError, AgentBusy, ClientUnavailable, assign_client, available_clients
+from .territories import within_scope
+from . import live_settings
+from .workload import workload
+from . import presence
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEIGHTS = {
+    'priority': 10.0,  # score per priority level
+    'wait_hours': 2.0,  # score per hour the client has been waiting
+    'distance_km': 1.0,  # score lost per km from the agent
+}
+
+def dispatch_enabled():
+    return live_settings.get('DISPATCH_ENABLED', False)
+
+class ClientQueue:
+    """Unassigned clients as parallel NumPy arrays"""
+
+    def __init__(self):
+        self.ids = []
+        self.priority = np.empty(0)
+        self.created = np.empty(0)
+        self.lat = np.empty(0)
+        self.lng = np.empty(0)
+        self.zone = np.empty(0, dtype=int)
+        self.alive = np.empty(0, dtype=bool)
+        self.loaded_at = 0.0
+
+    def load(self):
+        rows = list(available_clients().values_list('id', 'priority', 'created_at', 'location', 'zone_id'))
+        self.ids = [row[0] for row in rows]
+        self.priority = np.array([row[1] for row in rows], dtype=float)
+        self.created = np.array([row[2].timestamp() for row in rows], dtype=float)
+        self.lat = np.array([row[3].y for row in rows], dtype=float)
+        self.lng = np.array([row[3].x for row in rows], dtype=float)
+        self.zone = np.array([row[4] if row[4] is not None else -1 for row in rows], dtype=int)
+        self.alive = np.ones(len(rows), dtype=bool)
+        self.loaded_at = time.monotonic()
+
+    def is_stale(self):
+        return time.monotonic() - self.loaded_at > live_settings.get('DISPATCH_QUEUE_REFRESH', 30)
+
+    def ranked_for(self, latitude, longitude, weights, zone_id=None):
+        """Indices of live clients, best first, for an agent at the given position and territory"""
+        if not self.alive.any():
+            return np.empty(0, dtype=int)
+        candidates = within_scope(np.flatnonzero(self.alive), self.zone, zone_id)
+        wait_hours = (time.time() - self.created[candidates]) / 3600
+        distance = haversine_km(latitude, longitude, self.lat[candidates], self.lng[candidates])
+        score = (
+            weights['priority'] * self.priority[candidates]
+            + weights['wait_hours'] * wait_hours
+            - weights['distance_km'] * distance
+        )
+        return candidates[np.argsort(-score)]
+
+    def remove(self, index):
+        self.alive[index] = False
+
+class Dispatcher:
+    """Background thread turning "agent is free" reports into assignments"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.queued = False
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.queue = ClientQueue()
+
+    def agent_free(self, agent_id):
+        """Report an agent as free; returns immediately"""
+        if not dispatch_enabled():
+            return
+        with self.lock:
+            self.pending.add(str(agent_id))
+            self.start()
+        self.wakeup.set()
+
+    def client_queued(self):
+        """Report a newly queued client, to be offered to idle online agents; returns immediately"""
+        if not dispatch_enabled():
+            return
+        with self.lock:
+            self.queued = True
+            self.start()
+        self.wakeup.set()
+
+    def start(self):
+        # Called with the lock held
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name='dispatcher', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            # Let a burst of completions accumulate into one batch
+            time.sleep(live_settings.get('DISPATCH_BATCH_WINDOW', 0.25))
+            self.wakeup.clear()
+
+            with self.lock:
+                agent_ids, self.pending = self.pending, set()
+                queued, self.queued = self.queued, False
+
+            close_old_connections()
+            try:
+                self.dispatch(agent_ids, queued=queued)
+            except Exception:
+                logger.exception("Dispatch batch failed")
+            finally:
+                close_old_connections()
+
+    def dispatch(self, agent_ids, queued=False):
+        """Assign the best queued client to each free agent; returns the assignments made.
+
+        queued means clients were added to the queue: it is reloaded and
+        every idle online agent is considered, not just agent_ids.
+        """
+        if queued or self.queue.is_stale():
+            self.queue.load()
+
+        online = presence.online_agent_ids()
+        if queued and online is not None:
+            agent_ids = set(agent_ids) | online
+        active_assignment = Assignment.objects.filter(agent=OuterRef('pk'), status__in=ACTIVE_STATUSES)
+        agents = User.objects.filter(
+            id__in=agent_ids,
+            role='agent',
+            is_active=True,
+            is_active_agent=True,
+            current_location__isnull=False
+        ).exclude(Exists(active_assignment)).only('id', 'current_location', 'zone_id')
+
+        weights = dict(DEFAULT_WEIGHTS, **live_settings.get('DISPATCH_WEIGHTS', {}))
+        assignments = []
+        for agent in sorted(agents, key=lambda agent: workload.agent_load(agent.id)):
+            if online is not None and str(agent.id) not in online:
+                continue
+            assignment = self.assign_best(agent, weights)
+            if assignment:
+                assignments.append(assignment)
+
+        if assignments:
+            logger.info("Dispatched %d of %d free agents", len(assignments), len(agent_ids))
+        return assignments
+
+    def assign_best(self, agent, weights):
+        location = agent.current_location
+        for index in self.queue.ranked_for(location.y, location.x, weights, agent.zone_id):
+            client_id = self.queue.ids[index]
+            try:
+                assignment = assign_client(agent.id, client_id, agent_location=location)
+            except AgentBusy:
+                return None
+            except ClientUnavailable:
+                # Taken elsewhere or deactivated since the queue was loaded
+                self.queue.remove(index)
+                continue
+            except AssignmentError:
+                return None
+            self.queue.remove(index)
+            return assignment
+        return None
+
+dispatcher = Dispatcher()
+
+def notify_agent_free(agent_id):
+    """Report an agent as free once the current transaction commits"""
+    transaction.on_commit(lambda: workload.record_free(agent_id))
+    if dispatch_enabled():
+        transaction.on_commit(lambda: dispatcher.agent_free(agent_id))
+
+def notify_client_queued():
+    """Offer queued clients to idle agents once the current transaction commits"""
+    if dispatch_enabled():
+        transaction.on_commit(dispatcher.client_queued)
+
+def client_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    if instance.is_active and (created or update_fields is None or 'is_active' in update_fields):
+        notify_client_queued()
+
+post_save.connect(client_saved, sender=Client, dispatch_uid='operations.dispatch.client_saved')
@@ -0,0 +1,115 @@
+"""
+On-site duration (ETA) estimates learned from completed assignments.
+
+The model is multiplicative: a global median duration scaled by factors for
+the agent, the area (a lat/lng grid cell of ETA_AREA_CELL_DEGREES) and the
+client priority. Each factor is the group median over the global median,
+shrunk towards 1 for groups with few samples. Training is a vectorized
+pandas job (the train_eta command); the model is a small JSON file at
+ETA_MODEL_PATH, loaded once per process, and a prediction is three dict
+lookups.
+"""
+import json
+import logging
+import math
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Samples at which a group's own median gets half the weight
+SHRINKAGE_SAMPLES = 10
+
+_model = None
+
+def cell_degrees():
+    return getattr(settings, 'ETA_AREA_CELL_DEGREES', 0.05)
+
+def area_key(latitude, longitude, size):
+    return f'{math.floor(latitude / size)}:{math.floor(longitude / size)}'
+
+def load_training_frame(since=None):
+    """Completed assignments with a measured duration as a DataFrame"""
+    from .models import Assignment
+
+    queryset = Assignment.objects.filter(status='completed', actual_duration__isnull=False)
+    if since:
+        queryset = queryset.filter(completed_at__gte=since)
+
+    rows = queryset.values_list('agent_id', 'client__priority', 'client__location', 'actual_duration')
+    frame = pd.DataFrame.from_records(
+        ((str(agent_id), priority, location.y, location.x, duration.total_seconds())
+         for agent_id, priority, location, duration in rows.iterator(chunk_size=5000)),
+        columns=['agent', 'priority', 'lat', 'lng', 'seconds']
+    )
+    return frame[frame['seconds'] > 0]
+
+def group_factors(frame, column, global_median):
+    """Shrunken median ratio per group value"""
+    grouped = frame.groupby(column)['seconds'].agg(['median', 'size'])
+    weight = grouped['size'] / (grouped['size'] + SHRINKAGE_SAMPLES)
+    factors = 1 + weight * (grouped['median'] / global_median - 1)
+    return {str(key): round(float(value), 4) for key, value in factors.items()}
+
+def train(frame):
+    """Fit the model from a training frame and return it as a dict"""
+    if frame.empty:
+        raise ValueError('No completed assignments with a measured duration')
+
+    size = cell_degrees()
+    frame = frame.assign(area=(
+        np.floor(frame['lat'] / size).astype(int).astype(str)
+        + ':'
+        + np.floor(frame['lng'] / size).astype(int).astype(str)
+    ))
+    global_median = float(frame['seconds'].median())
+
+    return {
+        'trained_at': timezone.now().isoformat(),
+        'samples': int(len(frame)),
+        'cell_degrees': size,
+        'global_seconds': global_median,
+        'agent': group_factors(frame, 'agent', global_median),
+        'area': group_factors(frame, 'area', global_median),
+        'priority': group_factors(frame, 'priority', global_median),
+    }
+
+def save_model(model, path=None):
+    path = path or settings.ETA_MODEL_PATH
+    with open(path, 'w') as f:
+        json.dump(model, f)
+    set_model(model)
+
+def set_model(model):
+    global _model
+    _model = model
+
+def load_model(path=None):
+    """Load the model from disk (once per process); returns None if there is none yet"""
+    global _model
+    path = path or settings.ETA_MODEL_PATH
+    try:
+        with open(path) as f:
+            _model = json.load(f)
+    except FileNotFoundError:
+        _model = {}
+    except (OSError, ValueError) as e:
+        logger.warning("Could not load ETA model from %s: %s", path, e)
+        _model = {}
+    return _model or None
+
+def estimate_duration(agent_id, latitude, longitude, priority):
+    """Predicted on-site duration as a timedelta, or None without a trained model"""
+    model = _model if _model is not None else load_model()
+    if not model:
+        return None
+
+    seconds = model['global_seconds']
+    seconds *= model['agent'].get(str(agent_id), 1.0)
+    if latitude is not None and longitude is not None:
+        seconds *= model['area'].get(area_key(latitude, longitude, model['cell_degrees']), 1.0)
+    seconds *= model['priority'].get(str(priority), 1.0)
+    return timedelta(seconds=round(seconds))
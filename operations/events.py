@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.db import transaction
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+from .models import AgentEvent
+from .outbox import enqueue_event
+
+# Prune the log only every few writes so the hot path stays a single INSERT
+PRUNE_EVERY = 20
+
+def record_agent_event(agent_id, data):
+    """Persist an event for an agent and return the payload tagged with its sequence number"""
+    event = AgentEvent.objects.create(
+        agent_id=agent_id,
+        event_type=data.get('type', ''),
+        payload=data
+    )
+
+    if event.id % PRUNE_EVERY == 0:
+        prune_agent_events(agent_id)
+
+    return dict(data, seq=event.id)
+
+def prune_agent_events(agent_id):
+    """Keep only the newest AGENT_EVENT_RETENTION events for an agent"""
+    retention = getattr(settings, 'AGENT_EVENT_RETENTION', 200)
+    cutoff = AgentEvent.objects.filter(
+        agent_id=agent_id
+    ).order_by('-id').values_list('id', flat=True)[retention:retention + 1]
+
+    cutoff = list(cutoff)
+    if cutoff:
+        AgentEvent.objects.filter(agent_id=agent_id, id__lte=cutoff[0]).delete()
+
+def get_missed_events(agent_id, last_seq):
+    """Return (events newer than last_seq, oldest first; truncated flag).
+
+    truncated is set when the replay is not a full catch-up: more than
+    AGENT_EVENT_REPLAY_LIMIT events were missed, or pruning already removed
+    events after last_seq. The client must then reload its state.
+    """
+    limit = getattr(settings, 'AGENT_EVENT_REPLAY_LIMIT', 100)
+    events = list(AgentEvent.objects.filter(
+        agent_id=agent_id,
+        id__gt=last_seq
+    ).order_by('-id')[:limit + 1])
+
+    truncated = len(events) > limit
+    events = events[:limit]
+    if events and not truncated:
+        # Sequence numbers are global, so a gap shows up as last_seq no longer being in the log
+        truncated = not AgentEvent.objects.filter(agent_id=agent_id, id__lte=last_seq).exists()
+
+    return [dict(event.payload, seq=event.id) for event in reversed(events)], truncated
+
+def send_agent_event(agent_id, data):
+    """Record an event and queue it for the agent's WebSocket group once the transaction commits"""
+    data = record_agent_event(agent_id, data)
+    enqueue_event(f'agent_{agent_id}', data)
+    return data
+
+def invalidate_agent_state(agent_id):
+    """Ask the agent's open consumers to reload their cached session state after commit"""
+    channel_layer = get_channel_layer()
+    transaction.on_commit(lambda: async_to_sync(channel_layer.group_send)(
+        f'agent_{agent_id}',
+        {'type': 'state_invalidate'}
+    ))
+
+def send_assignment_notification(assignment):
+    """Queue real-time notification for new assignment (published after commit)"""
+    notification_data = {
+        'type': 'assignment_notification',
+        'assignment_id': str(assignment.id),
+        'client_name': assignment.client.name,
+        'client_address': assignment.client.address,
+        'client_phone': assignment.client.phone,
+        'priority': assignment.client.get_priority_display(),
+        'latitude': assignment.client.latitude,
+        'longitude': assignment.client.longitude,
+        'assigned_at': assignment.assigned_at.isoformat(),
+        'message': f'New assignment: {assignment.client.name}'
+    }
+
+    # Send to specific agent (recorded so it can be replayed after a reconnect)
+    send_agent_event(assignment.agent_id, notification_data)
+
+    # Send to all managers
+    enqueue_event('managers', notification_data)
+
+def send_assignment_update(assignment):
+    """Queue real-time update for assignment status change (published after commit)"""
+    update_data = {
+        'type': 'assignment_update',
+        'assignment_id': str(assignment.id),
+        'status': assignment.status,
+        'status_display': assignment.get_status_display(),
+        'agent_name': assignment.agent.username,
+        'client_name': assignment.client.name,
+        'message': f'Assignment {assignment.get_status_display()}: {assignment.client.name}'
+    }
+
+    # Send to agent (recorded so it can be replayed after a reconnect)
+    send_agent_event(assignment.agent_id, update_data)
+
+    # Send to all managers
+    enqueue_event('managers', update_data)
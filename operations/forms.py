@@ -216,21 +216,6 @@ class BulkAssignmentForm(forms.Form):
         help_text="Choose how to assign clients to available agents"
     )
 
-    max_assignments_per_agent = forms.IntegerField(
-        min_value=1,
-        max_value=10,
-        initial=3,
-        widget=forms.NumberInput(attrs={'class': 'form-control'}),
-        help_text="Maximum number of assignments per agent"
-    )
-
-    only_available_agents = forms.BooleanField(
-        initial=True,
-        required=False,
-        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
-        help_text="Only assign to agents without current assignments"
-    )
-
 class ReportFilterForm(forms.Form):
     """Form for filtering reports"""
     date_from = forms.DateField(
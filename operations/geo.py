@@ -0,0 +1,12 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in km; accepts scalars or NumPy arrays (broadcast)"""
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
@@ -0,0 +1,127 @@
+"""
+Batched location uploads.
+
+Phones in poor coverage queue positions and upload them in one request (or
+one 'location_batch' WebSocket message) when they reconnect. A batch is a
+list of {latitude, longitude, accuracy, timestamp} points, timestamp being
+the client's epoch milliseconds. Points are validated as NumPy arrays -
+coordinates in range, timestamps no older than LOCATION_BATCH_MAX_AGE_HOURS
+and not in the future - and the valid ones are stored with a single
+bulk_create, keeping their client timestamps.
+
+Only the newest point moves User.current_location and is broadcast, and
+only if it is newer than User.location_updated_at (the time of the last
+known position, not of the last save), so a late batch never drags a live
+agent backwards while later chunks of one upload still move it forward. Anomaly detection runs on live pings
+only; mileage is updated from the batch.
+"""
+from datetime import datetime, timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db import transaction
+from django.utils import timezone
+from .analytics import mark_dirty
+from .mileage import last_position, record_batch
+from .models import LocationHistory
+from .territories import assign_zone
+
+# Accepted clock skew for client timestamps in the future, in seconds
+MAX_CLOCK_SKEW = 300
+
+class BatchError(ValueError):
+    """The batch as a whole is unusable; the message is safe to show to users"""
+
+def max_points():
+    return getattr(settings, 'LOCATION_BATCH_MAX_POINTS', 1000)
+
+def parse_points(points, now=None):
+    """Validate a list of point dicts; returns (valid mask, timestamps in s, lat, lng, accuracy)"""
+    if not isinstance(points, list) or not points:
+        raise BatchError('points must be a non-empty list')
+    if len(points) > max_points():
+        raise BatchError(f'At most {max_points()} points per batch')
+
+    def column(name):
+        values = []
+        for point in points:
+            value = point.get(name) if isinstance(point, dict) else None
+            try:
+                values.append(float(value) if value is not None else np.nan)
+            except (TypeError, ValueError):
+                values.append(np.nan)
+        return np.array(values, dtype=float)
+
+    lat = column('latitude')
+    lng = column('longitude')
+    accuracy = column('accuracy')
+    timestamps = column('timestamp') / 1000
+
+    now = (now or timezone.now()).timestamp()
+    oldest = now - getattr(settings, 'LOCATION_BATCH_MAX_AGE_HOURS', 72) * 3600
+    with np.errstate(invalid='ignore'):
+        valid = (
+            (np.abs(lat) <= 90)
+            & (np.abs(lng) <= 180)
+            & (timestamps >= oldest)
+            & (timestamps <= now + MAX_CLOCK_SKEW)
+            & (np.isnan(accuracy) | (accuracy >= 0))
+        )
+    return valid, timestamps, lat, lng, accuracy
+
+def store_location_batch(agent, points, assignment_id=None, assignment_since=None):
+    """Store a batch for an agent; returns a summary with the newest point if it was applied.
+
+    assignment_id tags points taken at or after assignment_since (all of
+    them when it is None).
+    """
+    valid, timestamps, lat, lng, accuracy = parse_points(points)
+
+    # Time order, valid points only
+    order = np.flatnonzero(valid)[np.argsort(timestamps[valid], kind='stable')]
+    timestamps, lat, lng, accuracy = timestamps[order], lat[order], lng[order], accuracy[order]
+    result = {'accepted': len(order), 'rejected': int(len(valid) - len(order)), 'latest': None}
+    if not len(order):
+        return result
+
+    since = assignment_since.timestamp() if assignment_since else None
+    # The agent may be a cached token user; the stored position is authoritative
+    previous, previous_at = last_position(agent.id)
+
+    with transaction.atomic():
+        LocationHistory.objects.bulk_create([
+            LocationHistory(
+                agent_id=agent.id,
+                location=Point(float(lng[i]), float(lat[i])),
+                accuracy=None if np.isnan(accuracy[i]) else float(accuracy[i]),
+                timestamp=datetime.fromtimestamp(timestamps[i], tz=dt_timezone.utc),
+                assignment_id=assignment_id if assignment_id and (since is None or timestamps[i] >= since) else None
+            )
+            for i in range(len(timestamps))
+        ], batch_size=1000)
+
+        record_batch(
+            agent.id, assignment_id, previous, previous_at, timestamps, lat, lng, accuracy,
+            assignment_since=since
+        )
+
+        # Late points land in hours that may already be rolled up
+        first, last = float(timestamps[0]), float(timestamps[-1])
+        transaction.on_commit(lambda: mark_dirty(first, last))
+
+        newest = len(timestamps) - 1
+        if previous_at is None or timestamps[newest] > previous_at.timestamp():
+            agent.current_location = Point(float(lng[newest]), float(lat[newest]))
+            agent.location_updated_at = datetime.fromtimestamp(timestamps[newest], tz=dt_timezone.utc)
+            fields = ['current_location', 'location_updated_at', 'updated_at']
+            if assign_zone(agent, float(lat[newest]), float(lng[newest])):
+                fields.append('zone')
+            agent.save(update_fields=fields)
+            result['latest'] = {
+                'latitude': float(lat[newest]),
+                'longitude': float(lng[newest]),
+                'accuracy': None if np.isnan(accuracy[newest]) else float(accuracy[newest]),
+                'timestamp': int(timestamps[newest] * 1000),
+            }
+
+    return result
@@ -0,0 +1,156 @@
+"""
+Runtime-tunable settings backed by the SystemSettings table.
+
+Every SystemSettings row is loaded once into process memory, and get(key,
+default) reads from that snapshot with no query. A row overrides the Django
+setting of the same name, so any value read through get() can be changed in
+the admin without a restart. Values are stored as text and coerced to the
+type of the Django setting (or the default): "true"/"false" for bools,
+numbers for ints and floats, JSON for dicts and lists.
+
+Saving or deleting a row publishes on the Redis channel
+LIVE_SETTINGS_CHANNEL after commit. Every worker runs a listener thread
+that reloads its snapshot when a message arrives, and the snapshot is also
+reloaded every LIVE_SETTINGS_REFRESH seconds in case a message was missed.
+
+Async code never queries: until the first load (done by the listener
+thread, or warmed with database_sync_to_async(ensure_loaded)) it sees the
+Django settings.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+import redis
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_delete, post_save
+from .models import SystemSettings
+from .presence import get_client
+
+logger = logging.getLogger(__name__)
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+def channel():
+    return getattr(settings, 'LIVE_SETTINGS_CHANNEL', 'live_settings:changed')
+
+def in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+def coerce(value, like):
+    """Parse a stored text value into the type of `like`"""
+    if isinstance(like, bool):
+        return value.strip().lower() in TRUE_VALUES
+    if isinstance(like, int):
+        number = float(value)
+        return int(number) if number.is_integer() else number
+    if isinstance(like, float):
+        return float(value)
+    if isinstance(like, (dict, list)):
+        parsed = json.loads(value)
+        if isinstance(like, dict) and not isinstance(parsed, dict):
+            raise ValueError('expected a JSON object')
+        if isinstance(like, list) and not isinstance(parsed, list):
+            raise ValueError('expected a JSON list')
+        return parsed
+    return value
+
+class LiveSettings:
+    """Per-process snapshot of SystemSettings with parsed values"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.parsed = {}
+        self.loaded_at = None
+        self.listener = None
+
+    def ensure_loaded(self):
+        """Load (or refresh) the snapshot if needed; never queries from async code"""
+        if in_event_loop():
+            return
+        refresh = getattr(settings, 'LIVE_SETTINGS_REFRESH', 300)
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > refresh:
+            self.load()
+
+    def load(self):
+        values = dict(SystemSettings.objects.values_list('key', 'value'))
+        with self.lock:
+            self.values = values
+            self.parsed = {}
+            self.loaded_at = time.monotonic()
+        self.start_listener()
+
+    def get(self, key, default=None):
+        """Value for key: SystemSettings row if present, else the Django setting, else default"""
+        self.ensure_loaded()
+        fallback = getattr(settings, key, default)
+        raw = self.values.get(key)
+        if raw is None:
+            return fallback
+
+        cached = self.parsed.get(key)
+        if cached is not None and cached[0] == raw:
+            return cached[1]
+        try:
+            value = coerce(raw, fallback)
+        except (TypeError, ValueError) as e:
+            logger.warning("Ignoring invalid value for setting %s: %s", key, e)
+            value = fallback
+        self.parsed[key] = (raw, value)
+        return value
+
+    def start_listener(self):
+        if not getattr(settings, 'LIVE_SETTINGS_LISTEN', True):
+            return
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self.listen, name='live-settings', daemon=True)
+                self.listener.start()
+
+    def listen(self):
+        """Reload the snapshot whenever another process publishes a change"""
+        while True:
+            try:
+                pubsub = get_client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(channel())
+                for message in pubsub.listen():
+                    close_old_connections()
+                    try:
+                        self.load()
+                    except Exception:
+                        logger.exception("Reloading live settings failed")
+                        self.loaded_at = None
+                    finally:
+                        close_old_connections()
+            except redis.RedisError as e:
+                logger.warning("Live settings listener disconnected: %s", e)
+                time.sleep(5)
+
+snapshot = LiveSettings()
+
+def get(key, default=None):
+    return snapshot.get(key, default)
+
+def ensure_loaded():
+    snapshot.ensure_loaded()
+
+def publish_change():
+    """Tell every worker (this one included) to reload its snapshot"""
+    snapshot.loaded_at = None
+    try:
+        get_client().publish(channel(), '1')
+    except redis.RedisError as e:
+        logger.warning("Publishing a settings change failed: %s", e)
+
+def setting_changed(sender, instance, **kwargs):
+    transaction.on_commit(publish_change)
+
+post_save.connect(setting_changed, sender=SystemSettings, dispatch_uid='operations.live_settings.saved')
+post_delete.connect(setting_changed, sender=SystemSettings, dispatch_uid='operations.live_settings.deleted')
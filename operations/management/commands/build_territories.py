@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from operations.territories import build_territories
+
+class Command(BaseCommand):
+    help = "Cluster active clients into territories (zones) and link neighbouring zones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--method', choices=['kmeans', 'grid'], default='kmeans')
+        parser.add_argument('--clusters', type=int, default=50, help="Number of k-means zones")
+        parser.add_argument('--cell-degrees', type=float, default=0.02, help="Grid cell size in degrees (grid method)")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        count = build_territories(
+            method=options['method'],
+            clusters=options['clusters'],
+            cell_degrees=options['cell_degrees'],
+            seed=options['seed']
+        )
+        if not count:
+            self.stdout.write(self.style.WARNING("No active clients; no territories built"))
+            return
+        self.stdout.write(self.style.SUCCESS(f"Built {count} territories ({options['method']})"))
@@ -0,0 +1,34 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from operations.mileage import day_bounds, recompute_assignments, recompute_day
+
+class Command(BaseCommand):
+    help = "Recompute daily agent mileage and assignment distance travelled from location history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Last day to recompute (YYYY-MM-DD, default: yesterday)")
+        parser.add_argument('--days', type=int, default=1, help="Number of days to recompute, ending at --date")
+
+    def handle(self, *args, **options):
+        try:
+            last = parse_date(options['date']) if options['date'] else timezone.localdate() - timedelta(days=1)
+        except ValueError:
+            last = None
+        if last is None:
+            raise CommandError("--date must be YYYY-MM-DD")
+
+        first = last - timedelta(days=options['days'] - 1)
+        day = first
+        total_km = 0.0
+        while day <= last:
+            totals = recompute_day(day)
+            total_km += sum(totals.values())
+            self.stdout.write(f"{day}: {len(totals)} agents, {sum(totals.values()):.1f} km")
+            day += timedelta(days=1)
+
+        updated = recompute_assignments(day_bounds(first)[0], day_bounds(last)[1])
+        self.stdout.write(self.style.SUCCESS(
+            f"Recomputed {options['days']} days ({total_km:.1f} km) and {updated} assignments"
+        ))
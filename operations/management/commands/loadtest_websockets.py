@@ -0,0 +1,222 @@
+import asyncio
+import random
+import time
+import numpy as np
+import websockets
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.gis.geos import Point
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from operations.models import User, LocationHistory
+from operations.protocol import MSGPACK_SUBPROTOCOL, MSGPACK_CODEC, JSON_CODEC, encode_location_frame
+
+USERNAME_PREFIX = 'loadtest_'
+
+# Synthetic agents start scattered around the map's default centre
+CENTER_LAT, CENTER_LNG = settings.LEAFLET_CONFIG['DEFAULT_CENTER']
+
+class Stats:
+    """Counters and latency samples collected during a run"""
+
+    def __init__(self):
+        self.sent = 0
+        self.acked = 0
+        self.broadcasts = 0
+        self.errors = 0
+        self.connect_failures = 0
+        self.latencies_ms = []
+
+class Command(BaseCommand):
+    help = (
+        "Simulate N agents streaming location updates and M managers receiving broadcasts "
+        "against a running ASGI server, then report latency percentiles and throughput. "
+        "Start the server first, e.g. CHANNEL_LAYER=memory daphne field_ops_system.asgi:application"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='ws://127.0.0.1:8000', help="Base WebSocket URL of the server")
+        parser.add_argument('--agents', type=int, default=100, help="Number of simulated agents")
+        parser.add_argument('--managers', type=int, default=5, help="Number of simulated managers")
+        parser.add_argument('--rate', type=float, default=1.0, help="Location updates per agent per second")
+        parser.add_argument('--duration', type=float, default=60.0, help="Seconds to send updates for")
+        parser.add_argument('--ramp-up', type=float, default=10.0, help="Seconds over which connections are opened")
+        parser.add_argument('--binary', action='store_true', help="Use MessagePack and binary location frames")
+        parser.add_argument('--cleanup', action='store_true', help="Delete the synthetic users after the run")
+
+    def handle(self, *args, **options):
+        agents = self.prepare_users('agent', options['agents'])
+        managers = self.prepare_users('manager', options['managers'])
+
+        history_before = LocationHistory.objects.count()
+        started = time.monotonic()
+        stats = asyncio.run(self.run(agents, managers, options))
+        elapsed = time.monotonic() - started
+        history_written = LocationHistory.objects.count() - history_before
+
+        self.report(stats, options, elapsed, history_written)
+
+        if options['cleanup']:
+            Session.objects.filter(session_key__in=[key for _, key in agents + managers]).delete()
+            deleted, _ = User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+            self.stdout.write(f"Deleted {deleted} synthetic rows and {len(agents) + len(managers)} sessions")
+
+    def prepare_users(self, role, count):
+        """Create (or reuse) synthetic users and return (user, session key) pairs"""
+        usernames = [f'{USERNAME_PREFIX}{role}_{i:05d}' for i in range(count)]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+
+        User.objects.bulk_create([
+            User(
+                username=username,
+                role=role,
+                password='!',  # unusable password
+                # Off duty, so dispatch and bulk assign never hand them real clients
+                is_active_agent=False,
+                current_location=Point(
+                    CENTER_LNG + random.uniform(-0.1, 0.1),
+                    CENTER_LAT + random.uniform(-0.1, 0.1)
+                ) if role == 'agent' else None,
+            )
+            for username in usernames if username not in existing
+        ])
+        # Users left by runs before synthetic agents were created off duty
+        User.objects.filter(username__in=existing).update(is_active_agent=False)
+
+        sessions = []
+        for user in User.objects.filter(username__in=usernames).order_by('username'):
+            session = SessionStore()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.create()
+            sessions.append((user, session.session_key))
+        return sessions
+
+    async def run(self, agents, managers, options):
+        stats = Stats()
+        deadline = time.monotonic() + options['ramp_up'] + options['duration']
+        ramp_step = options['ramp_up'] / max(len(agents) + len(managers), 1)
+
+        tasks = []
+        for index, (user, session_key) in enumerate(managers):
+            tasks.append(self.run_manager(session_key, index * ramp_step, deadline, stats, options))
+        offset = len(managers) * ramp_step
+        for index, (user, session_key) in enumerate(agents):
+            tasks.append(self.run_agent(session_key, offset + index * ramp_step, deadline, stats, options))
+
+        await asyncio.gather(*tasks)
+        return stats
+
+    async def connect(self, path, session_key, options):
+        subprotocols = [MSGPACK_SUBPROTOCOL] if options['binary'] else None
+        return await websockets.connect(
+            f"{options['url'].rstrip('/')}/ws/{path}/",
+            extra_headers={'Cookie': f'{settings.SESSION_COOKIE_NAME}={session_key}'},
+            subprotocols=subprotocols,
+            max_queue=None,
+        )
+
+    async def run_manager(self, session_key, delay, deadline, stats, options):
+        await asyncio.sleep(delay)
+        codec = MSGPACK_CODEC if options['binary'] else JSON_CODEC
+        try:
+            socket = await self.connect('manager', session_key, options)
+        except Exception:
+            stats.connect_failures += 1
+            return
+
+        async with socket:
+            while True:
+                remaining = deadline + 2 - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    frame = await asyncio.wait_for(socket.recv(), remaining)
+                except (asyncio.TimeoutError, websockets.ConnectionClosed):
+                    break
+
+                if isinstance(frame, bytes):
+                    data = codec.decode(bytes_data=frame)
+                else:
+                    data = codec.decode(text_data=frame)
+                if data.get('type') == 'location_update' and isinstance(data.get('timestamp'), (int, float)):
+                    stats.broadcasts += 1
+                    stats.latencies_ms.append(time.time() * 1000 - data['timestamp'])
+
+    async def run_agent(self, session_key, delay, deadline, stats, options):
+        await asyncio.sleep(delay)
+        try:
+            socket = await self.connect('agent', session_key, options)
+        except Exception:
+            stats.connect_failures += 1
+            return
+
+        async with socket:
+            receiver = asyncio.ensure_future(self.drain_agent(socket, stats, options))
+            interval = 1.0 / options['rate']
+            latitude = CENTER_LAT + random.uniform(-0.1, 0.1)
+            longitude = CENTER_LNG + random.uniform(-0.1, 0.1)
+
+            # Random phase so agents do not send in lockstep
+            await asyncio.sleep(random.uniform(0, interval))
+            while time.monotonic() < deadline:
+                latitude += random.uniform(-0.0005, 0.0005)
+                longitude += random.uniform(-0.0005, 0.0005)
+                timestamp = int(time.time() * 1000)
+                try:
+                    if options['binary']:
+                        await socket.send(encode_location_frame(latitude, longitude, 10.0, timestamp))
+                    else:
+                        await socket.send(JSON_CODEC.encode({
+                            'type': 'location_update',
+                            'latitude': latitude,
+                            'longitude': longitude,
+                            'accuracy': 10.0,
+                            'timestamp': timestamp,
+                        }))
+                except websockets.ConnectionClosed:
+                    break
+                stats.sent += 1
+                await asyncio.sleep(interval)
+
+            # Give in-flight acknowledgements a moment to arrive
+            await asyncio.sleep(1)
+            receiver.cancel()
+
+    async def drain_agent(self, socket, stats, options):
+        codec = MSGPACK_CODEC if options['binary'] else JSON_CODEC
+        try:
+            async for frame in socket:
+                if isinstance(frame, bytes):
+                    data = codec.decode(bytes_data=frame)
+                else:
+                    data = codec.decode(text_data=frame)
+                if data.get('type') == 'location_updated':
+                    stats.acked += 1
+                elif data.get('type') == 'error':
+                    stats.errors += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    def report(self, stats, options, elapsed, history_written):
+        send_window = options['duration'] or 1
+        self.stdout.write(f"Agents: {options['agents']}  Managers: {options['managers']}  "
+                          f"Rate: {options['rate']}/s  Duration: {options['duration']}s  "
+                          f"Protocol: {'msgpack' if options['binary'] else 'json'}")
+        self.stdout.write(f"Connect failures:   {stats.connect_failures}")
+        self.stdout.write(f"Updates sent:       {stats.sent} ({stats.sent / send_window:.1f} msg/s)")
+        self.stdout.write(f"Updates acked:      {stats.acked} ({stats.acked / send_window:.1f} msg/s)")
+        self.stdout.write(f"Errors:             {stats.errors}")
+        self.stdout.write(f"Broadcasts recv'd:  {stats.broadcasts} ({stats.broadcasts / send_window:.1f} msg/s)")
+        self.stdout.write(f"DB history writes:  {history_written} ({history_written / elapsed:.1f} rows/s over {elapsed:.1f}s)")
+
+        if stats.latencies_ms:
+            latencies = np.array(stats.latencies_ms)
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+            self.stdout.write(
+                f"Broadcast latency:  p50 {p50:.1f} ms  p90 {p90:.1f} ms  p99 {p99:.1f} ms  max {latencies.max():.1f} ms"
+            )
+        else:
+            self.stdout.write("Broadcast latency:  no samples")
@@ -0,0 +1,26 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from operations.outbox import relay_pending_events, purge_published_events
+
+class Command(BaseCommand):
+    help = "Publish outbox events left behind when a relay failed mid-batch, and purge old ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep polling instead of exiting after one pass")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds between polls when looping")
+        parser.add_argument('--batch-size', type=int, default=None, help="Events published per transaction")
+        parser.add_argument('--purge-after', type=int, default=24, help="Delete published events older than this many hours")
+
+    def handle(self, *args, **options):
+        while True:
+            published = relay_pending_events(options['batch_size'])
+            purged = purge_published_events(timezone.now() - timedelta(hours=options['purge_after']))
+
+            if published or purged:
+                self.stdout.write(f"Published {published} events, purged {purged}")
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from operations.analytics import parse_range, rollup_pending, rollup_range
+
+class Command(BaseCommand):
+    help = "Bin location history into hourly grid-cell rollups (incremental; run hourly from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="Rebuild from this ISO datetime instead of continuing the last run")
+        parser.add_argument('--end', help="Rebuild up to this ISO datetime (default: now)")
+
+    def handle(self, *args, **options):
+        if options['start']:
+            try:
+                start, end = parse_range(options['start'], options['end'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            written = rollup_range(start, min(end, timezone.now()))
+        else:
+            written = rollup_pending()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} rollup rows"))
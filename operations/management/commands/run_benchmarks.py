@@ -0,0 +1,90 @@
+import json
+import platform
+import subprocess
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from operations.benchmarking import CASES, BenchmarkData, start_stub_route_server
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the operations hot paths on seeded synthetic data and write timings "
+        "and query counts to JSON. All data is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--case', action='append', choices=sorted(CASES), help="Run only these cases (repeatable)")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--agents', type=int, default=200)
+        parser.add_argument('--clients', type=int, default=5000)
+        parser.add_argument('--history', type=int, default=50000, help="Number of LocationHistory rows to seed")
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', default='benchmark_results.json', help="Where to write the results")
+        parser.add_argument('--compare', help="Baseline JSON from an earlier run to diff against")
+
+    def handle(self, *args, **options):
+        stub = start_stub_route_server()
+        test_settings = override_settings(
+            CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+            PRESENCE_ENABLED=False,
+            OPENROUTESERVICE_API_KEY='benchmark',
+            OPENROUTESERVICE_URL=f'http://127.0.0.1:{stub.server_port}/',
+            ALLOWED_HOSTS=['*'],
+        )
+
+        results = {}
+        try:
+            with test_settings, transaction.atomic():
+                self.stdout.write("Seeding synthetic data...")
+                data = BenchmarkData(options['seed'], options['agents'], options['clients'], options['history'])
+
+                for name in options['case'] or sorted(CASES):
+                    self.stdout.write(f"Running {name}...")
+                    results[name] = CASES[name](data, options['repeat'])
+                    self.stdout.write(
+                        f"  median {results[name]['median_ms']} ms, p95 {results[name]['p95_ms']} ms, "
+                        f"{results[name]['queries']} queries"
+                    )
+
+                transaction.set_rollback(True)
+        finally:
+            stub.shutdown()
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'commit': self.current_commit(),
+            'python': platform.python_version(),
+            'params': {key: options[key] for key in ('seed', 'agents', 'clients', 'history', 'repeat')},
+            'results': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def current_commit(self):
+        try:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, path, results):
+        try:
+            with open(path) as f:
+                baseline = json.load(f)['results']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Could not read baseline {path}: {e}")
+
+        self.stdout.write(f"\n{'case':<24}{'median ms':>22}{'queries':>16}")
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            before = baseline[name]
+            change = (result['median_ms'] - before['median_ms']) / before['median_ms'] * 100 if before['median_ms'] else 0
+            self.stdout.write(
+                f"{name:<24}{before['median_ms']:>9.2f} -> {result['median_ms']:>7.2f} ({change:+.0f}%)"
+                f"{before['queries']:>7} -> {result['queries']:<5}"
+            )
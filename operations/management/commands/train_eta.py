@@ -0,0 +1,26 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from operations.eta import load_training_frame, train, save_model
+
+class Command(BaseCommand):
+    help = "Fit the assignment duration (ETA) model from completed assignments and save it to ETA_MODEL_PATH"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help="Train on assignments completed in the last N days (0 = all)")
+        parser.add_argument('--output', help="Write the model here instead of ETA_MODEL_PATH")
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days']) if options['days'] else None
+        frame = load_training_frame(since)
+
+        try:
+            model = train(frame)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        save_model(model, options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Trained on {model['samples']} assignments: global median {model['global_seconds'] / 60:.1f} min, "
+            f"{len(model['agent'])} agents, {len(model['area'])} areas"
+        ))
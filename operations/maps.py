@@ -0,0 +1,105 @@
+"""
+Server-side clustering of map markers.
+
+Instead of one Leaflet marker per client and agent, the dashboard asks for
+the markers inside the visible bounding box at the current zoom. Points are
+grouped with PostGIS ST_SnapToGrid on a grid of MAP_CLUSTER_CELLS_PER_TILE
+cells per 256px tile, so the response size depends on the viewport, not on
+the number of rows. Clients are also available as Mapbox vector tiles
+(ST_AsMVT), cached per tile for MAP_TILE_CACHE_TIMEOUT seconds.
+"""
+from django.conf import settings
+from django.contrib.gis.db.models import Collect
+from django.contrib.gis.db.models.functions import Centroid, SnapToGrid
+from django.contrib.gis.geos import Polygon
+from django.core.cache import cache
+from django.db import connections, router
+from django.db.models import CharField, Count, Max
+from django.db.models.functions import Cast
+from .models import Client
+
+MAX_ZOOM = 22
+
+CLIENT_TILE_SQL = """
+WITH bounds AS (
+    SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom
+),
+clusters AS (
+    SELECT COUNT(*) AS count,
+           MAX(c.id::text) AS id,
+           MAX(c.priority) AS priority,
+           ST_Centroid(ST_Collect(c.location)) AS location
+    FROM operations_client c, bounds
+    WHERE c.is_active AND c.location && ST_Transform(bounds.geom, 4326)
+    GROUP BY ST_SnapToGrid(c.location, %(cell)s)
+)
+SELECT ST_AsMVT(tile, 'clients') FROM (
+    SELECT clusters.count,
+           CASE WHEN clusters.count = 1 THEN clusters.id END AS id,
+           clusters.priority,
+           ST_AsMVTGeom(ST_Transform(clusters.location, 3857), bounds.geom) AS geom
+    FROM clusters, bounds
+) AS tile
+"""
+
+def parse_bbox(value):
+    """'west,south,east,north' in degrees -> tuple of floats; raises ValueError"""
+    west, south, east, north = (float(part) for part in value.split(','))
+    if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+        raise ValueError('Invalid bounding box')
+    return west, south, east, north
+
+def parse_zoom(value):
+    zoom = int(value)
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError('Invalid zoom')
+    return zoom
+
+def cell_degrees(zoom):
+    """Grid cell size in degrees for a Web Mercator zoom level"""
+    return 360 / (2 ** zoom) / getattr(settings, 'MAP_CLUSTER_CELLS_PER_TILE', 4)
+
+def cluster_markers(queryset, field, bbox, zoom, extra=None):
+    """Markers for queryset rows inside bbox, grouped into grid cells.
+
+    Returns dicts with lat, lng and count; single-row cells also carry the
+    row's id. extra maps output names to aggregates added to every cluster.
+    """
+    envelope = Polygon.from_bbox(bbox)
+    envelope.srid = 4326
+    rows = (
+        queryset.filter(**{f'{field}__bboxoverlaps': envelope})
+        .annotate(cell=SnapToGrid(field, cell_degrees(zoom)))
+        .order_by()
+        .values('cell')
+        .annotate(
+            count=Count('pk'),
+            center=Centroid(Collect(field)),
+            sample=Max(Cast('pk', output_field=CharField())),
+            **(extra or {})
+        )
+    )
+
+    markers = []
+    for row in rows:
+        marker = {'lat': row['center'].y, 'lng': row['center'].x, 'count': row['count']}
+        if row['count'] == 1:
+            marker['id'] = row['sample']
+        for name in extra or {}:
+            marker[name] = row[name]
+        markers.append(marker)
+    return markers
+
+def tile_cache_key(layer, z, x, y):
+    return f'maptile:{layer}:{z}:{x}:{y}'
+
+def client_tile(z, x, y):
+    """Clustered active clients for one tile as Mapbox vector tile bytes (cached)"""
+    key = tile_cache_key('clients', z, x, y)
+    tile = cache.get(key)
+    if tile is None:
+        with connections[router.db_for_read(Client)].cursor() as cursor:
+            cursor.execute(CLIENT_TILE_SQL, {'z': z, 'x': x, 'y': y, 'cell': cell_degrees(z)})
+            tile = bytes(cursor.fetchone()[0] or b'')
+        cache.set(key, tile, getattr(settings, 'MAP_TILE_CACHE_TIMEOUT', 60))
+    return tile
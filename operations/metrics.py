@@ -0,0 +1,172 @@
+"""
+Lightweight in-process metrics with a Prometheus text endpoint.
+
+Nothing is recorded unless METRICS_ENABLED is set: the middleware removes
+itself from the stack and the timers below return immediately. Metrics are
+per process, so scrape each ASGI/WSGI worker separately.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+def metrics_enabled():
+    return getattr(settings, 'METRICS_ENABLED', False)
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{str(value)}"' for name, value in pairs) + '}'
+
+class Counter:
+    """Monotonic counter with labels"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield f'{self.name}{format_labels(key)} {value}'
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                # per-bucket counts (+Inf last), then sum and count
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self.lock:
+            items = [(key, list(series)) for key, series in self.values.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                yield f'{self.name}_bucket{format_labels(key, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_sum{format_labels(key)} {series[-2]}'
+            yield f'{self.name}_count{format_labels(key)} {series[-1]}'
+
+def register(metric):
+    with _registry_lock:
+        return _registry.setdefault(metric.name, metric)
+
+def render():
+    """Render every registered metric in the Prometheus text format"""
+    lines = []
+    for metric in list(_registry.values()):
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+HTTP_REQUEST_SECONDS = register(Histogram(
+    'fieldops_http_request_duration_seconds', 'HTTP request latency by view'))
+HTTP_REQUESTS = register(Counter(
+    'fieldops_http_requests_total', 'HTTP requests by view and status'))
+HTTP_REQUEST_QUERIES = register(Histogram(
+    'fieldops_http_request_db_queries', 'Database queries per HTTP request by view', QUERY_BUCKETS))
+WS_MESSAGE_SECONDS = register(Histogram(
+    'fieldops_ws_message_duration_seconds', 'WebSocket message handling latency by consumer and type'))
+WS_CONNECTIONS = register(Counter(
+    'fieldops_ws_connections_total', 'WebSocket connections opened by consumer'))
+GROUP_SEND_SECONDS = register(Histogram(
+    'fieldops_group_send_duration_seconds', 'Channel layer group_send latency by source'))
+ROUTING_SECONDS = register(Histogram(
+    'fieldops_routing_request_duration_seconds', 'External routing API latency by provider'))
+
+@contextmanager
+def timer(histogram, **labels):
+    """Observe the duration of the block; free when metrics are disabled"""
+    if not metrics_enabled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+class QueryCounter:
+    """Database execute wrapper counting queries and their total time"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+@contextmanager
+def count_queries():
+    """Count queries on every configured database for the duration of the block"""
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        yield counter
+
+class MetricsMiddleware:
+    """Records latency, status and query count for every request"""
+
+    def __init__(self, get_response):
+        if not metrics_enabled():
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with count_queries() as queries:
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        HTTP_REQUEST_SECONDS.observe(duration, view=view)
+        HTTP_REQUEST_QUERIES.observe(queries.count, view=view)
+        HTTP_REQUESTS.inc(view=view, status=response.status_code)
+        return response
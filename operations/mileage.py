@@ -0,0 +1,224 @@
+"""
+Distance travelled per agent, per day and per assignment.
+
+Every location ping adds the haversine distance from the agent's previous
+position to AgentMileage (one row per agent per local day) and to the
+active assignment's distance_travelled, so mileage reports never scan raw
+history. Steps shorter than the GPS accuracy (at least
+MILEAGE_MIN_STEP_METERS) are treated as jitter and steps implying more than
+MILEAGE_MAX_SPEED_KMH as glitches; neither is counted.
+
+A batch of queued points (see ingest.py) often arrives after live pings
+have already moved the agent past it, and those pings counted straight
+steps across the gap. record_batch then counts the difference between the
+stored track with the batch spliced in and the track without it.
+
+The compute_mileage command recomputes whole days from LocationHistory with
+the same rules, vectorized over NumPy arrays, to backfill or repair totals.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Max, Min, Q
+from django.utils import timezone
+from .geo import haversine_km
+from .models import AgentMileage, Assignment, LocationHistory, User
+
+UPSERT_SQL = """
+INSERT INTO operations_agentmileage (agent_id, date, distance_km, updated_at)
+VALUES (%s, %s, %s, NOW())
+ON CONFLICT (agent_id, date)
+DO UPDATE SET distance_km = operations_agentmileage.distance_km + EXCLUDED.distance_km, updated_at = NOW()
+"""
+
+def countable(km, seconds, accuracy_m=None):
+    """Mask (or bool) of steps that count as travel"""
+    km = np.asarray(km, dtype=float)
+    min_km = getattr(settings, 'MILEAGE_MIN_STEP_METERS', 15) / 1000
+    if accuracy_m is not None:
+        min_km = np.maximum(min_km, np.nan_to_num(np.asarray(accuracy_m, dtype=float)) / 1000)
+    max_km = np.asarray(seconds, dtype=float) / 3600 * getattr(settings, 'MILEAGE_MAX_SPEED_KMH', 150)
+    return (km >= min_km) & (km <= max_km)
+
+def last_position(agent_id):
+    """Stored ((lat, lng) or None, location_updated_at) of an agent, read fresh from the database"""
+    row = User.objects.filter(pk=agent_id).values_list('current_location', 'location_updated_at').first()
+    if row is None:
+        return None, None
+    location, located_at = row
+    return ((location.y, location.x) if location else None), located_at
+
+def record_movement(agent_id, assignment_id, previous, previous_at, latitude, longitude, accuracy=None):
+    """Add the step from the previous position to the agent's mileage; returns km counted"""
+    if previous is None or previous_at is None:
+        return 0.0
+
+    now = timezone.now()
+    km = float(haversine_km(previous[0], previous[1], latitude, longitude))
+    if not countable(km, (now - previous_at).total_seconds(), accuracy):
+        return 0.0
+
+    with connection.cursor() as cursor:
+        cursor.execute(UPSERT_SQL, [agent_id, timezone.localdate(now), km])
+    if assignment_id:
+        Assignment.objects.filter(id=assignment_id).update(distance_travelled=F('distance_travelled') + km)
+    return km
+
+def stored_track(agent_id, first, last):
+    """Stored points from the last one before first to the first one after last (epoch seconds), as arrays"""
+    history = LocationHistory.objects.filter(agent_id=agent_id)
+    start = datetime.fromtimestamp(first, tz=dt_timezone.utc)
+    end = datetime.fromtimestamp(last, tz=dt_timezone.utc)
+    bounds = history.aggregate(
+        before=Max('timestamp', filter=Q(timestamp__lt=start)),
+        after=Min('timestamp', filter=Q(timestamp__gt=end))
+    )
+    rows = history.filter(
+        timestamp__gte=bounds['before'] or start,
+        timestamp__lte=bounds['after'] or end
+    ).order_by('timestamp').values_list('timestamp', 'location', 'accuracy')
+
+    timestamps, lat, lng, accuracy = [], [], [], []
+    for timestamp, location, point_accuracy in rows:
+        timestamps.append(timestamp.timestamp())
+        lat.append(location.y)
+        lng.append(location.x)
+        accuracy.append(point_accuracy if point_accuracy is not None else np.nan)
+    return (
+        np.array(timestamps, dtype=float),
+        np.array(lat, dtype=float),
+        np.array(lng, dtype=float),
+        np.array(accuracy, dtype=float),
+    )
+
+def km_by_day(timestamps, km):
+    by_day = {}
+    for timestamp, distance in zip(timestamps, km):
+        if distance > 0:
+            day = timezone.localdate(datetime.fromtimestamp(timestamp, tz=dt_timezone.utc))
+            by_day[day] = by_day.get(day, 0.0) + float(distance)
+    return by_day
+
+def record_batch(agent_id, assignment_id, previous, previous_at, timestamps, lat, lng, accuracy, assignment_since=None):
+    """Add the steps of a time-ordered batch of points (epoch seconds) to the agent's mileage; returns km.
+
+    The batch must already be stored. Only steps ending at or after
+    assignment_since (epoch seconds) count towards the assignment.
+    """
+    if previous_at is None or previous_at.timestamp() <= timestamps[0]:
+        # The batch continues from the last known position
+        if previous is not None and previous_at is not None:
+            timestamps = np.concatenate([[previous_at.timestamp()], timestamps])
+            lat = np.concatenate([[previous[0]], lat])
+            lng = np.concatenate([[previous[1]], lng])
+            accuracy = np.concatenate([[np.nan], accuracy])
+        km = step_distances([agent_id] * len(timestamps), timestamps, lat, lng, accuracy)
+        by_day = km_by_day(timestamps, km)
+        assigned = km[timestamps >= assignment_since].sum() if assignment_since else km.sum()
+    else:
+        # Live pings already moved the agent past (part of) the batch and counted steps across
+        # the gap; count the difference between the track with the batch and the track without it
+        track_ts, track_lat, track_lng, track_accuracy = stored_track(agent_id, timestamps[0], timestamps[-1])
+        live = ~np.isin(np.round(track_ts * 1000), np.round(timestamps * 1000))
+        new_km = step_distances([agent_id] * len(track_ts), track_ts, track_lat, track_lng, track_accuracy)
+        old_km = step_distances(
+            [agent_id] * int(live.sum()), track_ts[live], track_lat[live], track_lng[live], track_accuracy[live]
+        )
+        by_day = km_by_day(track_ts, new_km)
+        for day, distance in km_by_day(track_ts[live], old_km).items():
+            by_day[day] = by_day.get(day, 0.0) - distance
+        if assignment_since:
+            assigned = new_km[track_ts >= assignment_since].sum() - old_km[track_ts[live] >= assignment_since].sum()
+        else:
+            assigned = new_km.sum() - old_km.sum()
+
+    by_day = {day: distance for day, distance in by_day.items() if abs(distance) > 1e-9}
+    if by_day:
+        with connection.cursor() as cursor:
+            cursor.executemany(UPSERT_SQL, [[agent_id, day, distance] for day, distance in by_day.items()])
+    if assignment_id and abs(assigned) > 1e-9:
+        Assignment.objects.filter(id=assignment_id).update(distance_travelled=F('distance_travelled') + float(assigned))
+    return sum(by_day.values())
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+def load_points(start, end, agent_id=None):
+    """Location history in [start, end) (of one agent, if given) as arrays sorted by agent, then time"""
+    rows = LocationHistory.objects.filter(timestamp__gte=start, timestamp__lt=end)
+    if agent_id is not None:
+        rows = rows.filter(agent_id=agent_id)
+    rows = rows.order_by(
+        'agent_id', 'timestamp'
+    ).values_list('agent_id', 'assignment_id', 'timestamp', 'location', 'accuracy')
+
+    agents, assignments, timestamps, lat, lng, accuracy = [], [], [], [], [], []
+    for agent_id, assignment_id, timestamp, location, point_accuracy in rows.iterator(chunk_size=10000):
+        agents.append(agent_id)
+        assignments.append(assignment_id)
+        timestamps.append(timestamp.timestamp())
+        lat.append(location.y)
+        lng.append(location.x)
+        accuracy.append(point_accuracy if point_accuracy is not None else np.nan)
+    return (
+        agents,
+        assignments,
+        np.array(timestamps, dtype=float),
+        np.array(lat, dtype=float),
+        np.array(lng, dtype=float),
+        np.array(accuracy, dtype=float),
+    )
+
+def step_distances(agents, timestamps, lat, lng, accuracy):
+    """Counted km for each step into point i (from point i - 1 of the same agent)"""
+    km = np.zeros(len(timestamps))
+    if len(timestamps) < 2:
+        return km
+    codes = np.unique(np.array([str(agent) for agent in agents]), return_inverse=True)[1].ravel()
+    steps = haversine_km(lat[:-1], lng[:-1], lat[1:], lng[1:])
+    valid = (codes[1:] == codes[:-1]) & countable(steps, np.diff(timestamps), accuracy[1:])
+    km[1:] = np.where(valid, steps, 0.0)
+    return km
+
+def recompute_day(day):
+    """Rebuild one local day's AgentMileage rows from history; returns {agent_id: km}"""
+    start, end = day_bounds(day)
+    agents, _, timestamps, lat, lng, accuracy = load_points(start, end)
+    km = step_distances(agents, timestamps, lat, lng, accuracy)
+
+    totals = {}
+    for agent_id, distance in zip(agents, km):
+        totals[agent_id] = totals.get(agent_id, 0.0) + distance
+
+    with transaction.atomic():
+        AgentMileage.objects.filter(date=day).delete()
+        AgentMileage.objects.bulk_create([
+            AgentMileage(agent_id=agent_id, date=day, distance_km=round(distance, 3))
+            for agent_id, distance in totals.items()
+        ])
+    return totals
+
+def recompute_assignments(start, end):
+    """Rebuild distance_travelled for assignments created and finished within [start, end)"""
+    # Assignments running past the window would only get part of their distance
+    complete = list(Assignment.objects.filter(assigned_at__gte=start, completed_at__lt=end).only('id', 'agent_id'))
+    by_agent = {}
+    for assignment in complete:
+        by_agent.setdefault(assignment.agent_id, []).append(assignment)
+
+    # One agent's history at a time, so memory stays bounded for long windows
+    for agent_id, agent_assignments in by_agent.items():
+        agents, assignments, timestamps, lat, lng, accuracy = load_points(start, end, agent_id)
+        km = step_distances(agents, timestamps, lat, lng, accuracy)
+
+        totals = {}
+        for assignment_id, distance in zip(assignments, km):
+            if assignment_id is not None:
+                totals[assignment_id] = totals.get(assignment_id, 0.0) + distance
+        for assignment in agent_assignments:
+            assignment.distance_travelled = round(totals.get(assignment.id, 0.0), 3)
+
+    Assignment.objects.bulk_update(complete, ['distance_travelled'], batch_size=1000)
+    return len(complete)
@@ -15,6 +15,8 @@ class User(AbstractUser):
     phone = models.CharField(max_length=15, blank=True, null=True)
     current_location = models.PointField(null=True, blank=True, help_text="Current GPS location")
     is_active_agent = models.BooleanField(default=True, help_text="Is agent currently working")
+    location_updated_at = models.DateTimeField(null=True, blank=True, help_text="When current_location was recorded")
+    zone = models.ForeignKey('Territory', on_delete=models.SET_NULL, null=True, blank=True, related_name='agents', help_text="Territory of the agent's last known location")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -28,6 +30,20 @@ class User(AbstractUser):
     def current_assignment(self):
         return self.assignments.filter(status='assigned').first()
 
+class Territory(models.Model):
+    """Cluster of nearby clients (built by the build_territories command)"""
+    name = models.CharField(max_length=100)
+    center = models.PointField()
+    neighbours = models.ManyToManyField('self', blank=True)
+    client_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
 class Client(models.Model):
     PRIORITY_CHOICES = (
         (1, 'Low'),
@@ -45,6 +61,7 @@ class Client(models.Model):
     priority = models.IntegerField(choices=PRIORITY_CHOICES, default=2)
     notes = models.TextField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
+    zone = models.ForeignKey(Territory, on_delete=models.SET_NULL, null=True, blank=True, related_name='clients')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -89,6 +106,7 @@ class Assignment(models.Model):
     estimated_duration = models.DurationField(null=True, blank=True)
     actual_duration = models.DurationField(null=True, blank=True)
     distance_to_client = models.FloatField(null=True, blank=True, help_text="Distance in kilometers")
+    distance_travelled = models.FloatField(default=0, help_text="Kilometers travelled while assigned (from location history)")
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='created_assignments')
 
     class Meta:
@@ -98,6 +116,19 @@ class Assignment(models.Model):
             models.Index(fields=['assigned_at']),
             models.Index(fields=['agent', 'status']),
         ]
+        constraints = [
+            # At most one active assignment per agent and per client
+            models.UniqueConstraint(
+                fields=['agent'],
+                condition=models.Q(status__in=['assigned', 'in_progress']),
+                name='one_active_assignment_per_agent'
+            ),
+            models.UniqueConstraint(
+                fields=['client'],
+                condition=models.Q(status__in=['assigned', 'in_progress']),
+                name='one_active_assignment_per_client'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.agent.username} -> {self.client.name} ({self.get_status_display()})"
@@ -120,7 +151,7 @@ class LocationHistory(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     agent = models.ForeignKey(User, on_delete=models.CASCADE, related_name='location_history')
     location = models.PointField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now, help_text="When the position was taken (client time for batched uploads)")
     accuracy = models.FloatField(null=True, blank=True, help_text="GPS accuracy in meters")
     assignment = models.ForeignKey(Assignment, on_delete=models.SET_NULL, null=True, blank=True)
 
@@ -134,12 +165,48 @@ class LocationHistory(models.Model):
     def __str__(self):
         return f"{self.agent.username} at {self.timestamp}"
 
+class AgentMileage(models.Model):
+    """Kilometers travelled by an agent on one day (see operations/mileage.py)"""
+    agent = models.ForeignKey(User, on_delete=models.CASCADE, related_name='mileage')
+    date = models.DateField()
+    distance_km = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['agent', 'date'], name='unique_agent_mileage_per_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.agent.username} {self.date}: {self.distance_km:.1f} km"
+
+class LocationRollup(models.Model):
+    """Agent location samples and dwell time per grid cell per hour (see operations/analytics.py)"""
+    id = models.BigAutoField(primary_key=True)
+    hour = models.DateTimeField()
+    cell_x = models.IntegerField()
+    cell_y = models.IntegerField()
+    samples = models.IntegerField()
+    seconds = models.FloatField(help_text="Agent time spent in the cell")
+    agents = models.IntegerField(help_text="Distinct agents seen in the cell during the hour")
+
+    class Meta:
+        ordering = ['hour']
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'cell_x', 'cell_y'], name='unique_location_rollup_cell'),
+        ]
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H:00} ({self.cell_x}, {self.cell_y})"
+
 class NotificationLog(models.Model):
     NOTIFICATION_TYPES = (
         ('assignment', 'New Assignment'),
         ('update', 'Assignment Update'),
         ('completion', 'Assignment Completed'),
         ('system', 'System Notification'),
+        ('alert', 'Agent Alert'),
     )
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -180,3 +247,37 @@ class SystemSettings(models.Model):
 
     def __str__(self):
         return f"{self.key}: {self.value[:50]}"
+
+class AgentEvent(models.Model):
+    """Bounded per-agent event log used to replay missed WebSocket messages"""
+    id = models.BigAutoField(primary_key=True)
+    agent = models.ForeignKey(User, on_delete=models.CASCADE, related_name='events')
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['agent', 'id']),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.event_type} -> {self.agent_id}"
+
+class OutboxEvent(models.Model):
+    """Channel-layer message written in the same transaction as the change it announces"""
+    id = models.BigAutoField(primary_key=True)
+    group = models.CharField(max_length=100)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['published_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} -> {self.group}"
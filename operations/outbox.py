@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+from .models import OutboxEvent
+from . import metrics
+
+# Arbitrary key for the PostgreSQL advisory lock that serializes relays,
+# which keeps events in commit order across workers. It is held for the
+# session rather than a transaction: events are claimed in a short
+# transaction and published to Redis after it commits, with the lock still
+# held so batches go out in order. A crash between the two loses the claimed
+# batch (at most OUTBOX_BATCH_SIZE events).
+RELAY_LOCK_KEY = 727001
+
+def enqueue_event(group, data):
+    """Queue a channel-layer message to be published once the current transaction commits"""
+    enqueue_events([(group, data)])
+
+def enqueue_events(messages):
+    """Queue several (group, data) messages with a single INSERT"""
+    OutboxEvent.objects.bulk_create([
+        OutboxEvent(group=group, payload=data) for group, data in messages
+    ])
+    relay_on_commit()
+
+def relay_on_commit():
+    """Run the relay once when the current transaction commits.
+
+    The data is already committed by then, so a Redis failure is only
+    logged (robust) and the events wait for the next relay or relay_outbox.
+    """
+    pending = transaction.get_connection().run_on_commit
+    if any(func is relay_pending_events for _, func, *_ in pending):
+        return
+    transaction.on_commit(relay_pending_events, robust=True)
+
+def relay_pending_events(batch_size=None):
+    """Publish unpublished outbox events in id order, returning how many were sent"""
+    batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 100)
+    published = 0
+
+    while True:
+        if not acquire_relay_lock():
+            # Another relay holds the lock; it re-checks the queue after releasing it
+            return published
+        try:
+            while True:
+                events = claim_events(batch_size)
+                if not events:
+                    break
+                publish_events(events)
+                published += len(events)
+        finally:
+            release_relay_lock()
+
+        # A relay turned away while we held the lock left its events to us
+        if not OutboxEvent.objects.filter(published_at__isnull=True).exists():
+            return published
+
+def claim_events(batch_size):
+    """Mark the next batch of events as published in one short transaction and return them"""
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.filter(published_at__isnull=True).order_by('id')[:batch_size]
+        )
+        if events:
+            OutboxEvent.objects.filter(
+                id__in=[event.id for event in events]
+            ).update(published_at=timezone.now())
+    return events
+
+def publish_events(events):
+    """Send claimed events to the channel layer (no transaction open)"""
+    channel_layer = get_channel_layer()
+    for index, event in enumerate(events):
+        try:
+            with metrics.timer(metrics.GROUP_SEND_SECONDS, source='outbox'):
+                async_to_sync(channel_layer.group_send)(
+                    event.group,
+                    {
+                        'type': 'send_notification',
+                        'data': event.payload
+                    }
+                )
+        except Exception:
+            # Hand the unsent events back to the next relay
+            OutboxEvent.objects.filter(
+                id__in=[unsent.id for unsent in events[index:]]
+            ).update(published_at=None)
+            raise
+
+def acquire_relay_lock():
+    """Take the session-level relay lock without waiting"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [RELAY_LOCK_KEY])
+        return cursor.fetchone()[0]
+
+def release_relay_lock():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", [RELAY_LOCK_KEY])
+
+def purge_published_events(older_than):
+    """Delete events published before the given datetime"""
+    deleted, _ = OutboxEvent.objects.filter(published_at__lt=older_than).delete()
+    return deleted
@@ -0,0 +1,97 @@
+"""
+Pagination for very large tables (LocationHistory, NotificationLog).
+
+Counting is the expensive part of paging tens of millions of rows, so
+EstimatedCountPaginator asks PostgreSQL for an estimate first: the planner's
+reltuples for an unfiltered table, or the EXPLAIN row estimate for a
+filtered queryset. Above ESTIMATED_COUNT_THRESHOLD the estimate is used as
+is; below it an exact COUNT(*) is run and cached per filter for
+COUNT_CACHE_TIMEOUT seconds.
+"""
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models.query import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+def estimated_table_count(model, using='default'):
+    """Planner row estimate for a model's table, or None if the table was never analyzed"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+def estimated_queryset_count(queryset):
+    """Row estimate for a filtered queryset from the planner's EXPLAIN output"""
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+def count_cache_key(queryset):
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.sha1(f"{queryset.db}:{sql}:{params!r}".encode()).hexdigest()
+    return f'count:{queryset.model._meta.db_table}:{digest}'
+
+def cached_exact_count(queryset):
+    """COUNT(*) for a queryset, cached per distinct filter"""
+    key = count_cache_key(queryset)
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, getattr(settings, 'COUNT_CACHE_TIMEOUT', 60))
+    return count
+
+def fast_count(queryset):
+    """Return (count, is_estimate) using estimates for large results and cached exact counts otherwise"""
+    threshold = getattr(settings, 'ESTIMATED_COUNT_THRESHOLD', 100000)
+
+    if not queryset.query.where:
+        estimate = estimated_table_count(queryset.model, queryset.db)
+    else:
+        estimate = estimated_queryset_count(queryset)
+
+    if estimate is not None and estimate >= threshold:
+        return estimate, True
+    return cached_exact_count(queryset), False
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that avoids COUNT(*) over huge tables (see module docstring)"""
+
+    count_is_estimate = False
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return super().count
+        count, self.count_is_estimate = fast_count(self.object_list)
+        return count
+
+class EstimatedCountPagination(PageNumberPagination):
+    """DRF page-number pagination backed by EstimatedCountPaginator"""
+    django_paginator_class = EstimatedCountPaginator
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'count_is_estimate': self.page.paginator.count_is_estimate,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
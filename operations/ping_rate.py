@@ -0,0 +1,97 @@
+"""
+Server-controlled location ping rate.
+
+The agent consumer tells each phone how often to send its position with a
+'ping_rate' message ({interval, state}), sent on connect and whenever the
+interval changes. The interval depends on what the agent is doing:
+
+- idle: no active assignment; positions only feed the map and dispatch
+- en_route: heading to the client
+- near: en route and within PING_RATE_NEAR_METERS of the client, where
+  arrival times and the anomaly detectors need fine-grained positions
+- on_site: the assignment is in progress and the agent is not moving
+
+Intervals in seconds per state come from PING_RATE_POLICY (tunable live
+through SystemSettings, see operations/live_settings.py). When this worker
+ingests more than PING_RATE_TARGET_PER_SECOND location messages, every
+state except 'near' is slowed down in proportion, up to
+PING_RATE_MAX_BACKOFF times its normal interval.
+"""
+import math
+import threading
+import time
+from .geo import haversine_km
+from . import live_settings
+
+DEFAULT_POLICY = {
+    'idle': 120,
+    'en_route': 15,
+    'near': 5,
+    'on_site': 60,
+}
+
+# States that never back off under load
+PRECISE_STATES = ('near',)
+
+def policy():
+    return dict(DEFAULT_POLICY, **live_settings.get('PING_RATE_POLICY', {}))
+
+class LoadMeter:
+    """Location messages per second ingested by this worker (exponentially smoothed)"""
+
+    # Half-life of the smoothing, in seconds
+    HALF_LIFE = 10.0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rate = 0.0
+        self.updated = time.monotonic()
+
+    def decay(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        self.rate *= 0.5 ** (elapsed / self.HALF_LIFE)
+
+    def record(self, count=1):
+        with self.lock:
+            self.decay(time.monotonic())
+            # Each message adds its share of a per-second rate over the smoothing window
+            self.rate += count * math.log(2) / self.HALF_LIFE
+
+    def current(self):
+        with self.lock:
+            self.decay(time.monotonic())
+            return self.rate
+
+meter = LoadMeter()
+
+def load_factor():
+    """Backoff multiplier (>= 1) for this worker's current ingestion rate"""
+    target = live_settings.get('PING_RATE_TARGET_PER_SECOND', 200)
+    if not target:
+        return 1.0
+    # Half steps, so small load changes do not resend directives to every agent
+    factor = round(meter.current() / target * 2) / 2
+    return min(max(factor, 1.0), live_settings.get('PING_RATE_MAX_BACKOFF', 4))
+
+def agent_state(assignment_status, position=None, client_position=None):
+    """Ping state for an agent from its assignment status and distance to the client"""
+    if assignment_status == 'in_progress':
+        return 'on_site'
+    if assignment_status != 'assigned':
+        return 'idle'
+    if position and client_position and None not in client_position:
+        km = float(haversine_km(position[0], position[1], client_position[0], client_position[1]))
+        if km * 1000 <= live_settings.get('PING_RATE_NEAR_METERS', 1000):
+            return 'near'
+    return 'en_route'
+
+def interval_for(state):
+    """Ping interval in whole seconds for a state under the current load"""
+    seconds = policy().get(state, DEFAULT_POLICY['en_route'])
+    if state not in PRECISE_STATES:
+        seconds *= load_factor()
+    return max(1, int(round(seconds)))
+
+def adaptive_enabled():
+    return live_settings.get('PING_RATE_ADAPTIVE', True)
@@ -0,0 +1,142 @@
+"""
+Heartbeat-driven presence tracking for WebSocket connections.
+
+State lives in Redis so every ASGI worker behind the balancer sees the same
+picture:
+
+* ``presence:agents`` - sorted set of agent id -> last heartbeat (epoch seconds)
+* ``presence:agent_connections`` - hash of agent id -> open connection count
+* ``presence:nodes`` - sorted set of worker node id -> last heartbeat
+* ``presence:node_connections`` - hash of worker node id -> open connection count
+
+Agents count as online while their last heartbeat (connect, ping or location
+update) is younger than PRESENCE_TTL. Redis errors are logged and swallowed so
+presence can never take the WebSocket tier down with it.
+"""
+import logging
+import os
+import socket
+import time
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+NODE_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+AGENTS_KEY = 'presence:agents'
+AGENT_CONNECTIONS_KEY = 'presence:agent_connections'
+NODES_KEY = 'presence:nodes'
+NODE_CONNECTIONS_KEY = 'presence:node_connections'
+
+_client = None
+_async_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _client
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = aioredis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _async_client
+
+def presence_enabled():
+    return getattr(settings, 'PRESENCE_ENABLED', True)
+
+def cutoff():
+    return time.time() - getattr(settings, 'PRESENCE_TTL', 90)
+
+async def connection_opened(agent_id=None):
+    """Register a new WebSocket connection on this node (and for an agent, if given)"""
+    if not presence_enabled():
+        return
+    now = time.time()
+    try:
+        async with get_async_client().pipeline(transaction=False) as pipe:
+            pipe.hincrby(NODE_CONNECTIONS_KEY, NODE_ID, 1)
+            pipe.zadd(NODES_KEY, {NODE_ID: now})
+            if agent_id is not None:
+                pipe.hincrby(AGENT_CONNECTIONS_KEY, str(agent_id), 1)
+                pipe.zadd(AGENTS_KEY, {str(agent_id): now})
+            await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Presence update failed: %s", e)
+
+async def connection_closed(agent_id=None):
+    """Unregister a WebSocket connection; the agent goes offline with its last connection"""
+    if not presence_enabled():
+        return
+    try:
+        client = get_async_client()
+        await client.hincrby(NODE_CONNECTIONS_KEY, NODE_ID, -1)
+        if agent_id is not None:
+            remaining = await client.hincrby(AGENT_CONNECTIONS_KEY, str(agent_id), -1)
+            if remaining <= 0:
+                async with client.pipeline(transaction=False) as pipe:
+                    pipe.hdel(AGENT_CONNECTIONS_KEY, str(agent_id))
+                    pipe.zrem(AGENTS_KEY, str(agent_id))
+                    await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Presence update failed: %s", e)
+
+async def heartbeat(agent_id=None):
+    """Refresh this node's (and an agent's) last-seen time"""
+    if not presence_enabled():
+        return
+    now = time.time()
+    try:
+        async with get_async_client().pipeline(transaction=False) as pipe:
+            pipe.zadd(NODES_KEY, {NODE_ID: now})
+            if agent_id is not None:
+                pipe.zadd(AGENTS_KEY, {str(agent_id): now})
+            await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Presence heartbeat failed: %s", e)
+
+def touch_agent(agent_id):
+    """Sync heartbeat for agents reporting over the REST API"""
+    if not presence_enabled():
+        return
+    try:
+        get_client().zadd(AGENTS_KEY, {str(agent_id): time.time()})
+    except redis.RedisError as e:
+        logger.warning("Presence heartbeat failed: %s", e)
+
+def online_agent_ids():
+    """Return the set of agent ids with a recent heartbeat, or None if presence is unavailable"""
+    if not presence_enabled():
+        return None
+    try:
+        return set(get_client().zrangebyscore(AGENTS_KEY, cutoff(), '+inf'))
+    except redis.RedisError as e:
+        logger.warning("Presence lookup failed: %s", e)
+        return None
+
+def is_agent_online(agent_id):
+    """True if the agent has a recent heartbeat; fails open when presence is unavailable"""
+    if not presence_enabled():
+        return True
+    try:
+        last_seen = get_client().zscore(AGENTS_KEY, str(agent_id))
+    except redis.RedisError as e:
+        logger.warning("Presence lookup failed: %s", e)
+        return True
+    return last_seen is not None and last_seen >= cutoff()
+
+def node_connection_counts():
+    """Return {node id: open connections} for worker nodes with a recent heartbeat"""
+    if not presence_enabled():
+        return {}
+    try:
+        client = get_client()
+        live_nodes = client.zrangebyscore(NODES_KEY, cutoff(), '+inf')
+        counts = client.hgetall(NODE_CONNECTIONS_KEY)
+    except redis.RedisError as e:
+        logger.warning("Presence lookup failed: %s", e)
+        return {}
+    return {node: max(int(counts.get(node, 0)), 0) for node in live_nodes}
@@ -0,0 +1,137 @@
+"""
+Query budgets and slow-path profiling for views and consumer DB calls.
+
+QueryBudgetMiddleware and the query_budget decorator count the queries (and
+their total time) issued while handling one request or one consumer
+database call and compare them with QUERY_BUDGETS. Overruns are logged, or
+raised as QueryBudgetExceeded when QUERY_BUDGET_RAISE is set (as in tests).
+
+A sample of requests (PROFILE_SAMPLE_RATE) runs under a profiler and, when
+slower than PROFILE_THRESHOLD_MS, the profile is written to PROFILE_DIR.
+cProfile is used unless PROFILER = 'pyinstrument' and it is installed.
+"""
+import cProfile
+import functools
+import logging
+import random
+import time
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+from .metrics import count_queries
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+logger = logging.getLogger(__name__)
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a request or consumer call goes over its query budget"""
+
+def budget_enabled():
+    return getattr(settings, 'QUERY_BUDGET_ENABLED', False)
+
+def get_budget(name):
+    """Return (max queries, max total query ms) for a view or consumer call name"""
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    budget = budgets.get(name, budgets.get('default', {}))
+    return budget.get('queries'), budget.get('query_ms')
+
+def check_budget(name, queries, query_seconds):
+    """Log or raise if the counted queries exceed the budget for name"""
+    max_queries, max_query_ms = get_budget(name)
+    query_ms = query_seconds * 1000
+    problems = []
+    if max_queries is not None and queries > max_queries:
+        problems.append(f"{queries} queries (budget {max_queries})")
+    if max_query_ms is not None and query_ms > max_query_ms:
+        problems.append(f"{query_ms:.1f} ms in queries (budget {max_query_ms} ms)")
+    if not problems:
+        return
+
+    message = f"Query budget exceeded for {name}: {', '.join(problems)}"
+    if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+def query_budget(name):
+    """Decorator enforcing the query budget on a sync function (e.g. under database_sync_to_async)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not budget_enabled():
+                return func(*args, **kwargs)
+            with count_queries() as queries:
+                result = func(*args, **kwargs)
+            check_budget(name, queries.count, queries.duration)
+            return result
+        return wrapper
+    return decorator
+
+class Profiler:
+    """Thin wrapper over cProfile or pyinstrument with a common save()"""
+
+    def __init__(self):
+        self.use_pyinstrument = getattr(settings, 'PROFILER', 'cprofile') == 'pyinstrument' and pyinstrument is not None
+        self.profiler = pyinstrument.Profiler() if self.use_pyinstrument else cProfile.Profile()
+
+    def start(self):
+        if self.use_pyinstrument:
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.use_pyinstrument:
+            self.profiler.stop()
+        else:
+            self.profiler.disable()
+
+    def save(self, label, elapsed_ms):
+        directory = Path(getattr(settings, 'PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+        directory.mkdir(parents=True, exist_ok=True)
+        stem = f"{timezone.now():%Y%m%d-%H%M%S}-{label.replace(':', '_')}-{elapsed_ms:.0f}ms"
+        if self.use_pyinstrument:
+            path = directory / f'{stem}.html'
+            path.write_text(self.profiler.output_html())
+        else:
+            path = directory / f'{stem}.prof'
+            self.profiler.dump_stats(str(path))
+        return path
+
+class QueryBudgetMiddleware:
+    """Enforces per-view query budgets and samples profiles of slow requests"""
+
+    def __init__(self, get_response):
+        if not budget_enabled() and not getattr(settings, 'PROFILE_SAMPLE_RATE', 0):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profiler = None
+        if random.random() < getattr(settings, 'PROFILE_SAMPLE_RATE', 0):
+            profiler = Profiler()
+            profiler.start()
+
+        start = time.perf_counter()
+        try:
+            with count_queries() as queries:
+                response = self.get_response(request)
+        finally:
+            if profiler:
+                profiler.stop()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        name = match.view_name if match else 'unresolved'
+
+        if profiler and elapsed_ms >= getattr(settings, 'PROFILE_THRESHOLD_MS', 500):
+            path = profiler.save(name, elapsed_ms)
+            logger.info("Slow request %s (%.0f ms, %d queries) profiled to %s", name, elapsed_ms, queries.count, path)
+
+        if budget_enabled():
+            check_budget(name, queries.count, queries.duration)
+        return response
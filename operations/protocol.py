@@ -0,0 +1,117 @@
+"""
+WebSocket wire formats for agent and manager consumers.
+
+Clients pick a format through the WebSocket subprotocol header:
+
+* ``fieldops.json`` (or no subprotocol) - JSON text frames, encoded with
+  orjson when it is installed.
+* ``fieldops.msgpack`` - MessagePack binary frames.
+
+In either mode an agent may send location updates as a fixed 29-byte binary
+frame (see LOCATION_FRAME) instead of a full JSON/MessagePack object.
+"""
+import json
+import math
+import struct
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_SUBPROTOCOL = 'fieldops.json'
+MSGPACK_SUBPROTOCOL = 'fieldops.msgpack'
+
+# tag, latitude, longitude, accuracy (NaN when unknown), client timestamp in epoch ms
+LOCATION_FRAME = struct.Struct('<Bddfq')
+LOCATION_FRAME_TAG = 0x01
+
+class ProtocolError(ValueError):
+    """Raised when an incoming frame cannot be decoded"""
+
+def decode_location_frame(bytes_data):
+    """Decode a fixed-layout location frame into a location_update message"""
+    _tag, latitude, longitude, accuracy, timestamp = LOCATION_FRAME.unpack(bytes_data)
+    return {
+        'type': 'location_update',
+        'latitude': latitude,
+        'longitude': longitude,
+        'accuracy': None if math.isnan(accuracy) else accuracy,
+        'timestamp': timestamp or None,
+    }
+
+def encode_location_frame(latitude, longitude, accuracy=None, timestamp=None):
+    """Build a fixed-layout location frame (used by clients and the load tester)"""
+    return LOCATION_FRAME.pack(
+        LOCATION_FRAME_TAG,
+        latitude,
+        longitude,
+        math.nan if accuracy is None else accuracy,
+        timestamp or 0
+    )
+
+def is_location_frame(bytes_data):
+    return len(bytes_data) == LOCATION_FRAME.size and bytes_data[0] == LOCATION_FRAME_TAG
+
+class JsonCodec:
+    """JSON text frames"""
+    subprotocol = JSON_SUBPROTOCOL
+    binary = False
+
+    def encode(self, data):
+        if orjson is not None:
+            return orjson.dumps(data).decode()
+        return json.dumps(data)
+
+    def decode(self, text_data=None, bytes_data=None):
+        try:
+            if bytes_data is not None:
+                if is_location_frame(bytes_data):
+                    return decode_location_frame(bytes_data)
+                text_data = bytes_data
+            if orjson is not None:
+                return orjson.loads(text_data)
+            return json.loads(text_data)
+        except Exception as e:
+            raise ProtocolError('Invalid JSON format') from e
+
+class MsgpackCodec:
+    """MessagePack binary frames"""
+    subprotocol = MSGPACK_SUBPROTOCOL
+    binary = True
+
+    def encode(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def decode(self, text_data=None, bytes_data=None):
+        try:
+            if bytes_data is None:
+                # Tolerate JSON text frames from clients that have not switched yet
+                return JsonCodec().decode(text_data=text_data)
+            if is_location_frame(bytes_data):
+                return decode_location_frame(bytes_data)
+            return msgpack.unpackb(bytes_data, raw=False)
+        except ProtocolError:
+            raise
+        except Exception as e:
+            raise ProtocolError('Invalid MessagePack format') from e
+
+JSON_CODEC = JsonCodec()
+MSGPACK_CODEC = MsgpackCodec() if msgpack is not None else None
+
+def negotiate(subprotocols):
+    """Pick a codec from the client's offered subprotocols.
+
+    Returns (subprotocol to accept or None, codec).
+    """
+    for subprotocol in subprotocols or []:
+        if subprotocol == MSGPACK_SUBPROTOCOL and MSGPACK_CODEC is not None:
+            return subprotocol, MSGPACK_CODEC
+        if subprotocol == JSON_SUBPROTOCOL:
+            return subprotocol, JSON_CODEC
+    return None, JSON_CODEC
@@ -0,0 +1,116 @@
+"""
+Read-replica routing for dashboards, reports, admin lists and exports.
+
+Every query goes to the primary ('default') unless it runs inside a view
+wrapped with read_replica (or an admin using ReplicaReadAdminMixin), in
+which case reads go to one of REPLICA_DATABASES, picked once per request.
+Writes always go to the primary.
+
+Read-your-writes: once a user's request writes anything, that user is
+pinned to the primary for REPLICA_STICKY_SECONDS (the pin is kept in the
+shared cache, so it holds across workers and for token clients), and any
+reads later in the same request stay on the primary too. With no replicas
+configured everything behaves as before.
+"""
+import functools
+import random
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+
+# Per-request routing state: {'replica': alias or None, 'wrote': bool}
+request_state = ContextVar('replica_request_state', default=None)
+
+def replica_aliases():
+    return getattr(settings, 'REPLICA_DATABASES', [])
+
+def pin_key(user_id):
+    return f'replica:pinned:{user_id}'
+
+def is_pinned(user):
+    """Whether the user wrote recently and must read from the primary"""
+    if user is None or not user.is_authenticated:
+        return False
+    try:
+        return cache.get(pin_key(user.pk)) is not None
+    except Exception:
+        # Without the cache we cannot tell; the primary is always safe
+        return True
+
+def pin(user):
+    if user is None or not user.is_authenticated:
+        return
+    try:
+        cache.set(pin_key(user.pk), 1, getattr(settings, 'REPLICA_STICKY_SECONDS', 10))
+    except Exception:
+        pass
+
+class ReplicaRouter:
+    """Routes reads to the request's replica, if any; everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        state = request_state.get()
+        if state and state['replica'] and not state['wrote']:
+            return state['replica']
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        state = request_state.get()
+        if state is not None:
+            state['wrote'] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas mirror the primary, so objects from any of them may be related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+class ReplicaPinMiddleware:
+    """Tracks writes during a request and pins the user to the primary afterwards"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = {'replica': None, 'wrote': False}
+        token = request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_state.reset(token)
+        if state['wrote'] and replica_aliases():
+            # DRF copies the user it authenticated (e.g. by token) onto the Django request
+            pin(getattr(request, 'user', None))
+        return response
+
+def use_replica(user):
+    """Route the rest of this request's reads to a replica, unless the user is pinned"""
+    state = request_state.get()
+    aliases = replica_aliases()
+    if state is None or not aliases or state['wrote'] or is_pinned(user):
+        return False
+    state['replica'] = state['replica'] or random.choice(aliases)
+    return True
+
+def read_replica(view):
+    """View decorator: reads go to a replica (place it innermost, under auth decorators)"""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        use_replica(request.user)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+class ReplicaReadAdminMixin:
+    """ModelAdmin mixin serving change lists and exports from a replica"""
+
+    def changelist_view(self, request, extra_context=None):
+        # POSTs run bulk actions and list_editable saves; only plain listing goes to a replica
+        if request.method == 'GET':
+            use_replica(request.user)
+        return super().changelist_view(request, extra_context)
+
+    def export_action(self, request, *args, **kwargs):
+        use_replica(request.user)
+        return super().export_action(request, *args, **kwargs)
@@ -0,0 +1,148 @@
+"""
+Concurrency-safe assignment creation.
+
+Clients are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent
+auto-assign calls each lock a different candidate instead of queueing
+behind one another, and the partial unique constraints on Assignment
+(one active assignment per agent and per client) are the final guard: a
+claim that loses a race fails with IntegrityError and is retried.
+"""
+from django.contrib.gis.db.models.functions import Distance
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from .events import send_assignment_notification
+from .eta import estimate_duration
+from .geo import haversine_km
+from .models import Assignment, Client
+from .territories import zone_scope
+from .workload import record_assignment
+
+ACTIVE_STATUSES = ('assigned', 'in_progress')
+
+# Retries after losing a race on the unique constraints
+MAX_CLAIM_ATTEMPTS = 3
+
+class AssignmentError(Exception):
+    """Base class for assignment failures; the message is safe to show to users"""
+
+class AgentBusy(AssignmentError):
+    pass
+
+class ClientUnavailable(AssignmentError):
+    pass
+
+class NoClientAvailable(AssignmentError):
+    pass
+
+class OutOfZone(Exception):
+    """No candidate in the agent's territory scope (internal to claim_next_client)"""
+
+def violated_constraint(error):
+    """Name of the constraint behind an IntegrityError (PostgreSQL), or None"""
+    diag = getattr(error.__cause__, 'diag', None)
+    return getattr(diag, 'constraint_name', None)
+
+def agent_is_busy(agent_id):
+    return Assignment.objects.filter(agent_id=agent_id, status__in=ACTIVE_STATUSES).exists()
+
+def active_assignment(agent_id):
+    """The agent's assigned or in-progress assignment (with the client's location), or None"""
+    return Assignment.objects.filter(
+        agent_id=agent_id,
+        status__in=ACTIVE_STATUSES
+    ).select_related('client').only('id', 'status', 'assigned_at', 'client__location').first()
+
+def available_clients():
+    """Active clients with no active assignment"""
+    active_assignment = Assignment.objects.filter(client=OuterRef('pk'), status__in=ACTIVE_STATUSES)
+    return Client.objects.filter(is_active=True).exclude(Exists(active_assignment))
+
+def claim_next_client(agent, created_by=None, order='closest'):
+    """Atomically assign the best free client to an agent with a known location.
+
+    order is 'closest' (nearest first) or 'priority' (highest priority, then nearest).
+    Candidates come from the agent's territory and its neighbours, then from
+    anywhere once that scope is exhausted.
+    """
+    zones = zone_scope(agent.zone_id)
+    for attempt in range(MAX_CLAIM_ATTEMPTS):
+        if agent_is_busy(agent.id):
+            raise AgentBusy('Agent already has an active assignment')
+
+        candidates = available_clients().annotate(
+            distance=Distance('location', agent.current_location)
+        )
+        if zones is not None:
+            candidates = candidates.filter(zone_id__in=zones)
+        if order == 'priority':
+            candidates = candidates.order_by('-priority', 'distance')
+        else:
+            candidates = candidates.order_by('distance')
+
+        try:
+            with transaction.atomic():
+                # Rows being claimed by concurrent transactions are skipped, not waited on
+                claimed = list(candidates.select_for_update(skip_locked=True, of=('self',))[:1])
+                if not claimed and zones is not None:
+                    raise OutOfZone
+                if not claimed:
+                    raise NoClientAvailable('No available clients for assignment')
+
+                client = claimed[0]
+                assignment = Assignment.objects.create(
+                    agent=agent,
+                    client=client,
+                    distance_to_client=client.distance.km,
+                    estimated_duration=estimate_duration(agent.id, client.latitude, client.longitude, client.priority),
+                    created_by=created_by
+                )
+
+                # Queued in the same transaction; published once it commits
+                send_assignment_notification(assignment)
+                record_assignment(assignment)
+            return assignment
+        except OutOfZone:
+            # Nothing left nearby; widen the search to the whole city
+            zones = None
+            continue
+        except IntegrityError:
+            # Lost a race for the agent or the client; re-check and try again
+            continue
+
+    raise AssignmentError('Assignment conflicted with concurrent requests, please retry')
+
+def assign_client(agent_id, client_id, created_by=None, notes='', agent_location=None):
+    """Atomically assign a specific client to an agent (the caller validates the agent)"""
+    try:
+        with transaction.atomic():
+            # Waits only for another claim on this same client
+            client = Client.objects.select_for_update().get(id=client_id, is_active=True)
+
+            if Assignment.objects.filter(client=client, status__in=ACTIVE_STATUSES).exists():
+                raise ClientUnavailable('Client is already assigned')
+
+            distance = None
+            if agent_location:
+                distance = float(haversine_km(agent_location.y, agent_location.x, client.latitude, client.longitude))
+
+            assignment = Assignment.objects.create(
+                agent_id=agent_id,
+                client=client,
+                notes=notes,
+                distance_to_client=distance,
+                estimated_duration=estimate_duration(agent_id, client.latitude, client.longitude, client.priority),
+                created_by=created_by
+            )
+
+            send_assignment_notification(assignment)
+            record_assignment(assignment)
+        return assignment
+    except Client.DoesNotExist:
+        raise ClientUnavailable('Client not found')
+    except IntegrityError as e:
+        constraint = violated_constraint(e)
+        if constraint == 'one_active_assignment_per_agent':
+            raise AgentBusy('Agent already has an active assignment')
+        if constraint == 'one_active_assignment_per_client':
+            raise ClientUnavailable('Client is already assigned')
+        raise
@@ -0,0 +1,215 @@
+"""
+Territories: clients partitioned into compact zones.
+
+build_territories clusters client locations (k-means or a fixed lat/lng
+grid, both vectorized in NumPy), stores a zone on every client and links
+zones that share a border as neighbours - two zones are neighbours when some
+client has one as its nearest and the other as its second-nearest center.
+Agents get the zone of their last reported location.
+
+Candidate searches (auto-assign, bulk assignment, dispatch) then only look
+at clients in the agent's zone and its neighbours, falling back to the whole
+city when that scope has nothing left. Zone centers and neighbour sets are
+cached per process and reloaded every TERRITORY_CACHE_TIMEOUT seconds.
+"""
+import threading
+import time
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db import transaction
+
+# Point-to-center distances computed per chunk, to bound memory
+CHUNK_CELLS = 4000000
+
+def project(lat, lng, ref_lat):
+    """Equirectangular projection (degrees of latitude) so Euclidean distance is meaningful"""
+    return np.column_stack([lat, lng * np.cos(np.radians(ref_lat))])
+
+def nearest_two(points, centers):
+    """Indices of the nearest and second-nearest center for every point"""
+    first = np.empty(len(points), dtype=int)
+    second = np.empty(len(points), dtype=int)
+    size = max(1, CHUNK_CELLS // len(centers))
+    center_norms = (centers ** 2).sum(axis=1)
+    for start in range(0, len(points), size):
+        chunk = points[start:start + size]
+        # Squared distances up to a per-point constant, which does not change the ranking
+        d = center_norms[None, :] - 2 * chunk @ centers.T
+        if len(centers) > 1:
+            order = np.argpartition(d, 1, axis=1)[:, :2]
+            swap = d[np.arange(len(chunk)), order[:, 0]] > d[np.arange(len(chunk)), order[:, 1]]
+            order[swap] = order[swap][:, ::-1]
+            first[start:start + len(chunk)] = order[:, 0]
+            second[start:start + len(chunk)] = order[:, 1]
+        else:
+            first[start:start + len(chunk)] = 0
+            second[start:start + len(chunk)] = 0
+    return first, second
+
+def kmeans(points, k, iterations=25, seed=0):
+    """Lloyd's k-means; returns (labels, centers)"""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(points))
+    centers = points[rng.choice(len(points), k, replace=False)].copy()
+    labels = None
+    for _ in range(iterations):
+        new_labels, _second = nearest_two(points, centers)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        counts = np.bincount(labels, minlength=k)
+        for axis in range(points.shape[1]):
+            sums = np.bincount(labels, weights=points[:, axis], minlength=k)
+            # Empty clusters keep their previous center
+            centers[:, axis] = np.where(counts > 0, sums / np.maximum(counts, 1), centers[:, axis])
+    labels, _ = nearest_two(points, centers)
+    return labels, centers
+
+def grid(lat, lng, cell_degrees):
+    """Fixed lat/lng grid; returns (labels, centers as lat/lng)"""
+    cells = np.column_stack([np.floor(lat / cell_degrees), np.floor(lng / cell_degrees)]).astype(np.int64)
+    _, labels = np.unique(cells, axis=0, return_inverse=True)
+    labels = labels.ravel()
+    counts = np.bincount(labels)
+    centers = np.column_stack([
+        np.bincount(labels, weights=lat) / counts,
+        np.bincount(labels, weights=lng) / counts,
+    ])
+    return labels, centers
+
+def neighbour_pairs(points, centers):
+    """Unique (a, b) zone index pairs that share a border"""
+    first, second = nearest_two(points, centers)
+    pairs = np.column_stack([np.minimum(first, second), np.maximum(first, second)])
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    return np.unique(pairs, axis=0) if len(pairs) else pairs
+
+def build_territories(method='kmeans', clusters=50, cell_degrees=0.02, seed=0):
+    """Re-partition all active clients into territories; returns the number of zones"""
+    from .models import Client, Territory
+
+    rows = list(Client.objects.filter(is_active=True).values_list('id', 'location'))
+    if not rows:
+        return 0
+
+    ids = [row[0] for row in rows]
+    lat = np.array([row[1].y for row in rows], dtype=float)
+    lng = np.array([row[1].x for row in rows], dtype=float)
+    ref_lat = float(lat.mean())
+    points = project(lat, lng, ref_lat)
+
+    if method == 'grid':
+        labels, centers = grid(lat, lng, cell_degrees)
+        center_points = project(centers[:, 0], centers[:, 1], ref_lat)
+    else:
+        labels, center_points = kmeans(points, clusters, seed=seed)
+        centers = np.column_stack([center_points[:, 0], center_points[:, 1] / np.cos(np.radians(ref_lat))])
+
+    counts = np.bincount(labels, minlength=len(centers))
+    used = np.flatnonzero(counts)
+    pairs = [(int(a), int(b)) for a, b in neighbour_pairs(points, center_points)]
+
+    with transaction.atomic():
+        Client.objects.update(zone=None)
+        Territory.objects.all().delete()
+        territories = Territory.objects.bulk_create([
+            Territory(
+                name=f'Zone {n + 1}',
+                center=Point(float(centers[i, 1]), float(centers[i, 0])),
+                client_count=int(counts[i])
+            )
+            for n, i in enumerate(used)
+        ])
+        by_label = {int(i): t for i, t in zip(used, territories)}
+
+        for i, territory in by_label.items():
+            member_ids = [ids[j] for j in np.flatnonzero(labels == i)]
+            for start in range(0, len(member_ids), 5000):
+                Client.objects.filter(id__in=member_ids[start:start + 5000]).update(zone=territory)
+
+        Link = Territory.neighbours.through
+        links = []
+        for a, b in pairs:
+            # A second-nearest center can belong to a cluster that ended up empty
+            if a in by_label and b in by_label:
+                links.append(Link(from_territory_id=by_label[a].id, to_territory_id=by_label[b].id))
+                links.append(Link(from_territory_id=by_label[b].id, to_territory_id=by_label[a].id))
+        Link.objects.bulk_create(links)
+
+    invalidate_cache()
+    return len(territories)
+
+class TerritoryIndex:
+    """Zone centers and neighbour sets cached in memory"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = np.empty(0, dtype=int)
+        self.lat = np.empty(0)
+        self.lng = np.empty(0)
+        self.scopes = {}
+        self.loaded_at = None
+
+    def ensure_loaded(self):
+        timeout = getattr(settings, 'TERRITORY_CACHE_TIMEOUT', 300)
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > timeout:
+            self.load()
+
+    def load(self):
+        from .models import Territory
+
+        rows = list(Territory.objects.values_list('id', 'center'))
+        scopes = {territory_id: {territory_id} for territory_id, _ in rows}
+        for a, b in Territory.neighbours.through.objects.values_list('from_territory_id', 'to_territory_id'):
+            scopes[a].add(b)
+
+        with self.lock:
+            self.ids = np.array([row[0] for row in rows], dtype=int)
+            self.lat = np.array([row[1].y for row in rows], dtype=float)
+            self.lng = np.array([row[1].x for row in rows], dtype=float)
+            self.scopes = {key: frozenset(value) for key, value in scopes.items()}
+            self.loaded_at = time.monotonic()
+
+    def nearest(self, latitude, longitude):
+        """Id of the territory whose center is closest, or None if none are built"""
+        self.ensure_loaded()
+        if not len(self.ids):
+            return None
+        scale = np.cos(np.radians(latitude))
+        d = (self.lat - latitude) ** 2 + ((self.lng - longitude) * scale) ** 2
+        return int(self.ids[np.argmin(d)])
+
+    def scope(self, zone_id):
+        """The zone and its neighbours, or None (no restriction) when unknown"""
+        if zone_id is None or not getattr(settings, 'TERRITORIES_ENABLED', True):
+            return None
+        self.ensure_loaded()
+        return self.scopes.get(zone_id)
+
+index = TerritoryIndex()
+
+def invalidate_cache():
+    index.loaded_at = None
+
+def zone_scope(zone_id):
+    return index.scope(zone_id)
+
+def within_scope(indices, zones, zone_id):
+    """Subset of indices whose zones (array, -1 for none) are near zone_id; all of them if none are"""
+    scope = zone_scope(None if zone_id is None or zone_id < 0 else int(zone_id))
+    if scope is None:
+        return indices
+    nearby = indices[np.isin(zones[indices], list(scope))]
+    return nearby if len(nearby) else indices
+
+def nearest_zone(latitude, longitude):
+    return index.nearest(latitude, longitude)
+
+def assign_zone(obj, latitude, longitude):
+    """Set obj.zone_id from a location; returns True if it changed"""
+    zone_id = nearest_zone(latitude, longitude)
+    if zone_id is None or zone_id == obj.zone_id:
+        return False
+    obj.zone_id = zone_id
+    return True
@@ -0,0 +1,31 @@
+from django.contrib.gis.geos import Point
+from django.test import override_settings
+from operations.models import Client, User
+
+# Keep tests off Redis and background threads: in-process channel layer, no
+# presence, dispatch, live settings listener, territories or anomaly windows
+isolated = override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    PRESENCE_ENABLED=False,
+    DISPATCH_ENABLED=False,
+    LIVE_SETTINGS_LISTEN=False,
+    TERRITORIES_ENABLED=False,
+    ANOMALY_DETECTION_ENABLED=False,
+    QUERY_BUDGET_ENABLED=False,
+)
+
+def make_agent(name, latitude=12.97, longitude=77.59):
+    return User.objects.create(
+        username=name,
+        role='agent',
+        current_location=Point(longitude, latitude)
+    )
+
+def make_client(name, latitude=12.98, longitude=77.60, priority=2):
+    return Client.objects.create(
+        name=name,
+        phone='0000000000',
+        address=f'{name} street',
+        location=Point(longitude, latitude),
+        priority=priority
+    )
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db.models import Sum
+from django.test import TestCase
+from django.utils import timezone
+from operations.geo import haversine_km
+from operations.ingest import store_location_batch
+from operations.models import AgentMileage, LocationHistory
+from . import isolated, make_agent
+
+def zigzag(count, start_ms, step_seconds=60):
+    """Points about 250 m apart, one per step, zigzagging so the path is longer than the straight line"""
+    return [
+        {
+            'latitude': 12.97 + i * 0.002,
+            'longitude': 77.59 + (0.0015 if i % 2 else 0.0),
+            'accuracy': 5,
+            'timestamp': start_ms + i * step_seconds * 1000,
+        }
+        for i in range(count)
+    ]
+
+def path_km(points):
+    return sum(
+        float(haversine_km(a['latitude'], a['longitude'], b['latitude'], b['longitude']))
+        for a, b in zip(points, points[1:])
+    )
+
+def total_km(agent):
+    return AgentMileage.objects.filter(agent=agent).aggregate(total=Sum('distance_km'))['total'] or 0.0
+
+@isolated
+class StoreLocationBatchTests(TestCase):
+    def setUp(self):
+        self.agent = make_agent('agent')
+        self.agent.current_location = None
+        self.agent.save()
+        self.start_ms = int((timezone.now() - timedelta(hours=1)).timestamp()) * 1000
+
+    def assert_position(self, point):
+        self.agent.refresh_from_db()
+        self.assertAlmostEqual(self.agent.current_location.y, point['latitude'])
+        self.assertAlmostEqual(self.agent.current_location.x, point['longitude'])
+        self.assertEqual(
+            self.agent.location_updated_at,
+            datetime.fromtimestamp(point['timestamp'] / 1000, tz=dt_timezone.utc)
+        )
+
+    def test_chunks_move_agent_forward(self):
+        points = zigzag(10, self.start_ms)
+
+        first = store_location_batch(self.agent, points[:5])
+        second = store_location_batch(self.agent, points[5:])
+
+        self.assertEqual(first['latest']['timestamp'], points[4]['timestamp'])
+        self.assertEqual(second['latest']['timestamp'], points[9]['timestamp'])
+        self.assert_position(points[9])
+        self.assertEqual(LocationHistory.objects.filter(agent=self.agent).count(), 10)
+        self.assertAlmostEqual(total_km(self.agent), path_km(points), places=6)
+
+    def test_late_batch_keeps_newer_position(self):
+        points = zigzag(10, self.start_ms)
+        store_location_batch(self.agent, points[9:])
+
+        result = store_location_batch(self.agent, points[:9])
+
+        self.assertIsNone(result['latest'])
+        self.assertEqual(result['accepted'], 9)
+        self.assert_position(points[9])
+
+    def test_late_batch_replaces_counted_shortcut(self):
+        points = zigzag(10, self.start_ms)
+        store_location_batch(self.agent, points[:1])
+        store_location_batch(self.agent, points[9:])
+        straight = path_km([points[0], points[9]])
+        self.assertAlmostEqual(total_km(self.agent), straight, places=6)
+
+        store_location_batch(self.agent, points[1:9])
+
+        self.assertGreater(path_km(points), straight)
+        self.assertAlmostEqual(total_km(self.agent), path_km(points), places=6)
+
+    def test_admin_save_does_not_reorder(self):
+        points = zigzag(4, self.start_ms)
+        store_location_batch(self.agent, points[:2])
+
+        # A later save of the user (e.g. a profile edit) is not a newer position
+        self.agent.refresh_from_db()
+        self.agent.phone = '123'
+        self.agent.save()
+        result = store_location_batch(self.agent, points[2:])
+
+        self.assertEqual(result['latest']['timestamp'], points[3]['timestamp'])
+        self.assert_position(points[3])
+        self.assertAlmostEqual(total_km(self.agent), path_km(points), places=6)
+
+    def test_invalid_points_are_rejected(self):
+        points = zigzag(3, self.start_ms)
+        points[1]['latitude'] = 123
+
+        result = store_location_batch(self.agent, points)
+
+        self.assertEqual((result['accepted'], result['rejected']), (2, 1))
+        self.assertEqual(LocationHistory.objects.filter(agent=self.agent).count(), 2)
@@ -0,0 +1,119 @@
+import threading
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from operations.models import Assignment
+from operations.services import (
+    ACTIVE_STATUSES, AgentBusy, AssignmentError, ClientUnavailable,
+    assign_client, claim_next_client, violated_constraint
+)
+from . import isolated, make_agent, make_client
+
+def run_concurrently(calls):
+    """Run callables in threads started together; returns their results (or raised exceptions)"""
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+
+    def run(i, call):
+        try:
+            barrier.wait()
+            results[i] = call()
+        except Exception as e:
+            results[i] = e
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(i, call)) for i, call in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+@isolated
+class ConstraintTests(TestCase):
+    def test_constraint_names(self):
+        agent, other_agent = make_agent('agent_a'), make_agent('agent_b')
+        client, other_client = make_client('client_a'), make_client('client_b')
+        Assignment.objects.create(agent=agent, client=client)
+
+        with self.assertRaises(IntegrityError) as raised, transaction.atomic():
+            Assignment.objects.create(agent=other_agent, client=client)
+        self.assertEqual(violated_constraint(raised.exception), 'one_active_assignment_per_client')
+
+        with self.assertRaises(IntegrityError) as raised, transaction.atomic():
+            Assignment.objects.create(agent=agent, client=other_client)
+        self.assertEqual(violated_constraint(raised.exception), 'one_active_assignment_per_agent')
+
+    def test_finished_assignments_do_not_block(self):
+        agent, client = make_agent('agent_a'), make_client('client_a')
+        Assignment.objects.create(agent=agent, client=client, status='completed')
+        assignment = assign_client(agent.id, client.id)
+        self.assertEqual(assignment.status, 'assigned')
+
+@isolated
+class AssignClientRaceTests(TransactionTestCase):
+    def test_one_client_many_agents(self):
+        agents = [make_agent(f'agent_{i}') for i in range(4)]
+        client = make_client('client')
+
+        results = run_concurrently([
+            lambda agent=agent: assign_client(agent.id, client.id) for agent in agents
+        ])
+
+        assigned = [result for result in results if isinstance(result, Assignment)]
+        self.assertEqual(len(assigned), 1)
+        for result in results:
+            if not isinstance(result, Assignment):
+                self.assertIsInstance(result, ClientUnavailable)
+        self.assertEqual(Assignment.objects.filter(client=client, status__in=ACTIVE_STATUSES).count(), 1)
+
+    def test_one_agent_many_clients(self):
+        agent = make_agent('agent')
+        clients = [make_client(f'client_{i}') for i in range(4)]
+
+        results = run_concurrently([
+            lambda client=client: assign_client(agent.id, client.id) for client in clients
+        ])
+
+        assigned = [result for result in results if isinstance(result, Assignment)]
+        self.assertEqual(len(assigned), 1)
+        for result in results:
+            if not isinstance(result, Assignment):
+                self.assertIsInstance(result, AgentBusy)
+        self.assertEqual(Assignment.objects.filter(agent=agent, status__in=ACTIVE_STATUSES).count(), 1)
+
+@isolated
+class ClaimNextClientRaceTests(TransactionTestCase):
+    def test_agents_claim_distinct_clients(self):
+        agents = [make_agent(f'agent_{i}', longitude=77.59 + i * 0.001) for i in range(6)]
+        clients = [make_client(f'client_{i}', longitude=77.60 + i * 0.001) for i in range(4)]
+
+        results = run_concurrently([
+            lambda agent=agent: claim_next_client(agent) for agent in agents
+        ])
+
+        assigned = [result for result in results if isinstance(result, Assignment)]
+        self.assertTrue(assigned)
+        self.assertEqual(len({assignment.client_id for assignment in assigned}), len(assigned))
+        for result in results:
+            if not isinstance(result, Assignment):
+                # Out of clients (or out of retries after losing every race)
+                self.assertIsInstance(result, AssignmentError)
+
+        active = Assignment.objects.filter(status__in=ACTIVE_STATUSES)
+        self.assertEqual(active.count(), len(assigned))
+        self.assertEqual(active.values('client').distinct().count(), len(assigned))
+        self.assertEqual(active.values('agent').distinct().count(), len(assigned))
+
+    def test_agent_claims_once(self):
+        agent = make_agent('agent')
+        for i in range(4):
+            make_client(f'client_{i}')
+
+        results = run_concurrently([lambda: claim_next_client(agent) for _ in range(4)])
+
+        self.assertEqual(sum(isinstance(result, Assignment) for result in results), 1)
+        for result in results:
+            if not isinstance(result, Assignment):
+                self.assertIsInstance(result, AssignmentError)
+        self.assertEqual(Assignment.objects.filter(agent=agent, status__in=ACTIVE_STATUSES).count(), 1)
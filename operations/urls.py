@@ -14,8 +14,19 @@ urlpatterns = [
 
     # API Endpoints
     path('api/', include(router.urls)),
+    path('api/auth/token/', views.obtain_token, name='obtain_token'),
     path('api/auto-assign/', views.auto_assign_client, name='auto_assign_client'),
+    path('api/bulk-assign/', views.bulk_assign_clients, name='bulk_assign_clients'),
     path('api/assignment/<uuid:assignment_id>/status/', views.update_assignment_status, name='update_assignment_status'),
     path('api/location/update/', views.update_agent_location, name='update_agent_location'),
+    path('api/location/batch/', views.update_agent_location_batch, name='update_agent_location_batch'),
     path('api/route/', views.get_route, name='get_route'),
+    path('api/map/markers/', views.map_markers, name='map_markers'),
+    path('api/mileage/', views.mileage_report, name='mileage_report'),
+    path('api/analytics/heatmap/', views.location_heatmap, name='location_heatmap'),
+    path('api/analytics/coverage-gaps/', views.coverage_gaps, name='coverage_gaps'),
+    path('api/map/tiles/clients/<int:z>/<int:x>/<int:y>.mvt', views.client_tile, name='client_tile'),
+    path('api/presence/', views.presence_status, name='presence_status'),
+    path('api/location/history/', views.location_history_list, name='location_history_list'),
+    path('api/notifications/', views.notification_list, name='notification_list'),
 ]
@@ -1,26 +1,43 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.contrib.auth import authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, Http404
 from django.contrib import messages
 from django.contrib.gis.geos import Point
-from django.contrib.gis.db.models.functions import Distance
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.db import transaction
+from django.db.models import Exists, Max, OuterRef, Prefetch
 from django.core.paginator import Paginator
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from django.core.exceptions import ValidationError
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 import json
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
 import pandas as pd
 import requests
-from .models import User, Client, Assignment, LocationHistory, NotificationLog
-from .forms import ClientUploadForm, AssignmentForm
+from .models import User, Client, Assignment, AgentMileage, LocationHistory, NotificationLog
+from .forms import ClientUploadForm, AssignmentForm, BulkAssignmentForm
+from .events import send_assignment_update
+from .pagination import EstimatedCountPagination
+from .replicas import read_replica
+from .dispatch import notify_agent_free, notify_client_queued
+from .services import AgentBusy, AssignmentError, NoClientAvailable, active_assignment, assign_client, available_clients, claim_next_client
+from .anomalies import check_location
+from .authentication import TokenRateThrottle, issue_token
+from .ingest import BatchError, store_location_batch
+from .mileage import last_position, record_movement
+from .territories import assign_zone, nearest_zone
+from .workload import capacity_seconds, workload
+from . import analytics, maps, metrics, ping_rate, presence
 from django.conf import settings
 
 def home(request):
@@ -34,6 +51,7 @@ def home(request):
         return redirect('agent_dashboard')
 
 @login_required
+@read_replica
 def manager_dashboard(request):
     """Manager dashboard with overview and controls"""
     if request.user.role != 'manager':
@@ -53,13 +71,20 @@ def manager_dashboard(request):
     recent_assignments = Assignment.objects.select_related('agent', 'client').all()[:10]
 
     # Get agents with their current locations and assignments
+    online_ids = presence.online_agent_ids()
     agents_data = []
-    for agent in User.objects.filter(role='agent'):
-        current_assignment = agent.current_assignment
+    # One query for agents plus one for their current assignments (with clients)
+    agents = User.objects.filter(role='agent').prefetch_related(Prefetch(
+        'assignments',
+        queryset=Assignment.objects.filter(status='assigned').select_related('client'),
+        to_attr='assigned_now'
+    ))
+    for agent in agents:
         agents_data.append({
             'agent': agent,
-            'current_assignment': current_assignment,
+            'current_assignment': agent.assigned_now[0] if agent.assigned_now else None,
             'location': agent.current_location,
+            'is_online': agent.is_active_agent if online_ids is None else str(agent.id) in online_ids,
         })
 
     context = {
@@ -130,6 +155,7 @@ def upload_clients(request):
                     try:
                         # Create Point from coordinates
                         location = Point(float(row['longitude']), float(row['latitude']))
+                        zone_id = nearest_zone(location.y, location.x)
 
                         # Get or create client
                         client, created = Client.objects.get_or_create(
@@ -141,6 +167,7 @@ def upload_clients(request):
                                 'email': str(row.get('email', '')),
                                 'priority': int(row.get('priority', 2)),
                                 'notes': str(row.get('notes', '')),
+                                'zone_id': zone_id,
                             }
                         )
 
@@ -154,6 +181,7 @@ def upload_clients(request):
                             client.email = str(row.get('email', ''))
                             client.priority = int(row.get('priority', 2))
                             client.notes = str(row.get('notes', ''))
+                            client.zone_id = zone_id
                             client.save()
                             updated_count += 1
 
@@ -190,67 +218,44 @@ def auto_assign_client(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Check if agent already has an active assignment
-        if agent.current_assignment:
+        # Skip agents with no live connection (presence is shared across workers)
+        if not presence.is_agent_online(agent.id):
             return Response(
-                {'error': 'Agent already has an active assignment'}, 
+                {'error': 'Agent is offline'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Get available clients (not currently assigned)
-        assigned_client_ids = Assignment.objects.filter(
-            status__in=['assigned', 'in_progress']
-        ).values_list('client_id', flat=True)
-
-        available_clients = Client.objects.filter(
-            is_active=True
-        ).exclude(id__in=assigned_client_ids)
-
-        if not available_clients.exists():
-            return Response(
-                {'error': 'No available clients for assignment'}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
-
-        # Apply assignment logic
-        if assignment_type == 'priority':
-            # Priority-based assignment (highest priority first, then closest)
-            clients_with_distance = available_clients.annotate(
-                distance=Distance('location', agent.current_location)
-            ).order_by('-priority', 'distance')
-        else:
-            # Distance-based assignment (closest first)
-            clients_with_distance = available_clients.annotate(
-                distance=Distance('location', agent.current_location)
-            ).order_by('distance')
-
-        selected_client = clients_with_distance.first()
-
-        if not selected_client:
+        if workload.agent_load(agent.id) >= capacity_seconds():
             return Response(
-                {'error': 'No suitable client found'}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
-
-        # Create assignment
-        with transaction.atomic():
-            assignment = Assignment.objects.create(
-                agent=agent,
-                client=selected_client,
-                distance_to_client=selected_client.distance.km if hasattr(selected_client, 'distance') else None,
-                created_by=request.user
+                {'error': 'Agent has reached today\'s workload capacity'}, 
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-            # Send real-time notification
-            send_assignment_notification(assignment)
+        # Claim the best free client atomically (safe under concurrent calls)
+        assignment = claim_next_client(agent, created_by=request.user, order=assignment_type)
 
         return Response({
             'message': 'Assignment created successfully',
             'assignment_id': str(assignment.id),
-            'client_name': selected_client.name,
-            'distance': selected_client.distance.km if hasattr(selected_client, 'distance') else None
+            'client_name': assignment.client.name,
+            'distance': assignment.distance_to_client
         }, status=status.HTTP_201_CREATED)
 
+    except AgentBusy as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except NoClientAvailable as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+    except AssignmentError as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_409_CONFLICT
+        )
     except User.DoesNotExist:
         return Response(
             {'error': 'Agent not found'}, 
@@ -262,6 +267,53 @@ def auto_assign_client(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_assign_clients(request):
+    """Assign queued clients to free online agents (closest, priority or balanced workload)"""
+    if request.user.role != 'manager':
+        return Response(
+            {'error': 'Permission denied'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    form = BulkAssignmentForm(request.data)
+    if not form.is_valid():
+        return Response(
+            {'error': form.errors}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Each agent can hold one active assignment, so a run gives every free agent at most one client
+    clients = [
+        (client_id, location.y, location.x, zone_id)
+        for client_id, location, zone_id in available_clients().order_by('-priority', 'created_at').values_list('id', 'location', 'zone_id')
+    ]
+    plan = workload.plan(clients, policy=form.cleaned_data['assignment_type'], allowed=presence.online_agent_ids())
+
+    created, skipped = [], 0
+    for agent_id, client_id in plan:
+        position = workload.position(agent_id)
+        agent_location = Point(position[1], position[0]) if position else None
+        try:
+            assignment = assign_client(agent_id, client_id, created_by=request.user, agent_location=agent_location)
+        except AssignmentError:
+            # The agent or client was taken since the workload model was loaded
+            skipped += 1
+            continue
+        created.append({
+            'assignment_id': str(assignment.id),
+            'agent_id': str(agent_id),
+            'client_id': str(client_id),
+            'distance': assignment.distance_to_client,
+        })
+
+    return Response({
+        'message': f'{len(created)} assignments created',
+        'assignments': created,
+        'skipped': skipped,
+    }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def update_assignment_status(request, assignment_id):
@@ -295,9 +347,15 @@ def update_assignment_status(request, assignment_id):
                 assignment.notes = notes
                 assignment.save()
 
-            # Send real-time update
+            # Queue real-time update; published once the transaction commits
             send_assignment_update(assignment)
 
+            # A finished or cancelled assignment frees the agent for the next client
+            if new_status in ('completed', 'cancelled'):
+                notify_agent_free(assignment.agent_id)
+            if new_status == 'cancelled':
+                notify_client_queued()
+
         return Response({
             'message': 'Assignment status updated successfully',
             'status': assignment.get_status_display()
@@ -309,6 +367,29 @@ def update_assignment_status(request, assignment_id):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([TokenRateThrottle])
+def obtain_token(request):
+    """Issue a signed API token for username/password, or for the logged-in session user"""
+    user = request.user if request.user.is_authenticated else None
+    if user is None:
+        user = authenticate(
+            request,
+            username=request.data.get('username'),
+            password=request.data.get('password')
+        )
+    if user is None:
+        return Response(
+            {'error': 'Invalid credentials'}, 
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+
+    return Response({
+        'token': issue_token(user),
+        'expires_in': settings.AUTH_TOKEN_MAX_AGE,
+    })
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def update_agent_location(request):
@@ -319,22 +400,49 @@ def update_agent_location(request):
         accuracy = request.data.get('accuracy')
 
         location = Point(longitude, latitude)
+        ping_rate.meter.record()
+
+        # request.user may come from the token auth cache; read the stored position
+        previous, previous_at = last_position(request.user.id)
 
         with transaction.atomic():
             # Update agent location
             request.user.current_location = location
-            request.user.save()
+            request.user.location_updated_at = timezone.now()
+            fields = ['current_location', 'location_updated_at', 'updated_at']
+            if assign_zone(request.user, latitude, longitude):
+                fields.append('zone')
+            request.user.save(update_fields=fields)
 
             # Save location history
+            current_assignment = active_assignment(request.user.id)
             LocationHistory.objects.create(
                 agent=request.user,
                 location=location,
                 accuracy=accuracy,
-                assignment=request.user.current_assignment
+                assignment=current_assignment
             )
 
-            # Send real-time location update
-            send_location_update(request.user, location)
+            record_movement(
+                request.user.id,
+                current_assignment.id if current_assignment else None,
+                previous,
+                previous_at,
+                latitude,
+                longitude,
+                accuracy
+            )
+
+            check_location(
+                request.user, latitude, longitude,
+                assignment_id=str(current_assignment.id) if current_assignment else None,
+                client_position=(current_assignment.client.latitude, current_assignment.client.longitude) if current_assignment else None,
+                on_site=bool(current_assignment) and current_assignment.status == 'in_progress'
+            )
+
+        # Broadcast after commit so the transaction is not held open on Redis
+        send_location_update(request.user, location)
+        presence.touch_agent(request.user.id)
 
         return Response({'message': 'Location updated successfully'})
 
@@ -349,6 +457,282 @@ def update_agent_location(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def update_agent_location_batch(request):
+    """Store a batch of queued positions ({"points": [{latitude, longitude, accuracy, timestamp}, ...]})"""
+    if request.user.role != 'agent':
+        return Response(
+            {'error': 'Only agents can upload locations'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    current_assignment = active_assignment(request.user.id)
+
+    try:
+        result = store_location_batch(
+            request.user,
+            request.data.get('points'),
+            assignment_id=current_assignment.id if current_assignment else None,
+            assignment_since=current_assignment.assigned_at if current_assignment else None
+        )
+    except BatchError as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    latest = result['latest']
+    if latest:
+        send_location_update(
+            request.user,
+            Point(latest['longitude'], latest['latitude']),
+            datetime.fromtimestamp(latest['timestamp'] / 1000, tz=dt_timezone.utc)
+        )
+    presence.touch_agent(request.user.id)
+
+    return Response({
+        'accepted': result['accepted'],
+        'rejected': result['rejected'],
+        'current_location_updated': latest is not None,
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def presence_status(request):
+    """Online agents and per-node WebSocket connection counts"""
+    if request.user.role != 'manager':
+        return Response(
+            {'error': 'Permission denied'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    online_ids = presence.online_agent_ids()
+    if online_ids is None:
+        return Response(
+            {'error': 'Presence tracking unavailable'}, 
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+    return Response({
+        'online_agents': sorted(online_ids),
+        'nodes': presence.node_connection_counts(),
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@read_replica
+def location_history_list(request):
+    """Paginated location history; managers may filter by agent, agents see their own"""
+    queryset = LocationHistory.objects.only('id', 'agent_id', 'assignment_id', 'location', 'accuracy', 'timestamp')
+
+    try:
+        if request.user.role != 'manager':
+            queryset = queryset.filter(agent=request.user)
+        elif request.GET.get('agent_id'):
+            queryset = queryset.filter(agent_id=request.GET['agent_id'])
+
+        if request.GET.get('assignment_id'):
+            queryset = queryset.filter(assignment_id=request.GET['assignment_id'])
+
+        paginator = EstimatedCountPagination()
+        page = paginator.paginate_queryset(queryset, request)
+    except ValidationError:
+        return Response(
+            {'error': 'Invalid filter'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return paginator.get_paginated_response([{
+        'id': str(point.id),
+        'agent_id': str(point.agent_id),
+        'assignment_id': str(point.assignment_id) if point.assignment_id else None,
+        'latitude': point.location.y,
+        'longitude': point.location.x,
+        'accuracy': point.accuracy,
+        'timestamp': point.timestamp.isoformat(),
+    } for point in page])
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def notification_list(request):
+    """Paginated notifications for the current user (?unread=1 for unread only)"""
+    queryset = NotificationLog.objects.filter(recipient=request.user)
+    if request.GET.get('unread'):
+        queryset = queryset.filter(is_read=False)
+
+    paginator = EstimatedCountPagination()
+    page = paginator.paginate_queryset(queryset, request)
+
+    return paginator.get_paginated_response([{
+        'id': str(notification.id),
+        'notification_type': notification.notification_type,
+        'title': notification.title,
+        'message': notification.message,
+        'is_read': notification.is_read,
+        'assignment_id': str(notification.assignment_id) if notification.assignment_id else None,
+        'created_at': notification.created_at.isoformat(),
+    } for notification in page])
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@read_replica
+def map_markers(request):
+    """Clustered client and agent markers inside ?bbox=west,south,east,north at ?zoom="""
+    if request.user.role != 'manager':
+        return Response(
+            {'error': 'Permission denied'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    try:
+        bbox = maps.parse_bbox(request.query_params.get('bbox', ''))
+        zoom = maps.parse_zoom(request.query_params.get('zoom', ''))
+    except (ValueError, TypeError):
+        return Response(
+            {'error': 'bbox and zoom are required'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    clients = maps.cluster_markers(
+        Client.objects.filter(is_active=True), 'location', bbox, zoom,
+        extra={'priority': Max('priority')}
+    )
+    agents = maps.cluster_markers(
+        User.objects.filter(role='agent', current_location__isnull=False), 'current_location', bbox, zoom
+    )
+
+    # Individual agent markers get a name and status (one query for the visible ones)
+    single = {marker['id']: marker for marker in agents if 'id' in marker}
+    if single:
+        online_ids = presence.online_agent_ids()
+        busy = Assignment.objects.filter(agent=OuterRef('pk'), status__in=['assigned', 'in_progress'])
+        details = User.objects.filter(id__in=single).annotate(busy=Exists(busy))
+        for agent in details:
+            single[str(agent.id)].update({
+                'name': agent.get_full_name() or agent.username,
+                'busy': agent.busy,
+                'is_online': agent.is_active_agent if online_ids is None else str(agent.id) in online_ids,
+            })
+
+    return Response({'zoom': zoom, 'clients': clients, 'agents': agents})
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@read_replica
+def client_tile(request, z, x, y):
+    """Clustered clients as a Mapbox vector tile"""
+    if request.user.role != 'manager':
+        return Response(
+            {'error': 'Permission denied'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    if z > maps.MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return Response(
+            {'error': 'Invalid tile'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return HttpResponse(maps.client_tile(z, x, y), content_type='application/vnd.mapbox-vector-tile')
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@read_replica
+def location_heatmap(request):
+    """Agent time per grid cell over ?start=&end= (ISO, default last 7 days), optionally within ?bbox="""
+    if request.user.role != 'manager':
+        return Response(
+            {'error': 'Permission denied'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    try:
+        start, end = analytics.parse_range(request.query_params.get('start'), request.query_params.get('end'))
+        bbox = request.query_params.get('bbox')
+        bbox = maps.parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    return Response({
+        'start': start,
+        'end': end,
+        'cell_degrees': analytics.cell_degrees(),
+        'cells': analytics.heatmap(start, end, bbox),
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@read_replica
+def coverage_gaps(request):
+    """Grid cells with clients but (almost) no agent time over ?start=&end="""
+    if request.user.role != 'manager':
+        return Response(
+            {'error': 'Permission denied'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    try:
+        start, end = analytics.parse_range(request.query_params.get('start'), request.query_params.get('end'))
+        min_seconds = float(request.query_params.get('min_seconds', 0))
+        limit = min(int(request.query_params.get('limit', 100)), 1000)
+    except ValueError as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    report = analytics.coverage_gaps(start, end, min_seconds=min_seconds, limit=limit)
+    return Response(dict(report, start=start, end=end))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@read_replica
+def mileage_report(request):
+    """Kilometers travelled per agent per day between ?start= and ?end= (dates, default last 30 days)"""
+    try:
+        end = parse_date(request.query_params.get('end', '')) or timezone.localdate()
+        start = parse_date(request.query_params.get('start', '')) or end - timedelta(days=30)
+    except ValueError:
+        return Response(
+            {'error': 'Invalid date'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    mileage = AgentMileage.objects.filter(date__gte=start, date__lte=end).select_related('agent')
+    if request.user.role == 'manager':
+        agent_id = request.query_params.get('agent_id')
+        if agent_id:
+            try:
+                agent_id = uuid.UUID(agent_id)
+            except ValueError:
+                return Response(
+                    {'error': 'Invalid agent_id'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            mileage = mileage.filter(agent_id=agent_id)
+    else:
+        mileage = mileage.filter(agent=request.user)
+
+    agents = {}
+    for row in mileage.order_by('agent_id', 'date'):
+        entry = agents.setdefault(str(row.agent_id), {
+            'agent_id': str(row.agent_id),
+            'agent_name': row.agent.get_full_name() or row.agent.username,
+            'total_km': 0.0,
+            'days': [],
+        })
+        entry['total_km'] += row.distance_km
+        entry['days'].append({'date': row.date, 'distance_km': round(row.distance_km, 3)})
+
+    for entry in agents.values():
+        entry['total_km'] = round(entry['total_km'], 3)
+
+    return Response({'start': start, 'end': end, 'agents': list(agents.values())})
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_route(request):
@@ -371,7 +755,7 @@ def get_route(request):
                 'instructions': ['Follow the route to destination']
             })
 
-        url = "https://api.openrouteservice.org/v2/directions/driving-car"
+        url = settings.OPENROUTESERVICE_URL
         headers = {
             'Authorization': api_key,
             'Content-Type': 'application/json'
@@ -383,7 +767,8 @@ def get_route(request):
             'instructions': True
         }
 
-        response = requests.post(url, json=data, headers=headers, timeout=10)
+        with metrics.timer(metrics.ROUTING_SECONDS, provider='openrouteservice'):
+            response = requests.post(url, json=data, headers=headers, timeout=10)
 
         if response.status_code == 200:
             route_data = response.json()
@@ -410,77 +795,7 @@ def get_route(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
-def send_assignment_notification(assignment):
-    """Send real-time notification for new assignment"""
-    channel_layer = get_channel_layer()
-
-    notification_data = {
-        'type': 'assignment_notification',
-        'assignment_id': str(assignment.id),
-        'client_name': assignment.client.name,
-        'client_address': assignment.client.address,
-        'client_phone': assignment.client.phone,
-        'priority': assignment.client.get_priority_display(),
-        'latitude': assignment.client.latitude,
-        'longitude': assignment.client.longitude,
-        'message': f'New assignment: {assignment.client.name}'
-    }
-
-    # Send to specific agent
-    async_to_sync(channel_layer.group_send)(
-        f'agent_{assignment.agent.id}',
-        {
-            'type': 'send_notification',
-            'data': notification_data
-        }
-    )
-
-    # Send to all managers
-    managers = User.objects.filter(role='manager')
-    for manager in managers:
-        async_to_sync(channel_layer.group_send)(
-            f'manager_{manager.id}',
-            {
-                'type': 'send_notification',
-                'data': notification_data
-            }
-        )
-
-def send_assignment_update(assignment):
-    """Send real-time update for assignment status change"""
-    channel_layer = get_channel_layer()
-
-    update_data = {
-        'type': 'assignment_update',
-        'assignment_id': str(assignment.id),
-        'status': assignment.status,
-        'status_display': assignment.get_status_display(),
-        'agent_name': assignment.agent.username,
-        'client_name': assignment.client.name,
-        'message': f'Assignment {assignment.get_status_display()}: {assignment.client.name}'
-    }
-
-    # Send to agent
-    async_to_sync(channel_layer.group_send)(
-        f'agent_{assignment.agent.id}',
-        {
-            'type': 'send_notification',
-            'data': update_data
-        }
-    )
-
-    # Send to all managers
-    managers = User.objects.filter(role='manager')
-    for manager in managers:
-        async_to_sync(channel_layer.group_send)(
-            f'manager_{manager.id}',
-            {
-                'type': 'send_notification',
-                'data': update_data
-            }
-        )
-
-def send_location_update(agent, location):
+def send_location_update(agent, location, timestamp=None):
     """Send real-time location update"""
     channel_layer = get_channel_layer()
 
@@ -490,16 +805,21 @@ def send_location_update(agent, location):
         'agent_name': agent.username,
         'latitude': location.y,
         'longitude': location.x,
-        'timestamp': timezone.now().isoformat()
+        'timestamp': (timestamp or timezone.now()).isoformat()
     }
 
     # Send to all managers
-    managers = User.objects.filter(role='manager')
-    for manager in managers:
+    with metrics.timer(metrics.GROUP_SEND_SECONDS, source='rest_location'):
         async_to_sync(channel_layer.group_send)(
-            f'manager_{manager.id}',
+            'managers',
             {
                 'type': 'send_notification',
                 'data': location_data
             }
         )
+
+def metrics_endpoint(request):
+    """Prometheus scrape endpoint, served only to METRICS_ALLOWED_IPS"""
+    if not metrics.metrics_enabled() or request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,181 @@
+"""
+In-memory workload model for balancing assignments across agents.
+
+Each agent's load is the work booked for them today: the on-site duration
+(actual, else estimated, else WORKLOAD_DEFAULT_DURATION_MINUTES) plus travel
+time at WORKLOAD_TRAVEL_SPEED_KMH for every assignment given out today. The
+model is loaded from the database once per day (and every WORKLOAD_REFRESH
+seconds) and updated incrementally as assignments are created, so choosing
+the agent that would finish a new job earliest - the greedy rule for keeping
+the makespan across agents low - is one vectorized pass over a few NumPy
+arrays.
+"""
+import threading
+import time
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .geo import haversine_km
+from .territories import within_scope
+
+def travel_seconds(distance_km):
+    return distance_km / getattr(settings, 'WORKLOAD_TRAVEL_SPEED_KMH', 25) * 3600
+
+def default_duration_seconds():
+    return getattr(settings, 'WORKLOAD_DEFAULT_DURATION_MINUTES', 30) * 60
+
+def capacity_seconds():
+    """Work an agent may have booked today before no more is assigned to them"""
+    from . import live_settings
+
+    return live_settings.get('WORKLOAD_DAILY_CAPACITY_HOURS', 10) * 3600
+
+class WorkloadModel:
+    """Per-process booked work for every active agent"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = {}
+        self.agent_ids = []
+        self.lat = np.empty(0)
+        self.lng = np.empty(0)
+        self.load_seconds = np.empty(0)
+        self.busy = np.empty(0, dtype=bool)
+        self.zone = np.empty(0, dtype=int)
+        self.loaded_at = 0.0
+        self.loaded_for = None
+
+    def ensure_loaded(self):
+        today = timezone.localdate()
+        stale = time.monotonic() - self.loaded_at > getattr(settings, 'WORKLOAD_REFRESH', 60)
+        if stale or self.loaded_for != today:
+            self.load(today)
+
+    def load(self, today=None):
+        from .models import Assignment, User
+
+        today = today or timezone.localdate()
+        agents = list(User.objects.filter(
+            role='agent', is_active=True, is_active_agent=True
+        ).values_list('id', 'current_location', 'zone_id'))
+
+        index = {str(agent_id): i for i, (agent_id, _, _) in enumerate(agents)}
+        lat = np.array([loc.y if loc else np.nan for _, loc, _ in agents], dtype=float)
+        lng = np.array([loc.x if loc else np.nan for _, loc, _ in agents], dtype=float)
+        zone = np.array([zone_id if zone_id is not None else -1 for _, _, zone_id in agents], dtype=int)
+        load_seconds = np.zeros(len(agents))
+        busy = np.zeros(len(agents), dtype=bool)
+
+        todays = Assignment.objects.filter(assigned_at__date=today).exclude(status='cancelled').values_list(
+            'agent_id', 'status', 'actual_duration', 'estimated_duration', 'distance_to_client'
+        )
+        default = default_duration_seconds()
+        for agent_id, status, actual, estimated, distance in todays:
+            i = index.get(str(agent_id))
+            if i is None:
+                continue
+            duration = actual or estimated
+            load_seconds[i] += (duration.total_seconds() if duration else default) + travel_seconds(distance or 0)
+            if status in ('assigned', 'in_progress'):
+                busy[i] = True
+
+        with self.lock:
+            self.index = index
+            self.agent_ids = [str(agent_id) for agent_id, _, _ in agents]
+            self.lat, self.lng, self.zone = lat, lng, zone
+            self.load_seconds, self.busy = load_seconds, busy
+            self.loaded_at = time.monotonic()
+            self.loaded_for = today
+
+    def agent_load(self, agent_id):
+        """Seconds of work booked today for an agent (0 if unknown)"""
+        self.ensure_loaded()
+        i = self.index.get(str(agent_id))
+        return float(self.load_seconds[i]) if i is not None else 0.0
+
+    def position(self, agent_id):
+        """(lat, lng) the model has for an agent, or None (e.g. dropped by a reload)"""
+        i = self.index.get(str(agent_id))
+        if i is None or np.isnan(self.lat[i]):
+            return None
+        return float(self.lat[i]), float(self.lng[i])
+
+    def record_assignment(self, agent_id, duration_seconds, distance_km):
+        """Book a new assignment against an agent"""
+        with self.lock:
+            i = self.index.get(str(agent_id))
+            if i is None:
+                return
+            self.load_seconds[i] += (duration_seconds or default_duration_seconds()) + travel_seconds(distance_km or 0)
+            self.busy[i] = True
+
+    def record_free(self, agent_id):
+        with self.lock:
+            i = self.index.get(str(agent_id))
+            if i is not None:
+                self.busy[i] = False
+
+    def plan(self, clients, policy='balanced', allowed=None):
+        """Pair queued clients with free agents; returns [(agent_id, client_id)].
+
+        clients is a list of (client_id, lat, lng, zone_id) in the
+        order they should be served. 'balanced' gives each client to the agent
+        that would finish it earliest, 'priority' to the nearest free agent,
+        and 'closest' lets the least-loaded agents pick their nearest client
+        first. Clients are matched within their territory and its neighbours
+        when a free agent is there, otherwise across the whole city. Every
+        agent receives at most one client (an agent can only hold one active
+        assignment), and agents already booked up to capacity_seconds() get
+        none.
+        """
+        self.ensure_loaded()
+        capacity = capacity_seconds()
+        with self.lock:
+            free = ~self.busy & ~np.isnan(self.lat) & (self.load_seconds < capacity)
+            if allowed is not None:
+                free &= np.fromiter((agent_id in allowed for agent_id in self.agent_ids), bool, len(self.agent_ids))
+            load_seconds = self.load_seconds.copy()
+            lat, lng, zone, agent_ids = self.lat, self.lng, self.zone, self.agent_ids
+
+        pairs = []
+        if policy == 'closest':
+            client_lat = np.array([c[1] for c in clients], dtype=float)
+            client_lng = np.array([c[2] for c in clients], dtype=float)
+            open_clients = np.ones(len(clients), dtype=bool)
+            client_zone = np.array([c[3] if c[3] is not None else -1 for c in clients], dtype=int)
+            for i in sorted(np.flatnonzero(free), key=lambda i: load_seconds[i]):
+                remaining = np.flatnonzero(open_clients)
+                if not len(remaining):
+                    break
+                remaining = within_scope(remaining, client_zone, zone[i])
+                distance = haversine_km(lat[i], lng[i], client_lat[remaining], client_lng[remaining])
+                best = remaining[np.argmin(distance)]
+                open_clients[best] = False
+                pairs.append((agent_ids[i], clients[best][0]))
+            return pairs
+
+        for client_id, client_lat, client_lng, zone_id in clients:
+            candidates = np.flatnonzero(free)
+            if not len(candidates):
+                break
+            candidates = within_scope(candidates, zone, zone_id)
+            distance = haversine_km(client_lat, client_lng, lat[candidates], lng[candidates])
+            if policy == 'balanced':
+                # The job's own duration is the same for every agent, so it drops out
+                cost = load_seconds[candidates] + travel_seconds(distance)
+            else:
+                cost = distance
+            best = candidates[np.argmin(cost)]
+            free[best] = False
+            pairs.append((agent_ids[best], client_id))
+        return pairs
+
+workload = WorkloadModel()
+
+def record_assignment(assignment):
+    """Book an assignment in this process's workload model once it commits"""
+    duration = assignment.estimated_duration.total_seconds() if assignment.estimated_duration else None
+    transaction.on_commit(lambda: workload.record_assignment(
+        assignment.agent_id, duration, assignment.distance_to_client
+    ))